@@ -0,0 +1,673 @@
+"""
+Storage Backends Module
+
+This module runs the same product feed queries against different ways of
+storing the catalog, so they can be compared on equal terms:
+
+- "jsonl": the catalog held in memory and queried through its indexes,
+  the way the server answers /api/products
+- "jsonl-scan": the product list filtered by apply_filters and sorted by
+  the sort functions in filter.py, without any index
+- "postgres": a PostgreSQL table with an index on each filtered and sorted
+  column (needs the optional `psycopg2` package and a running server)
+- "mongo": a MongoDB collection with the same indexes (needs the optional
+  `pymongo` package and a running server)
+
+Every backend is loaded with the same products and answers a query -
+filters, a sort order and a page - with the product ids on the page and
+the total number of matches, so their answers can be checked against each
+other. Products with equal sort keys are kept in catalog order by every
+backend, as the feed does.
+
+A backend whose driver isn't installed, or whose server can't be reached,
+raises BackendUnavailable when it is created and is left out of the run.
+
+run_benchmarks() times a fixed mix of queries (see build_query_mix) on
+each backend and returns a report that can be saved as JSON; see
+`python benchmark.py backends --help`.
+"""
+
+import json
+import math
+import os
+import time
+from collections import Counter
+from itertools import islice, product
+
+import filter as filter_module
+from catalog import Catalog
+from product_index import SORT_ORDERS
+from query_planner import Exclude
+
+try:
+    import psycopg2
+    import psycopg2.extras
+except ImportError:
+    psycopg2 = None
+
+try:
+    import pymongo
+    import pymongo.errors
+except ImportError:
+    pymongo = None
+
+
+# Maps apply_filters argument -> stored field, for the categorical filters
+FILTER_FIELDS = {"color": "color", "brand": "designer", "gender": "gender"}
+
+# Maps sort order -> (field, direction) pairs to order the rows by, ending
+# with the catalog position so that ties come out in catalog order
+SORT_KEYS = {
+    None: [("row_id", 1)],
+    "price_low_to_high": [("effective_price", 1), ("row_id", 1)],
+    "price_high_to_low": [("effective_price", -1), ("row_id", 1)],
+    "popularity": [("item_score", -1), ("row_id", 1)],
+}
+
+# Rows sent to a database per insert
+LOAD_BATCH_SIZE = 10000
+
+
+class BackendUnavailable(Exception):
+    """Raised when a backend's driver isn't installed or its server can't be reached"""
+
+
+class JsonlBackend:
+    """
+    The in-memory catalog, queried through its indexes like the server does.
+
+    Attributes:
+        name (str): Name of the backend in reports
+        filename (str): Path to the catalog file the products came from
+        catalog (Catalog): The loaded catalog (None until load() is called)
+    """
+
+    name = "jsonl"
+
+    def __init__(self, filename="data.jsonl"):
+        """
+        Args:
+            filename (str): Path to the catalog file the products came from,
+                for the storage size (default: "data.jsonl")
+        """
+        self.filename = filename
+        self.catalog = None
+
+    def load(self, products):
+        """
+        Build the catalog and its indexes.
+
+        Args:
+            products (list): Product dictionaries to load
+        """
+        self.catalog = Catalog(products, self.filename, 0, 0, 1)
+
+    def query(self, filters, sort_by, offset, limit):
+        """
+        Find one page of the products matching some filters.
+
+        Args:
+            filters (dict): Arguments for filter.apply_filters
+            sort_by (str): One of SORT_ORDERS, or None for catalog order
+            offset (int): Number of matching products to skip
+            limit (int): Maximum number of products to return
+
+        Returns:
+            tuple: (product ids on the page, total number of matches)
+        """
+        index = self.catalog.index
+        row_ids = filter_module.filter_page_row_ids(index, sort_by, offset, limit, **filters)
+        if row_ids is None:
+            row_ids = index.sort_row_ids(
+                filter_module.filter_row_ids(index, **filters), sort_by, offset, limit
+            )
+        total, _ = filter_module.count_matches(index, **filters)
+        products = self.catalog.products
+        encoded_products = self.catalog.encoded_products
+        # Fetch each product's JSON too, as the databases return theirs
+        page = [(products[row_id]["product_id"], encoded_products[row_id]) for row_id in row_ids]
+        return [product_id for product_id, _ in page], total
+
+    def storage_bytes(self):
+        """
+        Returns:
+            int: Size of the catalog file, or None if it doesn't exist
+        """
+        try:
+            return os.path.getsize(self.filename)
+        except OSError:
+            return None
+
+    def close(self):
+        self.catalog = None
+
+
+class JsonlScanBackend(JsonlBackend):
+    """
+    The product list filtered and sorted by the functions in filter.py
+    without an index, as a baseline for the indexed catalog.
+    """
+
+    name = "jsonl-scan"
+
+    def load(self, products):
+        self.products = list(products)
+
+    def query(self, filters, sort_by, offset, limit):
+        matches = filter_module.apply_filters(self.products, **filters)
+        if sort_by == "price_low_to_high":
+            page = filter_module.sort_by_price_low_to_high(matches, offset, limit)
+        elif sort_by == "price_high_to_low":
+            page = filter_module.sort_by_price_high_to_low(matches, offset, limit)
+        elif sort_by == "popularity":
+            page = filter_module.sort_by_popularity(matches, offset, limit)
+        else:
+            page = matches[offset:offset + limit]
+        return [product["product_id"] for product in page], len(matches)
+
+    def close(self):
+        self.products = None
+
+
+def _stored_fields(row_id, product):
+    # The fields the databases filter and sort on, plus the whole product
+    return {
+        "row_id": row_id,
+        "product_id": product["product_id"],
+        "color": product.get("color"),
+        "designer": product.get("designer"),
+        "gender": product.get("gender"),
+        "on_sale": product["on_sale"],
+        "effective_price": filter_module.get_effective_price(product),
+        "item_score": product["item_score"],
+        "data": json.dumps(product),
+    }
+
+
+def _iter_batches(products):
+    rows = (_stored_fields(row_id, product) for row_id, product in enumerate(products))
+    while True:
+        batch = list(islice(rows, LOAD_BATCH_SIZE))
+        if not batch:
+            return
+        yield batch
+
+
+def sql_where(filters):
+    """
+    Build a SQL WHERE condition matching the same products as apply_filters.
+
+    Args:
+        filters (dict): Arguments for filter.apply_filters
+
+    Returns:
+        tuple: (condition, parameters) with %s placeholders for psycopg2
+    """
+    conditions = []
+    parameters = []
+    for name, field in FILTER_FIELDS.items():
+        value = filters.get(name)
+        if value is None:
+            continue
+        if isinstance(value, Exclude):
+            # Products without a value aren't excluded, as in apply_filters
+            conditions.append(f"({field} IS NULL OR {field} <> ALL(%s))")
+            parameters.append(list(value.values))
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            conditions.append(f"{field} = ANY(%s)")
+            parameters.append(list(value))
+        else:
+            conditions.append(f"{field} = %s")
+            parameters.append(value)
+    if filters.get("on_sale") is not None:
+        conditions.append("on_sale = %s")
+        parameters.append(filters["on_sale"])
+    if filters.get("price_range") is not None:
+        conditions.append("effective_price BETWEEN %s AND %s")
+        parameters.extend(filters["price_range"])
+    return " AND ".join(conditions) or "TRUE", parameters
+
+
+def sql_order(sort_by):
+    """
+    Build a SQL ORDER BY list for a sort order.
+
+    Args:
+        sort_by (str): One of SORT_ORDERS, or None for catalog order
+
+    Returns:
+        str: Comma separated columns, each with ASC or DESC
+    """
+    return ", ".join(
+        f"{field} {'ASC' if direction == 1 else 'DESC'}" for field, direction in SORT_KEYS[sort_by]
+    )
+
+
+def mongo_filter(filters):
+    """
+    Build a MongoDB query document matching the same products as apply_filters.
+
+    Args:
+        filters (dict): Arguments for filter.apply_filters
+
+    Returns:
+        dict: Query document for find() and count_documents()
+    """
+    query = {}
+    for name, field in FILTER_FIELDS.items():
+        value = filters.get(name)
+        if value is None:
+            continue
+        if isinstance(value, Exclude):
+            # $nin matches documents without the field, as apply_filters does
+            query[field] = {"$nin": list(value.values)}
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            query[field] = {"$in": list(value)}
+        else:
+            query[field] = value
+    if filters.get("on_sale") is not None:
+        query["on_sale"] = filters["on_sale"]
+    if filters.get("price_range") is not None:
+        min_price, max_price = filters["price_range"]
+        query["effective_price"] = {"$gte": min_price, "$lte": max_price}
+    return query
+
+
+class PostgresBackend:
+    """
+    A PostgreSQL table of the products, with an index per filtered column.
+
+    The table is created by load() and dropped by close(), so the catalog
+    tables of the database are left alone.
+
+    Attributes:
+        name (str): Name of the backend in reports
+        table (str): Name of the table the products are loaded into
+        connection: The psycopg2 connection
+    """
+
+    name = "postgres"
+
+    def __init__(self, dsn="", table="benchmark_products"):
+        """
+        Args:
+            dsn (str): libpq connection string; an empty string uses the
+                PGHOST, PGUSER, PGDATABASE, ... environment variables
+                (default: "")
+            table (str): Table to load the products into
+                (default: "benchmark_products")
+
+        Raises:
+            BackendUnavailable: If psycopg2 isn't installed or the server
+                can't be connected to
+        """
+        if psycopg2 is None:
+            raise BackendUnavailable("psycopg2 is not installed")
+        self.table = table
+        try:
+            self.connection = psycopg2.connect(dsn, connect_timeout=5)
+        except psycopg2.Error as error:
+            raise BackendUnavailable(f"can't connect to PostgreSQL: {error}".strip())
+
+    def load(self, products):
+        """
+        Create the table, insert the products and index them.
+
+        Args:
+            products (list): Product dictionaries to load
+        """
+        table = self.table
+        with self.connection, self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {table}")
+            cursor.execute(
+                f"""
+                CREATE TABLE {table} (
+                    row_id integer PRIMARY KEY,
+                    product_id bigint,
+                    color text,
+                    designer text,
+                    gender text,
+                    on_sale boolean,
+                    effective_price float8,
+                    item_score float8,
+                    data text
+                )
+                """
+            )
+            for batch in _iter_batches(products):
+                psycopg2.extras.execute_values(
+                    cursor,
+                    f"INSERT INTO {table} VALUES %s",
+                    batch,
+                    template="(%(row_id)s, %(product_id)s, %(color)s, %(designer)s, "
+                    "%(gender)s, %(on_sale)s, %(effective_price)s, %(item_score)s, %(data)s)",
+                    page_size=1000,
+                )
+            # Indexes are quicker to build once the rows are in
+            for field in FILTER_FIELDS.values():
+                cursor.execute(f"CREATE INDEX ON {table} ({field})")
+            cursor.execute(f"CREATE INDEX ON {table} (on_sale)")
+            for sort_by in SORT_ORDERS:
+                cursor.execute(f"CREATE INDEX ON {table} ({sql_order(sort_by)})")
+        # ANALYZE can't run inside the transaction above
+        self.connection.autocommit = True
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {table}")
+
+    def query(self, filters, sort_by, offset, limit):
+        """
+        Find one page of the products matching some filters.
+
+        See JsonlBackend.query.
+        """
+        condition, parameters = sql_where(filters)
+        with self.connection.cursor() as cursor:
+            cursor.execute(
+                f"SELECT product_id, data FROM {self.table} WHERE {condition} "
+                f"ORDER BY {sql_order(sort_by)} LIMIT %s OFFSET %s",
+                parameters + [limit, offset],
+            )
+            page = cursor.fetchall()
+            cursor.execute(f"SELECT count(*) FROM {self.table} WHERE {condition}", parameters)
+            (total,) = cursor.fetchone()
+        return [product_id for product_id, _ in page], total
+
+    def storage_bytes(self):
+        """
+        Returns:
+            int: Size of the table and its indexes on disk
+        """
+        with self.connection.cursor() as cursor:
+            cursor.execute("SELECT pg_total_relation_size(%s)", (self.table,))
+            return cursor.fetchone()[0]
+
+    def close(self):
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+        self.connection.close()
+
+
+class MongoBackend:
+    """
+    A MongoDB collection of the products, with an index per filtered field.
+
+    The collection is created by load() and dropped by close().
+
+    Attributes:
+        name (str): Name of the backend in reports
+        client (pymongo.MongoClient): Connection to the server
+        collection (pymongo.collection.Collection): Collection the products
+            are loaded into
+    """
+
+    name = "mongo"
+
+    def __init__(self, uri="mongodb://localhost:27017/", database="benchmark", collection="products"):
+        """
+        Args:
+            uri (str): MongoDB connection string
+                (default: "mongodb://localhost:27017/")
+            database (str): Database to use (default: "benchmark")
+            collection (str): Collection to load the products into
+                (default: "products")
+
+        Raises:
+            BackendUnavailable: If pymongo isn't installed or the server
+                can't be reached
+        """
+        if pymongo is None:
+            raise BackendUnavailable("pymongo is not installed")
+        self.client = pymongo.MongoClient(uri, serverSelectionTimeoutMS=5000)
+        try:
+            self.client.admin.command("ping")
+        except pymongo.errors.PyMongoError as error:
+            self.client.close()
+            raise BackendUnavailable(f"can't connect to MongoDB: {error}")
+        self.collection = self.client[database][collection]
+
+    def load(self, products):
+        """
+        Create the collection, insert the products and index them.
+
+        Args:
+            products (list): Product dictionaries to load
+        """
+        self.collection.drop()
+        for batch in _iter_batches(products):
+            self.collection.insert_many(batch, ordered=False)
+        self.collection.create_index("row_id")
+        for field in FILTER_FIELDS.values():
+            self.collection.create_index(field)
+        self.collection.create_index("on_sale")
+        for sort_by in SORT_ORDERS:
+            self.collection.create_index(SORT_KEYS[sort_by])
+
+    def query(self, filters, sort_by, offset, limit):
+        """
+        Find one page of the products matching some filters.
+
+        See JsonlBackend.query.
+        """
+        query = mongo_filter(filters)
+        page = list(
+            self.collection.find(query, {"_id": 0, "product_id": 1, "data": 1})
+            .sort(SORT_KEYS[sort_by])
+            .skip(offset)
+            .limit(limit)
+        )
+        total = self.collection.count_documents(query)
+        return [document["product_id"] for document in page], total
+
+    def storage_bytes(self):
+        """
+        Returns:
+            int: Size of the collection and its indexes on disk
+        """
+        (stats,) = self.collection.aggregate([{"$collStats": {"storageStats": {}}}])
+        return stats["storageStats"]["storageSize"] + stats["storageStats"]["totalIndexSize"]
+
+    def close(self):
+        self.collection.drop()
+        self.client.close()
+
+
+# Backends by name, in the order they are run by default
+BACKENDS = {
+    backend.name: backend
+    for backend in (JsonlBackend, JsonlScanBackend, PostgresBackend, MongoBackend)
+}
+
+
+def build_query_mix(products, pages=(1, 10, 100)):
+    """
+    Build the fixed mix of queries to time.
+
+    The filter values are the most common ones in the products, so the mix
+    is the same every time for the same catalog and every query has
+    matches to sort and page through. Every filter set is run with each
+    sort order and on each page.
+
+    Args:
+        products (list): Product dictionaries that will be queried
+        pages (iterable): Page numbers to fetch (default: 1, 10 and 100)
+
+    Returns:
+        list: Queries, as dictionaries with "name", "filters" (arguments
+        for filter.apply_filters), "sort_by" and "page"
+    """
+
+    def most_common(field, count=1):
+        counts = Counter(product.get(field) for product in products)
+        counts.pop(None, None)
+        return [value for value, _ in counts.most_common(count)]
+
+    colors = most_common("color", 2)
+    (brand,) = most_common("designer")
+    (gender,) = most_common("gender")
+    filter_sets = [
+        ("none", {}),
+        ("color", {"color": colors[0]}),
+        ("brand", {"brand": brand}),
+        ("gender", {"gender": gender}),
+        ("on_sale", {"on_sale": True}),
+        ("price", {"price_range": (100, 500)}),
+        ("color+brand", {"color": colors[0], "brand": brand}),
+        (
+            "colors+gender+on_sale+price",
+            {"color": colors, "gender": gender, "on_sale": True, "price_range": (100, 500)},
+        ),
+    ]
+    return [
+        {
+            "name": f"{label}/{sort_by or 'catalog'}/page {page}",
+            "filters": filters,
+            "sort_by": sort_by,
+            "page": page,
+        }
+        for (label, filters), sort_by, page in product(filter_sets, (None,) + SORT_ORDERS, pages)
+    ]
+
+
+def rss_bytes():
+    """
+    Get the memory the process is using.
+
+    Returns:
+        int: Resident set size in bytes, or None where /proc isn't available
+    """
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def latency_percentiles(seconds):
+    """
+    Summarize latencies by their percentiles.
+
+    Args:
+        seconds (list): Latencies in seconds
+
+    Returns:
+        dict: "p50", "p95", "p99" and "max" latency in milliseconds
+        (nearest rank), or None for each if there are no latencies
+    """
+    ordered = sorted(seconds)
+    summary = {}
+    for name, percentile in (("p50", 50), ("p95", 95), ("p99", 99), ("max", 100)):
+        if not ordered:
+            summary[name] = None
+            continue
+        rank = max(math.ceil(percentile / 100 * len(ordered)), 1)
+        summary[name] = round(ordered[rank - 1] * 1000, 3)
+    return summary
+
+
+def benchmark_backend(backend, products, queries, repeat, items_per_page):
+    """
+    Load products into a backend and time every query.
+
+    Each query is run once right after loading (cold), then every query is
+    run again, in turn, `repeat` times (warm). Databases may still hold
+    the freshly loaded pages in memory, so a cold run is the first run of
+    a query rather than a run against an empty cache.
+
+    Args:
+        backend: A loaded backend, e.g. a JsonlBackend
+        products (list): Product dictionaries to load
+        queries (list): Queries from build_query_mix
+        repeat (int): Number of warm runs of each query
+        items_per_page (int): Number of products per page
+
+    Returns:
+        tuple: (report dict, answers) where answers maps each query name ->
+        (product ids, total) for checking against other backends
+    """
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    backend.load(products)
+    load_seconds = time.perf_counter() - start
+    rss_after = rss_bytes()
+
+    def run(query):
+        offset = (query["page"] - 1) * items_per_page
+        start = time.perf_counter()
+        answer = backend.query(query["filters"], query["sort_by"], offset, items_per_page)
+        return time.perf_counter() - start, answer
+
+    answers = {}
+    cold = {}
+    for query in queries:
+        cold[query["name"]], answers[query["name"]] = run(query)
+    warm = {query["name"]: [] for query in queries}
+    for _ in range(repeat):
+        for query in queries:
+            seconds, _ = run(query)
+            warm[query["name"]].append(seconds)
+
+    warm_seconds = [seconds for timings in warm.values() for seconds in timings]
+    report = {
+        "status": "ok",
+        "load_seconds": round(load_seconds, 3),
+        "memory": {
+            "rss_bytes": None if rss_before is None else rss_after - rss_before,
+            "storage_bytes": backend.storage_bytes(),
+        },
+        "cold_ms": latency_percentiles(list(cold.values())),
+        "warm_ms": latency_percentiles(warm_seconds),
+        "throughput_qps": (
+            round(len(warm_seconds) / sum(warm_seconds), 1) if warm_seconds else None
+        ),
+        "queries": {
+            query["name"]: {
+                "cold_ms": round(cold[query["name"]] * 1000, 3),
+                "warm_ms": latency_percentiles(warm[query["name"]]),
+                "total": answers[query["name"]][1],
+            }
+            for query in queries
+        },
+    }
+    return report, answers
+
+
+def run_benchmarks(backends, products, queries, repeat=5, items_per_page=50):
+    """
+    Time the same queries on several backends.
+
+    Args:
+        backends (list): (name, factory) pairs, where factory() returns a
+            backend or raises BackendUnavailable
+        products (list): Product dictionaries to load into each backend
+        queries (list): Queries from build_query_mix
+        repeat (int): Number of warm runs of each query (default: 5)
+        items_per_page (int): Number of products per page (default: 50)
+
+    Returns:
+        dict: Maps backend name -> its report (see benchmark_backend), or
+        {"status": "skipped", "reason": ...} if it wasn't available. Each
+        report's "mismatches" lists the queries it answered differently
+        from the first backend that ran, named by "compared_with".
+    """
+    reports = {}
+    expected = None
+    for name, factory in backends:
+        try:
+            backend = factory()
+        except BackendUnavailable as error:
+            reports[name] = {"status": "skipped", "reason": str(error)}
+            continue
+        try:
+            report, answers = benchmark_backend(
+                backend, products, queries, repeat, items_per_page
+            )
+        finally:
+            backend.close()
+        if expected is None:
+            expected = (name, answers)
+        report["compared_with"] = expected[0]
+        report["mismatches"] = [
+            query_name for query_name, answer in answers.items() if expected[1][query_name] != answer
+        ]
+        reports[name] = report
+    return reports
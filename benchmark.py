@@ -0,0 +1,486 @@
+"""
+Benchmarks
+
+This script measures how long the product feed's hot paths take. Each
+benchmark is a subcommand, for example:
+
+    python benchmark.py serialization --data data.jsonl
+
+Run `python benchmark.py --help` to see them all.
+"""
+
+import argparse
+import json
+import statistics
+import sys
+import time
+from itertools import islice
+
+from catalog import CatalogStore
+from pagination import create_pagination_info
+
+
+def time_call(function, repeat):
+    """
+    Time a function over several runs.
+
+    Args:
+        function (callable): Function to call with no arguments
+        repeat (int): Number of times to call it
+
+    Returns:
+        float: Median time per call, in seconds
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def print_comparison(title, rows):
+    """
+    Print before/after timings as a table.
+
+    Args:
+        title (str): Heading for the table
+        rows (list): (label, before_seconds, after_seconds) tuples
+    """
+    print(title)
+    print(f"{'':<16}{'before (ms)':>14}{'after (ms)':>14}{'speedup':>10}")
+    for label, before, after in rows:
+        speedup = before / after if after else float("inf")
+        print(f"{label:<16}{before * 1000:>14.3f}{after * 1000:>14.3f}{speedup:>9.1f}x")
+    print()
+
+
+def benchmark_serialization(args):
+    """Compare encoding responses from dicts with joining pre-encoded bytes."""
+    from server import encode_products_response, iter_jsonl_chunks
+
+    catalog = CatalogStore(args.data).get()
+    products = catalog.products
+    page_rows = range(min(50, len(products)))
+    pagination_info = create_pagination_info(products, 1, 50)
+
+    def page_before():
+        page = [products[row_id] for row_id in page_rows]
+        return json.dumps({"products": page, "pagination": pagination_info}).encode()
+
+    def page_after():
+        return encode_products_response(
+            catalog.encoded_products, page_rows, pagination_info
+        )
+
+    def dump_before():
+        return "\n".join([json.dumps(product) for product in products]).encode()
+
+    def dump_after():
+        return b"".join(iter_jsonl_chunks(catalog.encoded_products))
+
+    # Both ways must produce the same bytes for the comparison to be fair
+    assert page_before() == page_after()
+    assert dump_before() + b"\n" == dump_after()
+
+    print_comparison(
+        f"Response encoding ({len(products)} products, median of {args.repeat} runs)",
+        [
+            ("50-row page", time_call(page_before, args.repeat), time_call(page_after, args.repeat)),
+            ("full dump", time_call(dump_before, args.repeat), time_call(dump_after, args.repeat)),
+        ],
+    )
+
+
+def benchmark_compression(args):
+    """Compare response sizes and compression time for each Content-Encoding."""
+    import http_compression
+    from server import encode_products_response, iter_jsonl_chunks
+
+    catalog = CatalogStore(args.data).get()
+    page_rows = range(min(50, len(catalog)))
+    pagination_info = create_pagination_info(catalog.products, 1, 50)
+    bodies = [
+        (
+            "50-row page",
+            encode_products_response(catalog.encoded_products, page_rows, pagination_info),
+        ),
+        ("full dump", b"".join(iter_jsonl_chunks(catalog.encoded_products))),
+    ]
+
+    print(f"Response compression ({len(catalog)} products, median of {args.repeat} runs)")
+    print("Cached bodies are compressed once per catalog; this is the cost of a miss.")
+    print(f"{'':<16}{'encoding':<10}{'bytes':>12}{'ratio':>8}{'CPU (ms)':>12}")
+    for label, body in bodies:
+        print(f"{label:<16}{'identity':<10}{len(body):>12}{1:>8.1f}{0:>12.3f}")
+        for encoding in http_compression.COMPRESSORS:
+            compressed = http_compression.compress(body, encoding)
+            seconds = time_call(
+                lambda: http_compression.compress(body, encoding), args.repeat
+            )
+            ratio = len(body) / len(compressed)
+            print(
+                f"{'':<16}{encoding:<10}{len(compressed):>12}{ratio:>8.1f}{seconds * 1000:>12.3f}"
+            )
+    print()
+
+
+def benchmark_loading(args):
+    """Measure catalog load throughput for different numbers of workers."""
+    import os
+
+    import jsonl_loader
+
+    size = os.path.getsize(args.data)
+    rows = len(jsonl_loader.load_jsonl(args.data, workers=1))
+
+    print(f"Catalog loading ({size / 1e6:.1f} MB, {rows} rows, median of {args.repeat} runs)")
+    print(f"{'workers':<10}{'time (s)':>10}{'MB/s':>10}{'rows/s':>12}{'speedup':>10}")
+    serial = None
+    for workers in args.workers:
+        # min_parallel_bytes=0 so the pool is used even for a small file
+        seconds = time_call(
+            lambda: jsonl_loader.load_jsonl(args.data, workers, min_parallel_bytes=0),
+            args.repeat,
+        )
+        if serial is None:
+            serial = seconds
+        print(
+            f"{workers:<10}{seconds:>10.3f}{size / 1e6 / seconds:>10.1f}"
+            f"{rows / seconds:>12.0f}{serial / seconds:>9.1f}x"
+        )
+    print()
+
+
+def read_rows(filename, rows):
+    """
+    Parse the first rows of a catalog file, repeating it if it is shorter.
+
+    Args:
+        filename (str): Path to the catalog file
+        rows (int): Number of products to return
+
+    Returns:
+        list: Product dictionaries, each parsed separately like a real load
+    """
+    products = []
+    while len(products) < rows:
+        # Read the file again from the start until there are enough rows
+        before = len(products)
+        with open(filename, "rb") as file:
+            for line in islice(file, rows - len(products)):
+                if line.strip():
+                    products.append(json.loads(line))
+        if len(products) == before:
+            raise ValueError(f"{filename} has no products")
+    return products
+
+
+def traced_bytes(function):
+    """
+    Measure the memory a function's result holds on to.
+
+    Args:
+        function (callable): Function to call with no arguments
+
+    Returns:
+        tuple: (result, bytes allocated during the call and still in use)
+    """
+    import gc
+    import tracemalloc
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = function()
+        gc.collect()
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, allocated
+
+
+def benchmark_memory(args):
+    """Compare the memory held by dict and compact product representations."""
+    from compact import ColumnarProducts, column_type
+
+    def interned_dicts(rows):
+        products = read_rows(args.data, rows)
+        for name in list(products[0]):
+            if column_type([product[name] for product in products]) == "category":
+                for product in products:
+                    if product[name] is not None:
+                        product[name] = sys.intern(product[name])
+        return products
+
+    print(f"Product memory ({args.data})")
+    print(f"{'rows':<10}{'representation':<22}{'MB':>10}{'bytes/product':>16}{'vs dict':>10}")
+    for rows in args.rows:
+        products, dict_bytes = traced_bytes(lambda: read_rows(args.data, rows))
+        # Only the columns are allocated while tracing; the dicts already exist
+        columnar, columnar_bytes = traced_bytes(lambda: ColumnarProducts(products))
+        del products, columnar
+        _, interned_bytes = traced_bytes(lambda: interned_dicts(rows))
+        for label, allocated in [
+            ("dict", dict_bytes),
+            ("dict, interned values", interned_bytes),
+            ("compact columns", columnar_bytes),
+        ]:
+            print(
+                f"{rows:<10}{label:<22}{allocated / 1e6:>10.1f}"
+                f"{allocated / rows:>16.0f}{allocated / dict_bytes:>9.2f}x"
+            )
+    print()
+
+
+def benchmark_search(args):
+    """Measure text index build time and query latency as the catalog grows."""
+    from text_search import TextIndex, query_terms
+
+    print(f"Text search ({args.data}, median of {args.repeat} runs)")
+    print(
+        f"{'rows':<10}{'build (s)':>10}{'terms':>10}{'index MB':>10}  "
+        f"{'query':<24}{'matches':>10}{'search (ms)':>13}{'ranked (ms)':>13}"
+    )
+    for rows in args.rows:
+        products = read_rows(args.data, rows)
+        start = time.perf_counter()
+        index = TextIndex(products)
+        build_seconds = time.perf_counter() - start
+        # Four bytes per row id, one per count and four per product length
+        index_bytes = 5 * sum(map(len, index.postings.values())) + 4 * len(index)
+        print(
+            f"{rows:<10}{build_seconds:>10.2f}{len(index.postings):>10}"
+            f"{index_bytes / 1e6:>10.1f}"
+        )
+        for query in args.queries:
+            terms = query_terms(query)
+            matches = index.search(terms)
+            search_seconds = time_call(lambda: index.search(terms), args.repeat)
+            ranked_seconds = time_call(
+                lambda: index.rank(terms, index.search(terms)), args.repeat
+            )
+            print(
+                f"{'':<40}  {query:<24}{len(matches):>10}"
+                f"{search_seconds * 1000:>13.2f}{ranked_seconds * 1000:>13.2f}"
+            )
+        del products, index
+    print()
+
+
+def benchmark_facets(args):
+    """Measure facet count build time and latency for a few filter states."""
+    from facets import FacetIndex
+    from filter import count_facets
+    from product_index import ProductIndex
+
+    print(f"Facet counts ({args.data}, median of {args.repeat} runs)")
+    print(
+        f"{'rows':<10}{'build (s)':>10}{'cells':>10}  "
+        f"{'filters':<48}{'first (ms)':>12}{'median (ms)':>13}"
+    )
+    for rows in args.rows:
+        products = read_rows(args.data, rows)
+        index = ProductIndex(products)
+        start = time.perf_counter()
+        facet_index = FacetIndex(index)
+        build_seconds = time.perf_counter() - start
+        print(f"{rows:<10}{build_seconds:>10.2f}{len(facet_index.counts):>10}")
+        first = products[0]
+        filter_states = [
+            {},
+            {"color": first.get("color")},
+            {"color": first.get("color"), "brand": first.get("designer")},
+            {"price_range": (100, 250), "on_sale": True, "gender": first.get("gender")},
+            # Not one of the buckets, so counted from the matching rows
+            {"price_range": (120, 180), "brand": first.get("designer")},
+        ]
+        for filters in filter_states:
+            # The first call also sums the cube over the unfiltered fields
+            start = time.perf_counter()
+            count_facets(facet_index, **filters)
+            first_seconds = time.perf_counter() - start
+            seconds = time_call(lambda: count_facets(facet_index, **filters), args.repeat)
+            label = ", ".join(f"{name}={value}" for name, value in filters.items()) or "none"
+            print(
+                f"{'':<30}  {label[:46]:<48}"
+                f"{first_seconds * 1000:>12.2f}{seconds * 1000:>13.2f}"
+            )
+        del products, index, facet_index
+    print()
+
+
+def benchmark_backends(args):
+    """Time the same query mix on the JSONL catalog, PostgreSQL and MongoDB."""
+    import platform
+
+    import backends
+    from filter import load_products
+
+    products = read_rows(args.data, args.rows) if args.rows else load_products(args.data)
+    queries = backends.build_query_mix(products)
+    factories = {
+        "jsonl": lambda: backends.JsonlBackend(args.data),
+        "jsonl-scan": lambda: backends.JsonlScanBackend(args.data),
+        "postgres": lambda: backends.PostgresBackend(args.postgres_dsn),
+        "mongo": lambda: backends.MongoBackend(args.mongo_uri),
+    }
+    reports = backends.run_benchmarks(
+        [(name, factories[name]) for name in args.backends],
+        products,
+        queries,
+        args.repeat,
+        args.items_per_page,
+    )
+
+    print(
+        f"Backends ({len(products)} products, {len(queries)} queries, "
+        f"{args.repeat} warm runs each)"
+    )
+    print(
+        f"{'backend':<12}{'load (s)':>10}{'cold p50':>10}{'cold p99':>10}"
+        f"{'warm p50':>10}{'warm p95':>10}{'warm p99':>10}{'queries/s':>11}"
+        f"{'RSS MB':>9}{'stored MB':>11}  mismatches"
+    )
+    for name, report in reports.items():
+        if report["status"] != "ok":
+            print(f"{name:<12}skipped: {report['reason']}")
+            continue
+        cold, warm, memory = report["cold_ms"], report["warm_ms"], report["memory"]
+        rss = "-" if memory["rss_bytes"] is None else f"{memory['rss_bytes'] / 1e6:.1f}"
+        stored = "-" if memory["storage_bytes"] is None else f"{memory['storage_bytes'] / 1e6:.1f}"
+        print(
+            f"{name:<12}{report['load_seconds']:>10.2f}{cold['p50']:>10.2f}{cold['p99']:>10.2f}"
+            f"{warm['p50']:>10.2f}{warm['p95']:>10.2f}{warm['p99']:>10.2f}"
+            f"{report['throughput_qps']:>11.1f}{rss:>9}{stored:>11}  {len(report['mismatches'])}"
+        )
+    print("Latencies in ms.")
+
+    if args.output:
+        report = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "data": args.data,
+            "products": len(products),
+            "repeat": args.repeat,
+            "items_per_page": args.items_per_page,
+            "queries": queries,
+            "backends": reports,
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+            file.write("\n")
+        print(f"Report written to {args.output}")
+    print()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the product feed.")
+    parser.add_argument("--data", default="data.jsonl", help="catalog file to use")
+    parser.add_argument("--repeat", type=int, default=20, help="runs per measurement")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    subparsers.add_parser(
+        "serialization", help="per-request JSON encoding, before and after pre-encoding"
+    ).set_defaults(run=benchmark_serialization)
+    subparsers.add_parser(
+        "compression", help="bytes on the wire and compression time per encoding"
+    ).set_defaults(run=benchmark_compression)
+    loading = subparsers.add_parser(
+        "loading", help="catalog load throughput with 1, 2, 4 and 8 worker processes"
+    )
+    loading.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4, 8],
+        help="worker counts to measure (default: 1 2 4 8)",
+    )
+    loading.set_defaults(run=benchmark_loading)
+    memory = subparsers.add_parser(
+        "memory", help="bytes per product as dicts and as compact columns"
+    )
+    memory.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=[100000, 1000000],
+        help="catalog sizes to measure, repeating the file's rows if needed "
+        "(default: 100000 1000000)",
+    )
+    memory.set_defaults(run=benchmark_memory)
+    search = subparsers.add_parser(
+        "search", help="text index build time and query latency by catalog size"
+    )
+    search.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=[10000, 100000, 1000000],
+        help="catalog sizes to measure, repeating the file's rows if needed "
+        "(default: 10000 100000 1000000)",
+    )
+    search.add_argument(
+        "--queries",
+        nargs="+",
+        default=["dress", "rayon dress", "flower brooch italy", "velvet"],
+        help="queries to time",
+    )
+    search.set_defaults(run=benchmark_search)
+    facets = subparsers.add_parser(
+        "facets", help="facet count build time and latency by catalog size"
+    )
+    facets.add_argument(
+        "--rows",
+        type=int,
+        nargs="+",
+        default=[10000, 100000, 1000000],
+        help="catalog sizes to measure, repeating the file's rows if needed "
+        "(default: 10000 100000 1000000)",
+    )
+    facets.set_defaults(run=benchmark_facets)
+    backends = subparsers.add_parser(
+        "backends",
+        help="query latency, throughput and memory of the JSONL catalog, "
+        "PostgreSQL and MongoDB",
+        description="Load the catalog into each backend and time a fixed mix of "
+        "filtered, sorted and paged queries. Backends whose driver isn't installed "
+        "or whose server isn't running are skipped.",
+    )
+    backends.add_argument(
+        "--backends",
+        nargs="+",
+        choices=["jsonl", "jsonl-scan", "postgres", "mongo"],
+        default=["jsonl", "postgres", "mongo"],
+        help="backends to run, in order; answers are checked against the first "
+        "(default: jsonl postgres mongo)",
+    )
+    backends.add_argument(
+        "--rows",
+        type=int,
+        help="catalog size, repeating the file's rows if needed (default: the whole file)",
+    )
+    backends.add_argument(
+        "--items-per-page", type=int, default=50, help="products per page (default: 50)"
+    )
+    backends.add_argument(
+        "--postgres-dsn",
+        default="",
+        help="libpq connection string (default: the PGHOST, PGUSER, ... environment "
+        "variables)",
+    )
+    backends.add_argument(
+        "--mongo-uri",
+        default="mongodb://localhost:27017/",
+        help="MongoDB connection string (default: mongodb://localhost:27017/)",
+    )
+    backends.add_argument("--output", help="file to write the JSON report to")
+    backends.set_defaults(run=benchmark_backends)
+
+    args = parser.parse_args(argv)
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,414 @@
+"""
+Product Catalog Module
+
+This module keeps the product catalog resident in memory so that the server
+does not have to re-parse data.jsonl on every request. The catalog is loaded
+once and only swapped for a fresh copy when the file changes on disk.
+
+After parsing data.jsonl the store can save a snapshot of the catalog (see
+snapshot.py), so the next start-up, or the next reload of an unchanged
+file, maps the snapshot instead of parsing JSON.
+
+Products appended to data.jsonl, and changes logged in data.jsonl.changes
+(see catalog_changes.py), are applied to the current catalog as they
+arrive, rather than loading everything again.
+"""
+
+import json
+import os
+import sys
+import threading
+
+import catalog_changes
+import compact as compact_module
+import filter as filter_module
+import snapshot as snapshot_module
+import text_search
+from facets import FacetIndex
+from product_index import ProductIndex
+from text_search import TextIndex
+
+
+class CatalogError(Exception):
+    """Raised when a data file can't be loaded and there's no catalog to fall back on."""
+
+
+class Catalog:
+    """
+    A snapshot of the products loaded from a data file.
+
+    A Catalog is never modified after it has been built: when the data file
+    changes a brand new Catalog is created and swapped in, so requests that
+    are still holding on to the old one keep seeing consistent data.
+
+    Attributes:
+        products (list): List of product dictionaries (or a read-only
+            sequence of them when loaded from a snapshot or kept compact)
+        index (ProductIndex): Posting lists built over products
+        text_index (TextIndex): Inverted index of the words in the products'
+            descriptions, for search queries
+        facet_index (FacetIndex): Counts of the products by filter value,
+            for facet counts
+        encoded_products (list): Each product's json.dumps() output as
+            bytes, by row id, so responses don't have to encode it again
+        filename (str): Path to the data file the products were loaded from
+        mtime_ns (int): Modification time of the file when it was loaded
+        size (int): Size of the file in bytes when it was loaded
+        version (int): Increases by one every time the catalog is reloaded
+            or updated
+        data_mark (catalog_changes.FileMark): How much of the data file
+            the catalog holds (set by CatalogStore, otherwise None)
+        changes_mark (catalog_changes.FileMark): How much of the change
+            log has been applied (set by CatalogStore, otherwise None)
+    """
+
+    def __init__(self, products, filename, mtime_ns, size, version):
+        self.products = products
+        if isinstance(products, snapshot_module.SnapshotProducts):
+            # Reuse everything the snapshot has already computed
+            snapshot = products.snapshot
+            arrays = snapshot.arrays()
+            if arrays:
+                self.index = ProductIndex.from_arrays(products, arrays, snapshot.metadata)
+            else:
+                self.index = ProductIndex(products)
+            # Snapshots saved before there was a text index don't have one,
+            # and terms from an older stemmer wouldn't match queries
+            text_metadata = snapshot.metadata.get("text") or {}
+            if (
+                arrays
+                and "text.postings" in arrays
+                and text_metadata.get("stemmer") == text_search.STEMMER_VERSION
+            ):
+                self.text_index = TextIndex.from_arrays(
+                    products, arrays, snapshot.metadata["text"]
+                )
+            else:
+                self.text_index = TextIndex(products)
+            self.encoded_products = snapshot.encoded_products()
+        else:
+            self.index = ProductIndex(products)
+            self.text_index = TextIndex(products)
+            self.encoded_products = [
+                json.dumps(product).encode() for product in products
+            ]
+        self.facet_index = FacetIndex(self.index)
+        self.filename = filename
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.version = version
+        self.data_mark = None
+        self.changes_mark = None
+
+    def __len__(self):
+        return len(self.products)
+
+    def is_current(self, stat_result):
+        """
+        Check whether this catalog still matches the file on disk.
+
+        Args:
+            stat_result (os.stat_result): Result of os.stat() on the data file
+
+        Returns:
+            bool: True if the file has not changed since it was loaded
+        """
+        return (
+            stat_result.st_mtime_ns == self.mtime_ns
+            and stat_result.st_size == self.size
+        )
+
+    def apply_changes(self, added, operations, data_mark, changes_mark, version):
+        """
+        Build the catalog with products added, replaced and removed.
+
+        Only the changed products are encoded and indexed; everything else
+        is carried over from this catalog, which isn't modified.
+
+        Args:
+            added (list): Products appended to the data file
+            operations (list): Changes from the change log, applied after
+                the products are added (see catalog_changes.parse_operations)
+            data_mark (catalog_changes.FileMark): How much of the data file
+                the new catalog holds
+            changes_mark (catalog_changes.FileMark): How much of the change
+                log has been applied
+            version (int): Version of the new catalog
+
+        Returns:
+            Catalog: The updated catalog
+        """
+        old_count = len(self.products)
+        row_ids = self.index.row_ids_by_product_id
+        # Rows of products added or deleted (None) by these changes
+        latest = {}
+        new_products = []
+        replaced = {}
+        deleted = set()
+
+        def find(product_id):
+            if product_id in latest:
+                return latest[product_id]
+            return row_ids.get(product_id)
+
+        for product in added:
+            latest[product.get("product_id")] = old_count + len(new_products)
+            new_products.append(product)
+        for op, value in operations:
+            if op == "delete":
+                row_id = find(value)
+                if row_id is not None:
+                    deleted.add(row_id)
+                    latest[value] = None
+                continue
+            product_id = value.get("product_id")
+            row_id = find(product_id)
+            if row_id is None:
+                latest[product_id] = old_count + len(new_products)
+                new_products.append(value)
+            elif row_id < old_count:
+                replaced[row_id] = value
+            else:
+                new_products[row_id - old_count] = value
+
+        new_products = [
+            product
+            for row_id, product in enumerate(new_products, old_count)
+            if row_id not in deleted
+        ]
+        deleted = {row_id for row_id in deleted if row_id < old_count}
+        for row_id in deleted:
+            replaced.pop(row_id, None)
+
+        catalog = Catalog.__new__(Catalog)
+        catalog.products = catalog_changes.patch_sequence(
+            self.products, replaced, deleted, new_products
+        )
+        catalog.index = self.index.apply_changes(catalog.products, replaced, deleted)
+        catalog.text_index = self.text_index.apply_changes(
+            catalog.products, replaced, deleted
+        )
+        catalog.facet_index = self.facet_index.apply_changes(
+            catalog.index, replaced, deleted
+        )
+        catalog.encoded_products = catalog_changes.patch_sequence(
+            self.encoded_products,
+            {row_id: json.dumps(product).encode() for row_id, product in replaced.items()},
+            deleted,
+            [json.dumps(product).encode() for product in new_products],
+        )
+        catalog.filename = self.filename
+        catalog.mtime_ns = data_mark.mtime_ns
+        catalog.size = data_mark.size
+        catalog.version = version
+        catalog.data_mark = data_mark
+        catalog.changes_mark = changes_mark
+        return catalog
+
+
+class CatalogStore:
+    """
+    Process-wide holder for the current Catalog of a data file.
+
+    Call get() to obtain the catalog. The file is only parsed on the first
+    call and again after its modification time or size changes; every other
+    call returns the same in-memory Catalog object.
+
+    Attributes:
+        filename (str): Path to the data file
+        save_snapshots (bool): Whether to save a snapshot in the background
+            after parsing the data file
+        compact (bool): Whether to keep parsed products as
+            compact.ColumnarProducts rather than a list of dictionaries
+    """
+
+    def __init__(self, filename="data.jsonl", save_snapshots=False, compact=False):
+        self.filename = filename
+        self.save_snapshots = save_snapshots
+        self.compact = compact
+        self.changes_filename = catalog_changes.changes_path(filename)
+        self._catalog = None
+        self._version = 0
+        self._lock = threading.Lock()
+        # Sizes and modification times of files that couldn't be read
+        self._bad_files = None
+
+    def get(self):
+        """
+        Return the current catalog, updating it if the files have changed.
+
+        Products appended to the data file and changes appended to its
+        change log are applied to the current catalog; any other change
+        to the files loads the catalog again.
+
+        If the files can't be read into a catalog (e.g. a line isn't valid
+        JSON), the error is logged and the last catalog is kept until the
+        files change again.
+
+        Returns:
+            Catalog: The up-to-date product catalog
+
+        Raises:
+            CatalogError: If the files can't be read and no catalog has been
+                loaded before
+        """
+        catalog = self._catalog
+        if catalog is not None and self._is_current(catalog):
+            return catalog
+
+        with self._lock:
+            # Another thread may have updated while we waited for the lock
+            catalog = self._catalog
+            stat_result = os.stat(self.filename)
+            changes_stat = catalog_changes.stat_or_none(self.changes_filename)
+            files = (
+                stat_result.st_size,
+                stat_result.st_mtime_ns,
+                changes_stat and (changes_stat.st_size, changes_stat.st_mtime_ns),
+            )
+            if catalog is not None and files == self._bad_files:
+                # Don't try the same broken files on every request
+                return catalog
+            try:
+                if catalog is not None:
+                    updated = self._update(catalog, stat_result, changes_stat)
+                    if updated is not None:
+                        return updated
+                return self._load(stat_result, changes_stat)
+            except Exception as e:
+                self._bad_files = files
+                print(
+                    f"Error reading {self.filename} or {self.changes_filename}: {e}",
+                    file=sys.stderr,
+                )
+                if catalog is None:
+                    raise CatalogError(f"couldn't load {self.filename}") from e
+                return catalog
+
+    def reload(self):
+        """
+        Force the catalog to be re-read from disk.
+
+        Returns:
+            Catalog: The newly loaded product catalog
+        """
+        with self._lock:
+            return self._load(
+                os.stat(self.filename),
+                catalog_changes.stat_or_none(self.changes_filename),
+            )
+
+    def _is_current(self, catalog):
+        changes_stat = catalog_changes.stat_or_none(self.changes_filename)
+        return catalog.is_current(
+            os.stat(self.filename)
+        ) and catalog.changes_mark.is_current(changes_stat)
+
+    def _update(self, catalog, stat_result, changes_stat):
+        # Returns None if the catalog has to be loaded again instead
+        appended = catalog.data_mark.read_appended(stat_result)
+        changes = catalog.changes_mark.read_appended(changes_stat)
+        if appended is None or changes is None:
+            return None
+        (data, data_mark), (change_data, changes_mark) = appended, changes
+        if not data and not change_data:
+            # Nothing but a line that is still being written
+            return catalog
+
+        self._version += 1
+        catalog = catalog.apply_changes(
+            catalog_changes.parse_products(data),
+            catalog_changes.parse_operations(change_data),
+            data_mark,
+            changes_mark,
+            self._version,
+        )
+        self._catalog = catalog
+        return catalog
+
+    def _load(self, stat_result, changes_stat):
+        while True:
+            products = filter_module.load_products(self.filename)
+            # Products appended while the file was being read would be added
+            # again by the next update, so read it again if it has changed
+            loaded_stat = os.stat(self.filename)
+            if (loaded_stat.st_size, loaded_stat.st_mtime_ns) == (
+                stat_result.st_size,
+                stat_result.st_mtime_ns,
+            ):
+                break
+            stat_result = loaded_stat
+        if self.compact and isinstance(products, list):
+            try:
+                products = compact_module.ColumnarProducts(products)
+            except ValueError:
+                # Products with different fields can't share columns
+                pass
+        self._version += 1
+        catalog = Catalog(
+            products,
+            self.filename,
+            stat_result.st_mtime_ns,
+            stat_result.st_size,
+            self._version,
+        )
+        catalog.data_mark = catalog_changes.FileMark(self.filename, stat_result)
+        catalog.changes_mark = catalog_changes.FileMark(self.changes_filename)
+
+        if self.save_snapshots and not isinstance(
+            products, snapshot_module.SnapshotProducts
+        ):
+            # The catalog is never modified, so it can be written out while
+            # requests are being served from it. The snapshot is of the data
+            # file alone, without the change log.
+            threading.Thread(
+                target=self._save_snapshot_in_background, args=(catalog,), daemon=True
+            ).start()
+
+        changes = catalog.changes_mark.read_appended(changes_stat)
+        if changes is not None and changes[0]:
+            change_data, changes_mark = changes
+            catalog = catalog.apply_changes(
+                [],
+                catalog_changes.parse_operations(change_data),
+                catalog.data_mark,
+                changes_mark,
+                self._version,
+            )
+        # Swap in the new catalog in a single assignment
+        self._catalog = catalog
+        return catalog
+
+    def save_snapshot(self, catalog):
+        """
+        Save a catalog, including its index, as a snapshot of the data file.
+
+        Args:
+            catalog (Catalog): A catalog loaded from this store's data file
+
+        Raises:
+            ValueError: If changes from the change log have been applied to
+                the catalog, since the snapshot is of the data file alone
+        """
+        if catalog.changes_mark is not None and catalog.changes_mark.size:
+            raise ValueError("the catalog includes changes from the change log")
+        arrays, metadata = catalog.index.to_arrays()
+        text_arrays, metadata["text"] = catalog.text_index.to_arrays()
+        arrays.update(text_arrays)
+        snapshot_module.write_snapshot(
+            catalog.products,
+            snapshot_module.snapshot_path(self.filename),
+            catalog.size,
+            catalog.mtime_ns,
+            catalog.encoded_products,
+            arrays,
+            metadata,
+        )
+
+    def _save_snapshot_in_background(self, catalog):
+        # A snapshot only speeds up the next load, so failing to write one
+        # (e.g. because products have different fields) isn't an error
+        try:
+            self.save_snapshot(catalog)
+        except (OSError, ValueError):
+            pass
@@ -0,0 +1,292 @@
+"""
+Catalog Changes Module
+
+This module finds out what has been added to a catalog's files since they
+were read, so the catalog can be updated without loading everything again.
+
+Two kinds of change are picked up:
+
+- Lines appended to the data file (data.jsonl). Each new line is a new
+  product, just as if the whole file had been loaded again.
+- Lines appended to the data file's change log (data.jsonl.changes). Each
+  line is an operation on the product with a given product_id:
+
+      {"op": "upsert", "product": {...}}    add the product, or replace the
+                                            one with the same product_id
+      {"op": "delete", "product_id": 123}   remove the product
+
+  The change log is applied on top of the data file, in order. A product
+  appended to the data file after a change to it was logged is only
+  affected by that change once the catalog is next loaded from scratch.
+
+Any other change to either file - a line edited, the file truncated or
+replaced - means the catalog has to be loaded again from scratch. Only
+complete lines are read, so a line that is still being written is picked
+up the next time.
+"""
+
+import json
+import os
+from array import array
+from collections.abc import Sequence
+from itertools import accumulate, compress
+
+
+# Change logs are saved as <data file> + SUFFIX, e.g. data.jsonl.changes
+SUFFIX = ".changes"
+
+# How many of the last bytes read are kept to check that they are unchanged
+TAIL_BYTES = 64
+
+
+def changes_path(filename):
+    """
+    Get the path of a data file's change log.
+
+    Args:
+        filename (str): Path to the JSONL data file
+
+    Returns:
+        str: Path to the change log
+    """
+    return filename + SUFFIX
+
+
+def stat_or_none(path):
+    """
+    Get a file's status, if it exists.
+
+    Args:
+        path (str): Path to the file
+
+    Returns:
+        os.stat_result: The file's status, or None if there is no such file
+    """
+    try:
+        return os.stat(path)
+    except FileNotFoundError:
+        return None
+
+
+def _read(path, start, end):
+    with open(path, "rb") as file:
+        file.seek(start)
+        return file.read(end - start)
+
+
+class FileMark:
+    """
+    How much of a file has been read, so that appends to it can be told
+    apart from other changes.
+
+    Attributes:
+        path (str): Path to the file
+        inode (int): The file's inode number, or None if it didn't exist
+        size (int): Number of bytes read, where reading carries on from
+        mtime_ns (int): Modification time of the file when it was read, or
+            None if it didn't exist
+        tail (bytes): The last bytes read, up to TAIL_BYTES of them
+    """
+
+    def __init__(self, path, stat_result=None, size=None, tail=None):
+        """
+        Args:
+            path (str): Path to the file
+            stat_result (os.stat_result, optional): The file's status when it
+                was read, or None if it doesn't exist
+            size (int, optional): Number of bytes read (default: all of them)
+            tail (bytes, optional): The last bytes read, if already known
+        """
+        self.path = path
+        if stat_result is None:
+            self.inode = None
+            self.size = 0
+            self.mtime_ns = None
+            self.tail = b""
+            return
+        self.inode = stat_result.st_ino
+        self.size = stat_result.st_size if size is None else size
+        self.mtime_ns = stat_result.st_mtime_ns
+        if tail is None:
+            tail = _read(path, max(self.size - TAIL_BYTES, 0), self.size)
+        self.tail = tail[-TAIL_BYTES:]
+
+    def is_current(self, stat_result):
+        """
+        Check whether the file is exactly as it was when it was read.
+
+        Args:
+            stat_result (os.stat_result): The file's status now, or None if
+                it doesn't exist
+
+        Returns:
+            bool: True if nothing has been written to the file since
+        """
+        if stat_result is None:
+            return self.inode is None
+        return (
+            stat_result.st_ino == self.inode
+            and stat_result.st_size == self.size
+            and stat_result.st_mtime_ns == self.mtime_ns
+        )
+
+    def read_appended(self, stat_result):
+        """
+        Read the complete lines added to the end of the file since.
+
+        Args:
+            stat_result (os.stat_result): The file's status now, or None if
+                it doesn't exist
+
+        Returns:
+            tuple: (data, mark) with the new lines as bytes and a FileMark
+            for reading on from after them, or None if the file has been
+            changed in some other way than appending to it
+        """
+        if stat_result is None:
+            return (b"", self) if self.inode is None else None
+        if self.inode is not None:
+            if stat_result.st_ino != self.inode or stat_result.st_size < self.size:
+                return None
+            if stat_result.st_size == self.size:
+                # Rewritten without changing its size
+                return (b"", self) if stat_result.st_mtime_ns == self.mtime_ns else None
+
+        # Read the tail again as well, to check it hasn't been rewritten
+        start = self.size - len(self.tail)
+        data = _read(self.path, start, stat_result.st_size)
+        if not data.startswith(self.tail):
+            return None
+        data = data[len(self.tail) :]
+        # Leave a line that is still being written for next time
+        data = data[: data.rfind(b"\n") + 1]
+        mark = FileMark(
+            self.path, stat_result, self.size + len(data), self.tail + data
+        )
+        return data, mark
+
+
+def parse_products(data):
+    """
+    Parse lines appended to a data file.
+
+    Args:
+        data (bytes): Complete JSONL lines
+
+    Returns:
+        list: One product dictionary per non-blank line
+    """
+    return [json.loads(line) for line in data.splitlines() if line.strip()]
+
+
+def parse_operations(data):
+    """
+    Parse lines appended to a change log.
+
+    Args:
+        data (bytes): Complete JSONL lines
+
+    Returns:
+        list: ("upsert", product) and ("delete", product_id) tuples, in order
+
+    Raises:
+        ValueError: If a line isn't a valid operation
+    """
+    operations = []
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        change = json.loads(line)
+        op = change.get("op") if isinstance(change, dict) else None
+        if op == "upsert" and isinstance(change.get("product"), dict):
+            operations.append((op, change["product"]))
+        elif op == "delete" and "product_id" in change:
+            operations.append((op, change["product_id"]))
+        else:
+            raise ValueError(f"invalid change: {line[:200]!r}")
+    return operations
+
+
+class PatchedSequence(Sequence):
+    """
+    A read-only sequence with items replaced, removed and added, that
+    doesn't copy the sequence it is based on.
+
+    Attributes:
+        base (Sequence): The unchanged sequence
+        positions (array): For each item, its index in base, or -1 if it is
+            one of the changed items
+        items (dict): Maps index -> each changed item
+    """
+
+    def __init__(self, base, positions, items):
+        self.base = base
+        self.positions = positions
+        self.items = items
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        position = self.positions[index]
+        if position < 0:
+            return self.items[index]
+        return self.base[position]
+
+
+def patch_sequence(sequence, replaced, deleted, added):
+    """
+    Get a copy of a sequence with some items changed.
+
+    Lists are copied. Other sequences, such as products read from a snapshot,
+    are wrapped in a PatchedSequence so their items aren't all built.
+
+    Args:
+        sequence (Sequence): The sequence to change, which isn't modified
+        replaced (dict): Maps index -> new item
+        deleted (set): Indexes of items to remove (after replacing)
+        added (list): Items to add at the end (after removing)
+
+    Returns:
+        list or PatchedSequence: The changed sequence
+    """
+    keep = None
+    if deleted:
+        keep = bytearray(b"\x01") * len(sequence)
+        for index in deleted:
+            keep[index] = 0
+
+    if isinstance(sequence, list):
+        items = list(sequence)
+        for index, item in replaced.items():
+            items[index] = item
+        if keep is not None:
+            items = list(compress(items, keep))
+        items.extend(added)
+        return items
+
+    if isinstance(sequence, PatchedSequence):
+        base = sequence.base
+        positions = array("l", sequence.positions)
+        items = dict(sequence.items)
+    else:
+        base = sequence
+        positions = array("l", range(len(sequence)))
+        items = {}
+    for index, item in replaced.items():
+        positions[index] = -1
+        items[index] = item
+    if keep is not None:
+        new_indexes = array("l", accumulate(keep, initial=0))
+        positions = array("l", compress(positions, keep))
+        items = {
+            new_indexes[index]: item for index, item in items.items() if keep[index]
+        }
+    for item in added:
+        items[len(positions)] = item
+        positions.append(-1)
+    return PatchedSequence(base, positions, items)
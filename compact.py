@@ -0,0 +1,196 @@
+"""
+Compact Products Module
+
+This module stores products column by column instead of as one dictionary
+per product. A list of dictionaries costs a hash table per product, plus a
+separate object for every value - including a fresh copy of strings like
+"black" or "gucci" on every row that has them.
+
+ColumnarProducts keeps one column per field instead:
+
+- "float", "int" and "bool" fields are packed into arrays
+- "category" fields (strings with few distinct values) are stored as an
+  array of one- or two-byte codes plus the list of distinct values, which
+  are interned so each is a single shared object
+- "string" fields are stored as one UTF-8 buffer with an array of offsets
+- anything else ("json") is kept as a list of the original values
+
+It is a read-only sequence of product dictionaries, so the filter, sort
+and pagination functions accept it wherever they accept a list. Each
+dictionary is built when its product is accessed; code that needs one
+field of every product, such as ProductIndex, can use column_values()
+instead. The server only builds dictionaries at the serialization
+boundary, and usually not even there since it sends pre-encoded JSON.
+"""
+
+import sys
+from array import array
+from collections.abc import Sequence
+
+
+# Strings with at most this many distinct values (and at most one distinct
+# value per CATEGORY_MIN_REPEATS rows) are dictionary-encoded
+MAX_CATEGORIES = 65535
+CATEGORY_MIN_REPEATS = 4
+
+
+def field_names(products):
+    """
+    Get the fields every product has.
+
+    Args:
+        products (list): Product dictionaries
+
+    Returns:
+        list: Field names, in the order they appear in each product
+
+    Raises:
+        ValueError: If the products don't all have the same fields in the
+            same order
+    """
+    names = list(products[0]) if products else []
+    for product in products:
+        if len(product) != len(names) or list(product) != names:
+            raise ValueError("products don't all have the same fields")
+    return names
+
+
+def column_type(values):
+    """
+    Pick the most compact form that can reproduce every value of a field.
+
+    Args:
+        values (list): The field's value for each product
+
+    Returns:
+        str: "bool", "float", "int", "category", "string" or "json"
+    """
+    types = {type(value) for value in values}
+    if types == {bool}:
+        return "bool"
+    if types == {float}:
+        return "float"
+    if types == {int} and all(-(2**63) <= value < 2**63 for value in values):
+        return "int"
+    if types <= {str, type(None)} and types != {type(None)}:
+        distinct = len(set(values))
+        if distinct <= MAX_CATEGORIES and distinct * CATEGORY_MIN_REPEATS <= len(values):
+            return "category"
+        if types == {str}:
+            return "string"
+    return "json"
+
+
+class ColumnarProducts(Sequence):
+    """
+    Products stored as one compact column per field.
+
+    Attributes:
+        names (list): Field names, in the order they appear in each product
+        types (dict): Maps field name -> its column_type()
+    """
+
+    def __init__(self, products):
+        """
+        Args:
+            products (list): Product dictionaries, all with the same fields
+                in the same order
+
+        Raises:
+            ValueError: If the products don't all have the same fields
+        """
+        self.names = field_names(products)
+        self.types = {}
+        self._rows = len(products)
+        self._columns = {}
+        for name in self.names:
+            values = [product[name] for product in products]
+            kind = self.types[name] = column_type(values)
+            if kind == "float":
+                column = array("d", values)
+            elif kind == "int":
+                column = array("q", values)
+            elif kind == "bool":
+                column = array("B", values)
+            elif kind == "category":
+                dictionary = [
+                    sys.intern(value) if value is not None else None
+                    for value in dict.fromkeys(values)
+                ]
+                codes = {value: code for code, value in enumerate(dictionary)}
+                typecode = "B" if len(dictionary) <= 256 else "H"
+                column = (dictionary, array(typecode, [codes[value] for value in values]))
+            elif kind == "string":
+                encoded = [value.encode() for value in values]
+                offsets = array("q", [0])
+                total = 0
+                for value in encoded:
+                    total += len(value)
+                    offsets.append(total)
+                if total < 2**32:
+                    offsets = array("I", offsets)
+                column = (offsets, b"".join(encoded))
+            else:
+                column = values
+            self._columns[name] = column
+
+    def __len__(self):
+        return self._rows
+
+    def __getitem__(self, row_id):
+        if isinstance(row_id, slice):
+            return [self[i] for i in range(*row_id.indices(len(self)))]
+        if row_id < 0:
+            row_id += len(self)
+        if not 0 <= row_id < len(self):
+            raise IndexError("product index out of range")
+        return {name: self._read(name, row_id) for name in self.names}
+
+    def __iter__(self):
+        names = self.names
+        columns = [self.column_values(name) for name in names]
+        for values in zip(*columns):
+            yield dict(zip(names, values))
+
+    def _read(self, name, row_id):
+        kind = self.types[name]
+        column = self._columns[name]
+        if kind == "bool":
+            return column[row_id] == 1
+        if kind == "category":
+            dictionary, codes = column
+            return dictionary[codes[row_id]]
+        if kind == "string":
+            offsets, heap = column
+            return heap[offsets[row_id] : offsets[row_id + 1]].decode()
+        return column[row_id]
+
+    def column_values(self, name):
+        """
+        Get every product's value for one field.
+
+        Numeric columns are returned as the stored arrays; other columns
+        are decoded into a list.
+
+        Args:
+            name (str): Field name
+
+        Returns:
+            Sequence of values, by row id (all None if no product has the field)
+        """
+        kind = self.types.get(name)
+        if kind is None:
+            return [None] * self._rows
+        column = self._columns[name]
+        if kind == "bool":
+            return [value == 1 for value in column]
+        if kind == "category":
+            dictionary, codes = column
+            return [dictionary[code] for code in codes]
+        if kind == "string":
+            offsets, heap = column
+            return [
+                heap[offsets[row_id] : offsets[row_id + 1]].decode()
+                for row_id in range(self._rows)
+            ]
+        return column
@@ -0,0 +1,336 @@
+"""
+Facets Module
+
+This module counts how many products each filter value would match, so the
+feed can show e.g. "Red (1,204)" next to every option of every filter.
+
+Each facet is counted with every filter applied except its own: the color
+counts take the brand, gender, sale and price filters into account but not
+the color filter, so picking another color shows how many products it
+would give.
+
+Rather than filtering the catalog once per facet, the products are counted
+once, when the catalog is loaded, by their combination of color, designer,
+gender, sale status and price cell (see below) - a "count cube". The cube
+has one entry per combination that occurs, which is far fewer than there
+are products. The counts a facet needs are the cube summed over the
+dimensions that aren't filtered on. Every such sum is worked out along
+with the cube, so a facet takes one dictionary lookup per value, and kept
+up to date along with it as products change.
+
+The price buckets overlap at their boundaries (a product costing exactly
+50 is in both 0-50 and 50-100, since price filters are inclusive), so
+prices are counted in cells that don't: one cell for each boundary price
+and one for each gap between boundaries. A bucket's count is the sum of
+the cells it spans.
+
+Counts that the cube can't give - with a text search, or a price range
+that isn't one of the buckets - are worked out from the matching rows
+instead.
+"""
+
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from itertools import accumulate, chain, combinations, compress, product
+from operator import itemgetter
+
+from product_index import CATEGORICAL_FIELDS
+from query_planner import accepted_values
+
+
+# The price filter options offered by the feed, as (min_price, max_price)
+PRICE_BUCKETS = (
+    (0, 50),
+    (50, 100),
+    (100, 250),
+    (250, 500),
+    (500, 1000),
+    (1000, 99999),
+)
+
+# Dimensions of the count cube, in the order of its keys
+DIMENSIONS = CATEGORICAL_FIELDS + ("price",)
+PRICE_DIMENSION = len(CATEGORICAL_FIELDS)
+ALL_DIMENSIONS = tuple(range(len(DIMENSIONS)))
+
+
+def _projection(positions):
+    # Function picking the values at some positions out of a key, as a tuple
+    if len(positions) == 1:
+        (position,) = positions
+        return lambda key: (key[position],)
+    return itemgetter(*positions)
+
+
+def _sum_cube(cube):
+    # Sums of the cube over every subset of its dimensions, keyed by the
+    # (sorted) dimensions kept. Each is summed from the smallest sum already
+    # worked out that keeps all of its dimensions, which is usually much
+    # smaller than the cube.
+    marginals = {ALL_DIMENSIONS: cube}
+    for size in range(len(DIMENSIONS) - 1, 0, -1):
+        for dimensions in combinations(ALL_DIMENSIONS, size):
+            kept, source = min(
+                (
+                    (kept, source)
+                    for kept, source in marginals.items()
+                    if set(dimensions) <= set(kept)
+                ),
+                key=lambda item: len(item[1]),
+            )
+            project = _projection([kept.index(dimension) for dimension in dimensions])
+            marginal = Counter()
+            get = marginal.get
+            for key, count in source.items():
+                key = project(key)
+                marginal[key] = get(key, 0) + count
+            marginals[dimensions] = marginal
+    return marginals
+
+
+class FacetIndex:
+    """
+    Counts of products by each combination of filter values.
+
+    A FacetIndex is never modified after it has been built, like the
+    ProductIndex it is built from.
+
+    Attributes:
+        index (ProductIndex): Index of the counted products
+        price_buckets (tuple): The (min_price, max_price) ranges counted
+        bounds (list): Sorted prices at which buckets start or end
+        cells (bytes): Price cell of each row: 2 * i + 1 if the row's price
+            is bounds[i], otherwise 2 * i where bounds[i] is the first bound
+            above it
+        counts (Counter): Maps (color, designer, gender, on_sale, cell) ->
+            number of products with those values
+        marginals (dict): Maps each subset of the cube's dimensions (as a
+            sorted tuple of their positions) -> the cube summed over the
+            other dimensions, keyed by the values of these ones
+    """
+
+    def __init__(self, index, price_buckets=PRICE_BUCKETS):
+        """
+        Args:
+            index (ProductIndex): Index built over the products to count
+            price_buckets (iterable): (min_price, max_price) ranges to count
+                products in (default: PRICE_BUCKETS)
+        """
+        self._set_buckets(index, price_buckets)
+        # The products are already sorted by price, so every cell is one
+        # run of that order
+        sorted_prices = index.sorted_prices
+        edges = [0]
+        for price in self.bounds:
+            edges.append(bisect_left(sorted_prices, price))
+            edges.append(bisect_right(sorted_prices, price))
+        edges.append(len(sorted_prices))
+        sorted_cells = bytearray()
+        for cell, (start, end) in enumerate(zip(edges, edges[1:])):
+            sorted_cells += bytes([cell]) * (end - start)
+        self.cells = bytes(
+            map(sorted_cells.__getitem__, index.ranks["price_low_to_high"])
+        )
+        self.counts = Counter(
+            zip(*(index.field_values[field] for field in CATEGORICAL_FIELDS), self.cells)
+        )
+        self.marginals = _sum_cube(self.counts)
+
+    def _set_buckets(self, index, price_buckets):
+        self.index = index
+        self.price_buckets = tuple(
+            (min_price, max_price) for min_price, max_price in price_buckets
+        )
+        self.bounds = sorted({price for bucket in self.price_buckets for price in bucket})
+        if 2 * len(self.bounds) + 1 > 256:
+            raise ValueError("too many price bucket boundaries")
+        # Maps each bucket -> the cells it spans
+        self._bucket_cells = {
+            (min_price, max_price): range(
+                2 * self.bounds.index(min_price) + 1,
+                2 * self.bounds.index(max_price) + 2,
+            )
+            for min_price, max_price in self.price_buckets
+        }
+
+    def _price_cell(self, price):
+        position = bisect_left(self.bounds, price)
+        if position < len(self.bounds) and self.bounds[position] == price:
+            return 2 * position + 1
+        return 2 * position
+
+    def apply_changes(self, index, changed_rows=(), deleted_rows=()):
+        """
+        Build the counts of an updated product list from these counts.
+
+        Only the products that were added or changed are counted again, and
+        the cube and its sums are updated by the difference they make.
+
+        Args:
+            index (ProductIndex): Index of the updated products (see
+                ProductIndex.apply_changes)
+            changed_rows (iterable): Row ids (in this index) of products
+                that have been replaced
+            deleted_rows (iterable): Row ids (in this index) of products
+                that have been removed
+
+        Returns:
+            FacetIndex: The counts of the updated products, the same as
+            FacetIndex(index) would count
+        """
+        old_count = len(self.cells)
+        deleted = set(deleted_rows)
+        changed = set(changed_rows) - deleted
+        # Change in the count of each combination of values
+        delta = Counter()
+
+        old_columns = [self.index.field_values[field] for field in CATEGORICAL_FIELDS]
+        for row_id in chain(changed, deleted):
+            delta[tuple(column[row_id] for column in old_columns) + (self.cells[row_id],)] -= 1
+
+        cells = bytearray(self.cells)
+        if deleted:
+            keep = bytearray(b"\x01") * old_count
+            for row_id in deleted:
+                keep[row_id] = 0
+            new_ids = array("l", accumulate(keep, initial=0))
+            cells = bytearray(compress(cells, keep))
+            changed = {new_ids[row_id] for row_id in changed}
+        added = range(len(cells), len(index))
+        cells.extend(bytes(len(added)))
+
+        columns = [index.field_values[field] for field in CATEGORICAL_FIELDS]
+        for row_id in chain(sorted(changed), added):
+            cell = cells[row_id] = self._price_cell(index.effective_prices[row_id])
+            delta[tuple(column[row_id] for column in columns) + (cell,)] += 1
+
+        facet_index = FacetIndex.__new__(FacetIndex)
+        facet_index._set_buckets(index, self.price_buckets)
+        facet_index.cells = bytes(cells)
+        facet_index.marginals = {}
+        delta = [(key, change) for key, change in delta.items() if change]
+        for dimensions, marginal in self.marginals.items():
+            marginal = Counter(marginal)
+            project = _projection(dimensions)
+            for key, change in delta:
+                key = project(key)
+                count = marginal[key] + change
+                if count:
+                    marginal[key] = count
+                else:
+                    del marginal[key]
+            facet_index.marginals[dimensions] = marginal
+        facet_index.counts = facet_index.marginals[ALL_DIMENSIONS]
+        return facet_index
+
+    def _values(self, dimension):
+        # Every value a dimension can take
+        if dimension == PRICE_DIMENSION:
+            return range(2 * len(self.bounds) + 1)
+        return self.index.postings[DIMENSIONS[dimension]].keys()
+
+    def _count_from_cube(self, dimension, fixed):
+        # fixed maps each other filtered dimension -> the values it allows
+        fixed_dimensions = sorted(fixed)
+        position = bisect_left(fixed_dimensions, dimension)
+        marginal = self.marginals[tuple(sorted([*fixed_dimensions, dimension]))]
+        values = self._values(dimension)
+        combinations = len(values)
+        for fixed_dimension in fixed_dimensions:
+            combinations *= len(fixed[fixed_dimension])
+        if combinations <= len(marginal):
+            allowed = list(
+                product(*(fixed[fixed_dimension] for fixed_dimension in fixed_dimensions))
+            )
+            return {
+                value: sum(
+                    marginal.get(others[:position] + (value,) + others[position:], 0)
+                    for others in allowed
+                )
+                for value in values
+            }
+
+        # Filters allowing many values (e.g. all brands but one) are quicker
+        # to check against every entry of the sum than to look up
+        checks = [
+            (key_position + (key_position >= position), frozenset(fixed[fixed_dimension]))
+            for key_position, fixed_dimension in enumerate(fixed_dimensions)
+        ]
+        counts = dict.fromkeys(values, 0)
+        for key, count in marginal.items():
+            for key_position, allowed in checks:
+                if key[key_position] not in allowed:
+                    break
+            else:
+                counts[key[position]] += count
+        return counts
+
+    def _count_from_rows(self, dimension, criteria, price_range, row_ids, in_search):
+        rows = self.index.lookup(criteria, price_range)
+        if row_ids is not None:
+            if isinstance(rows, range):
+                # No other filters, so just the rows searched among
+                rows = row_ids
+            else:
+                rows = compress(rows, map(in_search.__getitem__, rows))
+        if dimension == PRICE_DIMENSION:
+            values = self.cells
+        else:
+            values = self.index.field_values[DIMENSIONS[dimension]]
+        counts = Counter(map(values.__getitem__, rows))
+        return {value: counts[value] for value in self._values(dimension)}
+
+    def count(self, criteria, price_range=None, row_ids=None):
+        """
+        Count the products each filter value would match.
+
+        Args:
+            criteria (dict): Maps categorical field name -> required value
+                (or values, see query_planner.plan_query)
+            price_range (tuple, optional): Tuple of (min_price, max_price)
+            row_ids (optional): Row ids to count among, e.g. the results of
+                a text search (default: all products)
+
+        Returns:
+            dict: Maps each categorical field, and "price", -> a dictionary
+            of the number of products matching each of its values (or each
+            price bucket) and every filter on the other fields. Values that
+            no product would match are included with a count of 0.
+        """
+        price_cells = None
+        if price_range is not None:
+            price_cells = self._bucket_cells.get(tuple(price_range))
+        in_search = None
+        if row_ids is not None:
+            if isinstance(row_ids, range) and len(row_ids) == len(self.cells):
+                row_ids = None
+            else:
+                in_search = bytearray(len(self.cells))
+                for row_id in row_ids:
+                    in_search[row_id] = 1
+
+        # The values each categorical filter accepts
+        accepted = {
+            name: accepted_values(self.index, name, value) for name, value in criteria.items()
+        }
+        facets = {}
+        for dimension, field in enumerate(DIMENSIONS):
+            other_criteria = {name: value for name, value in criteria.items() if name != field}
+            other_price_range = None if field == "price" else price_range
+            if row_ids is None and (other_price_range is None or price_cells is not None):
+                fixed = {DIMENSIONS.index(name): accepted[name] for name in other_criteria}
+                if other_price_range is not None:
+                    fixed[PRICE_DIMENSION] = price_cells
+                counts = self._count_from_cube(dimension, fixed)
+            else:
+                counts = self._count_from_rows(
+                    dimension, other_criteria, other_price_range, row_ids, in_search
+                )
+            if field == "price":
+                counts = {
+                    bucket: sum(counts[cell] for cell in cells)
+                    for bucket, cells in self._bucket_cells.items()
+                }
+            facets[field] = counts
+        return facets
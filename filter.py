@@ -5,24 +5,36 @@ This module contains functions to filter product data based on various criteria.
 Students will implement the filtering logic for each function below.
 """
 
+import heapq
 import json
+from itertools import islice
 
+import jsonl_loader
+import snapshot as snapshot_module
+from query_planner import Exclude
 
-def load_products(filename="data.jsonl"):
+
+def load_products(filename="data.jsonl", workers=None):
     """
     Load products from the JSONL data file.
 
+    If the file has an up-to-date snapshot (see snapshot.py) the products
+    are read from it instead, without parsing any JSON. Otherwise large
+    files are parsed in parallel worker processes (see jsonl_loader.py).
+
     Args:
         filename (str): Path to the data file (default: "data.jsonl")
+        workers (int, optional): Number of worker processes to parse a large
+            file with (default: one per CPU, at most 8)
 
     Returns:
-        list: List of product dictionaries
+        list: List of product dictionaries (a read-only
+        snapshot.SnapshotProducts sequence when read from a snapshot)
     """
-    products = []
-    with open(filename, "r") as file:
-        for line in file:
-            products.append(json.loads(line.strip()))
-    return products
+    snapshot = snapshot_module.open_snapshot(filename)
+    if snapshot is not None:
+        return snapshot.products()
+    return jsonl_loader.load_jsonl(filename, workers)
 
 
 def filter_by_color(products, color):
@@ -48,6 +60,21 @@ def filter_by_color(products, color):
     return items_of_colour
         
         
+def get_effective_price(product):
+    """
+    Get the price a customer actually pays for a product.
+
+    Args:
+        product (dict): A product dictionary
+
+    Returns:
+        float: The discount_price if the product is on sale, otherwise the regular_price
+    """
+    if product["on_sale"]:
+        return product["discount_price"]
+    return product["regular_price"]
+
+
 def filter_by_price_range(products, min_price, max_price):
     """
     Filter products within a specific price range.
@@ -67,12 +94,8 @@ def filter_by_price_range(products, min_price, max_price):
     # YOUR CODE HERE
     items_in_price_range = []
     for product in products:
-        if product["on_sale"]:
-            if product["discount_price"] < max_price and product["discount_price"] > min_price:
-                items_in_price_range.append(product)
-        else:
-            if product["regular_price"] < max_price and product["regular_price"] > min_price:
-                items_in_price_range.append(product)
+        if min_price <= get_effective_price(product) <= max_price:
+            items_in_price_range.append(product)
     
     return items_in_price_range
 
@@ -97,7 +120,7 @@ def filter_by_sale_status(products, on_sale=True):
     
     items_on_sale = []
     for product in products:
-        if product["on_sale"] == True:
+        if product["on_sale"] == on_sale:
             items_on_sale.append(product)
     
     return items_on_sale
@@ -127,12 +150,37 @@ def filter_by_brand(products, brand):
 
 
 
-def sort_by_price_high_to_low(products):
+# A bounded sort uses a heap while the rows it needs are less than this
+# fraction of the input; past that a full sort is just as cheap
+PARTIAL_SORT_FRACTION = 0.25
+
+
+def _get_item_score(product):
+    return product["item_score"]
+
+
+def _sort_products(products, key, reverse, offset, limit):
+    if limit is None:
+        sorted_products = sorted(products, key=key, reverse=reverse)
+        return sorted_products[offset:] if offset else sorted_products
+
+    needed = offset + limit
+    if needed < len(products) * PARTIAL_SORT_FRACTION:
+        # heapq.nlargest/nsmallest match sorted() exactly, ties included
+        select = heapq.nlargest if reverse else heapq.nsmallest
+        return select(needed, products, key=key)[offset:]
+    return sorted(products, key=key, reverse=reverse)[offset:needed]
+
+
+def sort_by_price_high_to_low(products, offset=0, limit=None):
     """
     Sort products by price from highest to lowest.
 
     Args:
         products (list): List of product dictionaries
+        offset (int): Number of sorted products to skip (default: 0)
+        limit (int, optional): Maximum number of products to return. When
+            given, only the first offset + limit products are put in order.
 
     Returns:
         list: Sorted list of products (highest to lowest price)
@@ -142,24 +190,20 @@ def sort_by_price_high_to_low(products):
     You can use Python's sorted() function with a key parameter.
     """
     # YOUR CODE HERE
-    
-    for product in products:
-        if product["on_sale"] == True:
-            product["sorting_price"] = product["discount_price"]
-        else:
-            product["sorting_price"] = product["regular_price"]
-
-    return sorted(products, key=lambda x:x["sorting_price"], reverse=True)
+    return _sort_products(products, get_effective_price, True, offset, limit)
     
 
 
         
-def sort_by_price_low_to_high(products):
+def sort_by_price_low_to_high(products, offset=0, limit=None):
     """
     Sort products by price from lowest to highest.
 
     Args:
         products (list): List of product dictionaries
+        offset (int): Number of sorted products to skip (default: 0)
+        limit (int, optional): Maximum number of products to return. When
+            given, only the first offset + limit products are put in order.
 
     Returns:
         list: Sorted list of products (lowest to highest price)
@@ -169,21 +213,18 @@ def sort_by_price_low_to_high(products):
     You can use Python's sorted() function with a key parameter.
     """
     # YOUR CODE HERE
-    for product in products:
-        if product["on_sale"] == True:
-            product["sorting_price"] = product["discount_price"]
-        else:
-            product["sorting_price"] = product["regular_price"]
+    return _sort_products(products, get_effective_price, False, offset, limit)
 
-    return sorted(products, key=lambda x:x["sorting_price"])
 
-
-def sort_by_popularity(products):
+def sort_by_popularity(products, offset=0, limit=None):
     """
     Sort products by popularity score from highest to lowest.
 
     Args:
         products (list): List of product dictionaries
+        offset (int): Number of sorted products to skip (default: 0)
+        limit (int, optional): Maximum number of products to return. When
+            given, only the first offset + limit products are put in order.
 
     Returns:
         list: Sorted list of products (most popular first)
@@ -193,7 +234,7 @@ def sort_by_popularity(products):
     You can use Python's sorted() function with a key parameter.
     """
     # YOUR CODE HERE
-    return sorted(products, key=lambda x:x["item_score"], reverse=True)
+    return _sort_products(products, _get_item_score, True, offset, limit)
 
 def filter_by_gender(products,gender):
     items_of_gender = []
@@ -205,17 +246,24 @@ def filter_by_gender(products,gender):
 
 
 
-def apply_filters(products, color=None, price_range=None, on_sale=None, brand=None, gender=None):
+def apply_filters(products, color=None, price_range=None, on_sale=None, brand=None, gender=None, index=None):
     """
     Apply multiple filters to the product list.
     This function combines all individual filters.
 
     Args:
         products (list): List of product dictionaries
-        color (str, optional): Color to filter by
+        color (str, list or Exclude, optional): Color to filter by. The
+            color, brand and gender filters can also be given a list of
+            values, to match products with any of them, or an Exclude of
+            values, to match products with none of them.
         price_range (tuple, optional): Tuple of (min_price, max_price)
         on_sale (bool, optional): Filter by sale status
-        brand (str, optional): Brand to filter by
+        brand (str, list or Exclude, optional): Brand to filter by
+        gender (str, list or Exclude, optional): Gender to filter by (e.g., "F", "M")
+        index (ProductIndex, optional): Index built over products. When given,
+            the categorical filters are answered by intersecting its posting
+            lists instead of scanning every product.
 
     Returns:
         list: Filtered list of products matching all specified criteria
@@ -224,38 +272,279 @@ def apply_filters(products, color=None, price_range=None, on_sale=None, brand=No
     Hint: Start with all products, then apply each filter one at a time if the
     parameter is provided (not None).
     """
-    filtered_products = products
+    if index is not None:
+        return _apply_filters_with_index(
+            index, color, price_range, on_sale, brand, gender
+        )
+
+    if color is None and price_range is None and on_sale is None and brand is None and gender is None:
+        return products
 
     # YOUR CODE HERE
-    # Apply each filter if the parameter is provided
-    # Example structure:
-    if color is not None:
-        filtered_products = filter_by_color(filtered_products, color)
+    # All the filters are checked together in a single pass over the products
+    return list(
+        iter_filtered_products(products, color, price_range, on_sale, brand, gender)
+    )
+
+
+def iter_filtered_products(products, color=None, price_range=None, on_sale=None, brand=None, gender=None, index=None):
+    """
+    Lazily yield the products matching all the given filters.
+
+    Every active filter is checked in one fused pass over the products and
+    matches are yielded as soon as they are found, so no intermediate lists
+    are built and a consumer that only needs the first few matches (for
+    example with itertools.islice) stops the scan early.
+
+    Args:
+        products (iterable): Product dictionaries to filter
+        color (str, list or Exclude, optional): Color to filter by
+        price_range (tuple, optional): Tuple of (min_price, max_price)
+        on_sale (bool, optional): Filter by sale status
+        brand (str, list or Exclude, optional): Brand to filter by
+        gender (str, list or Exclude, optional): Gender to filter by
+        index (ProductIndex, optional): Index built over products. When given,
+            matches are found with the index and then yielded one at a time.
+
+    Yields:
+        dict: Each matching product, in catalog order
+    """
+    if index is not None:
+        row_ids = filter_row_ids(index, color, price_range, on_sale, brand, gender)
+        yield from index.iter_products(row_ids)
+        return
+
+    # Fields with one required value are compared; the rest are looked up
+    # in the set of values they accept (or don't)
+    checks = []
+    set_checks = []
+    for field, value in _get_criteria(color, on_sale, brand, gender).items():
+        if isinstance(value, Exclude):
+            set_checks.append((field, frozenset(value.values), False))
+        elif isinstance(value, tuple):
+            set_checks.append((field, frozenset(value), True))
+        else:
+            checks.append((field, value))
     if price_range is not None:
-         filtered_products = filter_by_price_range(filtered_products, price_range[0], price_range[1])
+        min_price, max_price = price_range
+
+    for product in products:
+        for field, value in checks:
+            if product[field] != value:
+                break
+        else:
+            for field, values, accepted in set_checks:
+                if (product[field] in values) != accepted:
+                    break
+            else:
+                if price_range is None or min_price <= get_effective_price(product) <= max_price:
+                    yield product
+
+
+def _get_condition(value):
+    # A list of values becomes a tuple without duplicates (or the value
+    # itself if there is only one); excluding nothing is no filter at all
+    if isinstance(value, Exclude):
+        return value if value.values else None
+    if isinstance(value, (list, tuple, set, frozenset)):
+        values = tuple(dict.fromkeys(value))
+        return values[0] if len(values) == 1 else values
+    return value
+
+
+def _get_criteria(color, on_sale, brand, gender):
+    # Maps product field -> required value (or values, or an Exclude) for
+    # the categorical filters
+    criteria = {}
+    color, brand, gender = map(_get_condition, (color, brand, gender))
+    if color is not None:
+        criteria["color"] = color
     if on_sale is not None:
-        filtered_products = filter_by_sale_status(filtered_products,on_sale=True)
+        criteria["on_sale"] = on_sale
     if brand is not None:
-        filtered_products = filter_by_brand(filtered_products,brand)
+        criteria["designer"] = brand
     if gender is not None:
-        filtered_products = filter_by_gender(filtered_products,gender)
+        criteria["gender"] = gender
+    return criteria
+
+
+def _apply_filters_with_index(index, color, price_range, on_sale, brand, gender):
+    if color is None and price_range is None and on_sale is None and brand is None and gender is None:
+        return index.products
+
+    return index.get_products(
+        filter_row_ids(index, color, price_range, on_sale, brand, gender)
+    )
+
+
+def filter_row_ids(index, color=None, price_range=None, on_sale=None, brand=None, gender=None):
+    """
+    Find the row ids of the products matching all the given filters.
+
+    This takes the same filters as apply_filters but returns positions in
+    index.products instead of product dictionaries, so the result can be
+    sorted with index.sort_row_ids() before any products are looked up.
+
+    Args:
+        index (ProductIndex): Index built over the product list
+        color (str, list or Exclude, optional): Color to filter by
+        price_range (tuple, optional): Tuple of (min_price, max_price)
+        on_sale (bool, optional): Filter by sale status
+        brand (str, list or Exclude, optional): Brand to filter by
+        gender (str, list or Exclude, optional): Gender to filter by
+
+    Returns:
+        Sorted row ids of the matching products
+    """
+    criteria = _get_criteria(color, on_sale, brand, gender)
+    return index.lookup(criteria, price_range)
+
+
+def filter_page_row_ids(index, sort_by=None, offset=0, limit=50, color=None, price_range=None, on_sale=None, brand=None, gender=None, start=0):
+    """
+    Find one page of the row ids matching the filters, in sort order.
+
+    Only the rows on the page are looked up, when that is cheaper than
+    finding every match (see ProductIndex.lookup_page).
+
+    Args:
+        index (ProductIndex): Index built over the product list
+        sort_by (str, optional): One of the index's sort orders
+        offset (int): Number of matching rows to skip (default: 0)
+        limit (int): Maximum number of rows to return (default: 50)
+        color (str, list or Exclude, optional): Color to filter by
+        price_range (tuple, optional): Tuple of (min_price, max_price)
+        on_sale (bool, optional): Filter by sale status
+        brand (str, list or Exclude, optional): Brand to filter by
+        gender (str, list or Exclude, optional): Gender to filter by
+        start (int): Rank in the sort order to start from (default: 0)
+
+    Returns:
+        Row ids of the page, or None if the caller should find every match
+        with filter_row_ids() and sort them instead
+    """
+    criteria = _get_criteria(color, on_sale, brand, gender)
+    return index.lookup_page(criteria, price_range, sort_by, offset, limit, start)
+
+
+def count_matches(index, color=None, price_range=None, on_sale=None, brand=None, gender=None, approximate=False):
+    """
+    Count the products matching all the given filters, without listing them.
+
+    Args:
+        index (ProductIndex): Index built over the product list
+        color (str, list or Exclude, optional): Color to filter by
+        price_range (tuple, optional): Tuple of (min_price, max_price)
+        on_sale (bool, optional): Filter by sale status
+        brand (str, list or Exclude, optional): Brand to filter by
+        gender (str, list or Exclude, optional): Gender to filter by
+        approximate (bool): Estimate the count from a sample of the rows
+            when an exact count would need a lot of rows checked
+
+    Returns:
+        tuple: (count, margin) where the true count is within count ± margin
+        with 95% confidence. The margin is 0 when the count is exact.
+    """
+    criteria = _get_criteria(color, on_sale, brand, gender)
+    if approximate:
+        return index.estimate_count(criteria, price_range)
+    return index.count(criteria, price_range), 0
+
+
+def explain_filters(index, color=None, price_range=None, on_sale=None, brand=None, gender=None):
+    """
+    Explain how filter_row_ids would answer a query.
+
+    Args:
+        index (ProductIndex): Index built over the product list
+        color (str, list or Exclude, optional): Color to filter by
+        price_range (tuple, optional): Tuple of (min_price, max_price)
+        on_sale (bool, optional): Filter by sale status
+        brand (str, list or Exclude, optional): Brand to filter by
+        gender (str, list or Exclude, optional): Gender to filter by
+
+    Returns:
+        list: One dictionary per filter, in the order they are applied, with
+        the method used ("index", "intersect" or "check") and the estimated
+        and actual number of rows left after that step
+    """
+    criteria = _get_criteria(color, on_sale, brand, gender)
+    return index.explain(criteria, price_range)
+
 
+def count_facets(facet_index, color=None, price_range=None, on_sale=None, brand=None, gender=None, row_ids=None):
+    """
+    Count the products each filter value would match, given the other filters.
 
-    return filtered_products
+    Args:
+        facet_index (FacetIndex): Counts built over the product list
+        color (str, list or Exclude, optional): Color to filter by
+        price_range (tuple, optional): Tuple of (min_price, max_price)
+        on_sale (bool, optional): Filter by sale status
+        brand (str, list or Exclude, optional): Brand to filter by
+        gender (str, list or Exclude, optional): Gender to filter by
+        row_ids (optional): Sorted row ids to count among, e.g. the matches
+            of a text search (default: all products)
+
+    Returns:
+        dict: Maps "color", "designer", "gender", "on_sale" and "price" ->
+        the number of products matching each value (or price bucket) and
+        every filter except the one on that field
+    """
+    criteria = _get_criteria(color, on_sale, brand, gender)
+    return facet_index.count(criteria, price_range, row_ids)
 
 
-def save_filtered_results(products, output_filename="filtered_data.jsonl"):
+def search_row_ids(index, text_index, terms, sort_by=None, color=None, price_range=None, on_sale=None, brand=None, gender=None):
+    """
+    Find the products matching a search query and the given filters.
+
+    Args:
+        index (ProductIndex): Index built over the product list
+        text_index (TextIndex): Text index built over the same products
+        terms (tuple): The search query's terms (see text_search.query_terms)
+        sort_by (str, optional): One of the index's sort orders. Without one
+            the most relevant products come first.
+        color (str, list or Exclude, optional): Color to filter by
+        price_range (tuple, optional): Tuple of (min_price, max_price)
+        on_sale (bool, optional): Filter by sale status
+        brand (str, list or Exclude, optional): Brand to filter by
+        gender (str, list or Exclude, optional): Gender to filter by
+
+    Returns:
+        Row ids of the products containing every term and matching every
+        filter, in the requested order
+    """
+    row_ids = filter_row_ids(index, color, price_range, on_sale, brand, gender)
+    row_ids = text_index.search(terms, row_ids)
+    if sort_by in index.sort_orders:
+        return index.sort_row_ids(row_ids, sort_by)
+    return text_index.rank(terms, row_ids)
+
+
+def save_filtered_results(products, output_filename="filtered_data.jsonl", limit=None):
     """
     Save filtered products to a new JSONL file.
 
     Args:
-        products (list): List of product dictionaries to save
+        products (iterable): Product dictionaries to save. This can be a
+            generator such as iter_filtered_products(); it is consumed lazily.
         output_filename (str): Path to the output file
+        limit (int, optional): Stop after saving this many products
+
+    Returns:
+        int: Number of products saved
     """
+    if limit is not None:
+        products = islice(products, limit)
+
+    count = 0
     with open(output_filename, "w") as file:
         for product in products:
             file.write(json.dumps(product) + "\n")
-    print(f"Saved {len(products)} products to {output_filename}")
+            count += 1
+    print(f"Saved {count} products to {output_filename}")
+    return count
 
 
 # Example usage (for testing your functions)
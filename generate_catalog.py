@@ -0,0 +1,401 @@
+"""
+Catalog Generator Module
+
+This module generates synthetic product catalogs of any size, so the feed
+can be tried and benchmarked with millions of products when data.jsonl only
+has a few thousand.
+
+The products have the same fields as data.jsonl. Their values follow a
+CatalogModel learnt from a sample catalog (data.jsonl by default):
+
+- designers, colors and retailers are drawn with the frequencies they have
+  in the sample, so the few big designers and the long tail of small ones
+  keep their proportions
+- gender, product type, category and subcategory are drawn together, as
+  combinations that occur in the sample
+- regular prices are log-normal, with a shift for each category and each
+  designer fitted to the sample, so e.g. bags from expensive designers
+  cost more than socks from cheap ones
+- the chance of being on sale depends on the retailer, and discount prices
+  use the sample's discount ratios
+- descriptions are assembled from sentences of the sample's descriptions of
+  the same category
+
+Generation is deterministic for a given seed and sample, and streams: the
+products are written out in batches, so memory use doesn't grow with the
+number of products. For example:
+
+    python generate_catalog.py 10000000 --output big.jsonl --seed 1
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import sys
+from collections import Counter, defaultdict
+from itertools import accumulate, islice
+
+
+# Fields of a generated product, in the order of data.jsonl
+FIELDS = (
+    "product_id",
+    "color",
+    "gender",
+    "product_type",
+    "category",
+    "subcategory",
+    "designer",
+    "retailer",
+    "on_sale",
+    "regular_price",
+    "discount_price",
+    "short_description",
+    "long_description",
+    "image_url",
+    "item_score",
+)
+
+# Most products read from the sample catalog
+SAMPLE_ROWS = 100000
+
+# Most values kept per pool (e.g. of item scores, or of the sentences of
+# one category's descriptions)
+POOL_SIZE = 1000
+
+# Categories, designers and retailers with few sample products have their
+# price shift and sale rate pulled towards the average, as if they had this
+# many more products that were average
+SHRINKAGE = 5
+
+# Products generated and written at a time
+BATCH_SIZE = 10000
+
+# Product ids are FIRST_PRODUCT_ID plus row * ID_MULTIPLIER modulo ID_SPACE.
+# The multiplier is odd, so ids are unique for the first ID_SPACE rows, and
+# scattered like the ids in data.jsonl rather than consecutive.
+FIRST_PRODUCT_ID = 1000000000
+ID_SPACE = 2**30
+ID_MULTIPLIER = 0x9E3779B1 % ID_SPACE
+
+IMAGE_URL = "https://cdna.lystit.com/300/379/tr/photos/{}/{:08x}/{}.jpeg"
+
+
+class _Pool:
+    # A uniform sample of at most POOL_SIZE of the values added to it
+    # (reservoir sampling), so it takes bounded memory whatever the sample
+    # catalog's size
+
+    def __init__(self, generator):
+        self.values = []
+        self.seen = 0
+        self.generator = generator
+
+    def add(self, value):
+        self.seen += 1
+        if len(self.values) < POOL_SIZE:
+            self.values.append(value)
+        else:
+            position = self.generator.randrange(self.seen)
+            if position < POOL_SIZE:
+                self.values[position] = value
+
+
+def _distribution(counts):
+    # (values, cumulative weights) for random.choices, most common first
+    values = [value for value, _ in counts.most_common()]
+    return values, list(accumulate(counts[value] for value in values))
+
+
+def _split_sentences(text):
+    return [sentence for sentence in re.split(r"(?<=[.;!?])\s+", text.strip()) if sentence]
+
+
+class CatalogModel:
+    """
+    Distributions of product field values, learnt from a sample catalog.
+
+    Attributes:
+        kinds (tuple): (values, cumulative weights) of the
+            (gender, product_type, category, subcategory) combinations
+        colors (tuple): (values, cumulative weights) of colors
+        designers (tuple): (values, cumulative weights) of designers
+        retailers (tuple): (values, cumulative weights) of retailers
+        sale_rates (dict): Maps retailer -> fraction of its products on sale
+        log_price (float): Average natural log of the regular price
+        log_price_sigma (float): Standard deviation of the log price left
+            once the category and designer shifts are taken out
+        category_shifts (dict): Maps category -> shift of its log prices
+        designer_shifts (dict): Maps designer -> shift of its log prices
+        discount_ratios (dict): Maps on_sale -> discount_price /
+            regular_price ratios of sample products (None where a product
+            had no discount price)
+        item_scores (list): Item scores of sample products
+        short_descriptions (dict): Maps category -> short descriptions
+        sentences (dict): Maps category -> sentences of long descriptions
+        sentence_counts (tuple): (values, cumulative weights) of the number
+            of sentences in a long description
+    """
+
+    def __init__(self, products):
+        """
+        Args:
+            products (iterable): Sample product dictionaries, e.g. parsed
+                from data.jsonl. They are only iterated over once.
+
+        Raises:
+            ValueError: If there are no products with a positive regular
+                price
+        """
+        # Fixed seed, so the same sample always gives the same model
+        generator = random.Random(0)
+        kinds = Counter()
+        colors = Counter()
+        designers = Counter()
+        retailers = Counter()
+        retailer_sales = Counter()
+        # (category, designer, log price) of each product with a price
+        prices = []
+        discount_ratios = {True: _Pool(generator), False: _Pool(generator)}
+        item_scores = _Pool(generator)
+        short_descriptions = defaultdict(lambda: _Pool(generator))
+        sentences = defaultdict(lambda: _Pool(generator))
+        sentence_counts = Counter()
+
+        for product in products:
+            category = product.get("category")
+            designer = product.get("designer")
+            retailer = product.get("retailer")
+            on_sale = bool(product.get("on_sale"))
+            kinds[
+                (product.get("gender"), product.get("product_type"), category, product.get("subcategory"))
+            ] += 1
+            colors[product.get("color")] += 1
+            designers[designer] += 1
+            retailers[retailer] += 1
+            retailer_sales[retailer] += on_sale
+
+            regular_price = product.get("regular_price")
+            if isinstance(regular_price, (int, float)) and regular_price > 0:
+                prices.append((category, designer, math.log(regular_price)))
+                discount_price = product.get("discount_price")
+                discount_ratios[on_sale].add(
+                    discount_price / regular_price
+                    if isinstance(discount_price, (int, float))
+                    else None
+                )
+            if product.get("item_score") is not None:
+                item_scores.add(product["item_score"])
+            if product.get("short_description"):
+                short_descriptions[category].add(product["short_description"])
+            long_sentences = _split_sentences(product.get("long_description") or "")
+            sentence_counts[len(long_sentences)] += 1
+            for sentence in long_sentences:
+                sentences[category].add(sentence)
+
+        if not prices:
+            raise ValueError("the sample has no products with a regular price")
+
+        self.kinds = _distribution(kinds)
+        self.colors = _distribution(colors)
+        self.designers = _distribution(designers)
+        self.retailers = _distribution(retailers)
+        sale_rate = sum(retailer_sales.values()) / sum(retailers.values())
+        self.sale_rates = {
+            retailer: (retailer_sales[retailer] + SHRINKAGE * sale_rate) / (count + SHRINKAGE)
+            for retailer, count in retailers.items()
+        }
+
+        # Fit log price = average + category shift + designer shift + noise,
+        # one shift at a time
+        self.log_price = math.fsum(log_price for _, _, log_price in prices) / len(prices)
+        self.category_shifts = self._fit_shifts(
+            (category, log_price - self.log_price) for category, _, log_price in prices
+        )
+        self.designer_shifts = self._fit_shifts(
+            (designer, log_price - self.log_price - self.category_shifts[category])
+            for category, designer, log_price in prices
+        )
+        residuals = [
+            log_price
+            - self.log_price
+            - self.category_shifts[category]
+            - self.designer_shifts[designer]
+            for category, designer, log_price in prices
+        ]
+        self.log_price_sigma = math.sqrt(
+            math.fsum(residual * residual for residual in residuals) / len(residuals)
+        )
+
+        self.discount_ratios = {
+            on_sale: pool.values or discount_ratios[not on_sale].values
+            for on_sale, pool in discount_ratios.items()
+        }
+        self.item_scores = item_scores.values or [0.0]
+        self.short_descriptions = {
+            category: pool.values for category, pool in short_descriptions.items()
+        }
+        self.sentences = {category: pool.values for category, pool in sentences.items()}
+        self.sentence_counts = _distribution(sentence_counts)
+
+    @staticmethod
+    def _fit_shifts(differences):
+        # Maps each key -> its average difference, pulled towards 0
+        totals = defaultdict(float)
+        counts = Counter()
+        for key, difference in differences:
+            totals[key] += difference
+            counts[key] += 1
+        return {key: totals[key] / (counts[key] + SHRINKAGE) for key in counts}
+
+    @classmethod
+    def from_file(cls, filename="data.jsonl", max_rows=SAMPLE_ROWS):
+        """
+        Learn a model from the first products of a JSONL catalog.
+
+        Args:
+            filename (str): Path to the sample catalog (default: "data.jsonl")
+            max_rows (int): Most products to read (default: SAMPLE_ROWS)
+
+        Returns:
+            CatalogModel: The learnt model
+        """
+        with open(filename, "rb") as file:
+            lines = (line for line in islice(file, max_rows) if line.strip())
+            return cls(json.loads(line) for line in lines)
+
+    def generate(self, count, seed=0):
+        """
+        Generate products.
+
+        The first products generated with a seed are the same whatever the
+        count, so a smaller catalog is the start of a bigger one.
+
+        Args:
+            count (int): Number of products to generate
+            seed (int): Seed for the random choices; the same seed gives the
+                same products (default: 0)
+
+        Yields:
+            dict: Product dictionaries with the fields in FIELDS, in order
+
+        Raises:
+            ValueError: If count is more than ID_SPACE, since product ids
+                would repeat
+        """
+        if count > ID_SPACE:
+            raise ValueError(f"can't generate more than {ID_SPACE} unique products")
+        generator = random.Random(seed)
+        choices = generator.choices
+        no_sentences = [""]
+        for start in range(0, count, BATCH_SIZE):
+            # Independent fields are drawn a batch at a time, which is much
+            # quicker than one product at a time. Whole batches are drawn
+            # even at the end, so the first products are the same whatever
+            # the count.
+            kinds = choices(self.kinds[0], cum_weights=self.kinds[1], k=BATCH_SIZE)
+            colors = choices(self.colors[0], cum_weights=self.colors[1], k=BATCH_SIZE)
+            designers = choices(self.designers[0], cum_weights=self.designers[1], k=BATCH_SIZE)
+            retailers = choices(self.retailers[0], cum_weights=self.retailers[1], k=BATCH_SIZE)
+            sentence_counts = choices(
+                self.sentence_counts[0], cum_weights=self.sentence_counts[1], k=BATCH_SIZE
+            )
+            item_scores = choices(self.item_scores, k=BATCH_SIZE)
+            for offset in range(min(BATCH_SIZE, count - start)):
+                row = start + offset
+                gender, product_type, category, subcategory = kinds[offset]
+                color = colors[offset]
+                designer = designers[offset]
+                retailer = retailers[offset]
+                on_sale = generator.random() < self.sale_rates[retailer]
+                regular_price = round(
+                    math.exp(
+                        generator.gauss(
+                            self.log_price
+                            + self.category_shifts.get(category, 0.0)
+                            + self.designer_shifts.get(designer, 0.0),
+                            self.log_price_sigma,
+                        )
+                    ),
+                    2,
+                )
+                ratio = generator.choice(self.discount_ratios[on_sale])
+                short_description = generator.choice(
+                    self.short_descriptions.get(category) or no_sentences
+                )
+                long_description = " ".join(
+                    choices(self.sentences.get(category) or no_sentences, k=sentence_counts[offset])
+                )
+                slug = "-".join(
+                    word
+                    for word in re.split(r"[^A-Za-z0-9]+", f"{designer} {color or ''} {short_description}")
+                    if word
+                )
+                yield {
+                    "product_id": FIRST_PRODUCT_ID + (row * ID_MULTIPLIER) % ID_SPACE,
+                    "color": color,
+                    "gender": gender,
+                    "product_type": product_type,
+                    "category": category,
+                    "subcategory": subcategory,
+                    "designer": designer,
+                    "retailer": retailer,
+                    "on_sale": on_sale,
+                    "regular_price": regular_price,
+                    "discount_price": None if ratio is None else round(regular_price * ratio, 2),
+                    "short_description": short_description,
+                    "long_description": long_description,
+                    "image_url": IMAGE_URL.format(retailer, generator.getrandbits(32), slug),
+                    "item_score": item_scores[offset],
+                }
+
+
+def write_catalog(model, count, file, seed=0):
+    """
+    Write generated products to a file, one JSON object per line.
+
+    Args:
+        model (CatalogModel): Model to generate the products from
+        count (int): Number of products to write
+        file: Text file object to write to
+        seed (int): Seed for the random choices (default: 0)
+    """
+    products = model.generate(count, seed)
+    while True:
+        batch = list(islice(products, BATCH_SIZE))
+        if not batch:
+            return
+        file.write("".join([json.dumps(product) + "\n" for product in batch]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Generate a synthetic product catalog like a sample catalog."
+    )
+    parser.add_argument("count", type=int, help="number of products to generate")
+    parser.add_argument(
+        "--sample", default="data.jsonl", help="catalog to learn from (default: data.jsonl)"
+    )
+    parser.add_argument(
+        "--output", default="-", help="file to write (default: standard output)"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    args = parser.parse_args(argv)
+
+    model = CatalogModel.from_file(args.sample)
+    if args.output == "-":
+        try:
+            write_catalog(model, args.count, sys.stdout, args.seed)
+        except BrokenPipeError:
+            # The reader stopped early, e.g. `| head`; don't complain about
+            # the output that can't be flushed at exit either
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+    else:
+        with open(args.output, "w") as file:
+            write_catalog(model, args.count, file, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""
+HTTP Compression Module
+
+This module picks a Content-Encoding for a response from the request's
+Accept-Encoding header, and compresses response bodies with it.
+
+gzip is always available. zstd and brotli ("br") are offered as well when
+the optional `zstandard` and `brotli` packages are installed; when a client
+accepts several encodings equally, they are preferred in that order because
+they compress JSON smaller and faster than gzip.
+"""
+
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Compression levels, chosen for speed since responses that aren't cached
+# are compressed while the client waits
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+BROTLI_QUALITY = 5
+
+# File name suffix for a compressed copy of a file, by encoding
+FILE_SUFFIXES = {"gzip": ".gz", "zstd": ".zst", "br": ".br"}
+
+
+def _gzip_compressor():
+    # wbits=31 writes a gzip header and trailer rather than a raw zlib stream
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+
+def _zstd_compressor():
+    compressor = zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    return compressor.compress, compressor.flush
+
+
+def _brotli_compressor():
+    compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+    return compressor.process, compressor.finish
+
+
+# Maps each available encoding -> function returning (compress, finish),
+# most preferred first
+COMPRESSORS = {}
+if zstandard is not None:
+    COMPRESSORS["zstd"] = _zstd_compressor
+if brotli is not None:
+    COMPRESSORS["br"] = _brotli_compressor
+COMPRESSORS["gzip"] = _gzip_compressor
+
+
+def parse_accept_encoding(header):
+    """
+    Parse an Accept-Encoding header.
+
+    Args:
+        header (str): The header's value, e.g. "gzip, br;q=0.8, *;q=0"
+
+    Returns:
+        dict: Maps each listed encoding (lowercase) -> its quality value
+    """
+    qualities = {}
+    for item in (header or "").split(","):
+        encoding, *params = item.split(";")
+        encoding = encoding.strip().lower()
+        if not encoding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[encoding] = quality
+    return qualities
+
+
+def choose_encoding(accept_encoding):
+    """
+    Choose the encoding to compress a response with.
+
+    Args:
+        accept_encoding (str): The request's Accept-Encoding header, or None
+
+    Returns:
+        str: One of COMPRESSORS' encodings, or None to send the body as it is
+    """
+    qualities = parse_accept_encoding(accept_encoding)
+    default = qualities.get("*", 0.0)
+    best, best_quality = None, 0.0
+    for encoding in COMPRESSORS:
+        quality = qualities.get(encoding, default)
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding):
+    """
+    Compress a whole body.
+
+    Args:
+        data (bytes): The body
+        encoding (str): One of COMPRESSORS' encodings
+
+    Returns:
+        bytes: The compressed body
+    """
+    compress_chunk, finish = COMPRESSORS[encoding]()
+    return compress_chunk(data) + finish()
+
+
+def iter_compressed(chunks, encoding):
+    """
+    Compress a body as it is produced.
+
+    Args:
+        chunks (iterable): Byte strings making up the body
+        encoding (str): One of COMPRESSORS' encodings
+
+    Yields:
+        bytes: The compressed body, a piece at a time (some may be empty)
+    """
+    compress_chunk, finish = COMPRESSORS[encoding]()
+    for chunk in chunks:
+        yield compress_chunk(chunk)
+    yield finish()
+
+
+def iter_file(path, chunk_size=1024 * 1024):
+    """
+    Read a file a chunk at a time.
+
+    Args:
+        path (str): Path of the file
+        chunk_size (int): Number of bytes per chunk
+
+    Yields:
+        bytes: The file's contents, a chunk at a time
+    """
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+def compress_file(source, destination, encoding, chunk_size=1024 * 1024):
+    """
+    Compress a file into another, a chunk at a time.
+
+    The copy is written under a temporary name and renamed into place, so
+    it never appears half written.
+
+    Args:
+        source (str): Path of the file to compress
+        destination (str): Path to write the compressed copy to
+        encoding (str): One of COMPRESSORS' encodings
+        chunk_size (int): Number of bytes read and compressed at a time
+
+    Raises:
+        OSError: If the source can't be read or the copy can't be written
+    """
+    temporary = destination + ".tmp"
+    try:
+        with open(temporary, "wb") as file:
+            for data in iter_compressed(iter_file(source, chunk_size), encoding):
+                file.write(data)
+        os.replace(temporary, destination)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
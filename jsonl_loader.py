@@ -0,0 +1,129 @@
+"""
+JSONL Loader Module
+
+This module parses JSONL files such as data.jsonl into lists of dictionaries.
+
+Large files are parsed in parallel: the file is memory-mapped, split into
+byte ranges that end on newline boundaries, and each range is parsed by a
+separate worker process. The parsed ranges are joined back together in file
+order, so the result is the same as reading the file line by line.
+
+Starting worker processes and sending the parsed rows back to the parent
+takes time of its own, so files smaller than PARALLEL_MIN_BYTES are parsed
+serially in the current process instead.
+"""
+
+import json
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Files smaller than this are parsed in the current process
+PARALLEL_MIN_BYTES = 32 * 1024 * 1024
+
+# Each worker is given this many ranges, so that a worker that finishes
+# early can pick up more work
+RANGES_PER_WORKER = 4
+
+
+def default_workers():
+    """
+    Get the number of worker processes to use by default.
+
+    Returns:
+        int: The number of CPUs available to this process, at most 8
+    """
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    return min(cpus, 8)
+
+
+def split_ranges(filename, parts):
+    """
+    Split a file into byte ranges that each end on a line boundary.
+
+    Args:
+        filename (str): Path to the file
+        parts (int): Number of ranges to aim for
+
+    Returns:
+        list: (start, end) byte offsets covering the whole file, in order.
+        There may be fewer than `parts` ranges if lines are long.
+    """
+    size = os.path.getsize(filename)
+    if size == 0:
+        return []
+
+    ranges = []
+    with open(filename, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        target = max(size // parts, 1)
+        start = 0
+        while start < size:
+            newline = data.find(b"\n", min(start + target, size) - 1)
+            end = size if newline == -1 else newline + 1
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_range(filename, start, end):
+    """
+    Parse the JSON lines in one byte range of a file.
+
+    Args:
+        filename (str): Path to the file
+        start (int): Offset of the first byte of the range
+        end (int): Offset just past the last byte of the range
+
+    Returns:
+        list: The parsed object from each non-blank line, in order
+    """
+    with open(filename, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        lines = data[start:end].split(b"\n")
+    return [json.loads(line) for line in lines if line.strip()]
+
+
+def load_jsonl(filename, workers=None, min_parallel_bytes=PARALLEL_MIN_BYTES):
+    """
+    Load every object from a JSONL file.
+
+    Args:
+        filename (str): Path to the file
+        workers (int, optional): Number of worker processes (default:
+            default_workers()). With 1 the file is parsed serially.
+        min_parallel_bytes (int): Files smaller than this are parsed
+            serially (default: PARALLEL_MIN_BYTES)
+
+    Returns:
+        list: The parsed objects, in file order
+    """
+    if workers is None:
+        workers = default_workers()
+    if workers <= 1 or os.path.getsize(filename) < min_parallel_bytes:
+        products = []
+        with open(filename, "r") as file:
+            for line in file:
+                if line.strip():
+                    products.append(json.loads(line))
+        return products
+
+    ranges = split_ranges(filename, workers * RANGES_PER_WORKER)
+    # Worker processes are started fresh rather than forked, because the
+    # server calls this from a thread while other threads are running
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        # map() returns results in the order the ranges were submitted
+        parsed_ranges = executor.map(
+            parse_range,
+            [filename] * len(ranges),
+            [start for start, _ in ranges],
+            [end for _, end in ranges],
+        )
+        products = []
+        for parsed in parsed_ranges:
+            products.extend(parsed)
+    return products
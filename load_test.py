@@ -0,0 +1,657 @@
+"""
+Load Test
+
+This script measures how server.py behaves with many users at once. Each
+simulated user has its own keep-alive connection and browses the feed the
+way the frontend does, over and over until the time is up:
+
+1. picks some filters (values are weighted by how many products have
+   them, as listed by /api/facets) and loads their facet counts
+2. pages through /api/products, moving on to the next page with
+   probability "next_page_rate", up to "max_pages"
+3. with probability "change_sort_rate" picks another sort order and pages
+   through again
+4. with probability "download_rate" downloads /data.jsonl with its filters
+5. with probability "change_filters_rate" goes back to 1 with new filters,
+   otherwise starts a new session
+
+Older clients posted their filters to /api/set-filters first; set
+"set_filters_rate" above 0 to include that (it rewrites the server's
+current_filters.json). Every rate, and the mean "think_time" between
+requests, can be changed with --session, a JSON file of the SESSION_MODEL
+keys to override.
+
+Latencies are counted in a LatencyHistogram per endpoint, and the report
+gives each endpoint's throughput, error rate and p50/p95/p99/p99.9. For
+example, against a server that is already running:
+
+    python load_test.py --url http://localhost:3000 --users 32 --duration 30
+
+or starting the server in each concurrency mode in turn, to compare them:
+
+    python load_test.py --start-server single threaded asyncio --users 32
+
+Only use it against your own server, e.g. on localhost.
+"""
+
+import argparse
+import http.client
+import json
+import math
+import os
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlencode, urlsplit
+
+from product_index import SORT_ORDERS
+
+
+# How simulated users behave (see the module docstring)
+SESSION_MODEL = {
+    "filter_rate": 0.4,
+    "next_page_rate": 0.6,
+    "max_pages": 10,
+    "change_sort_rate": 0.3,
+    "download_rate": 0.02,
+    "change_filters_rate": 0.7,
+    "set_filters_rate": 0.0,
+    "items_per_page": 50,
+    "think_time": 0.0,
+}
+
+# Filters a session can pick, as /api/facets names them
+FILTER_NAMES = ("color", "brand", "gender", "on_sale", "price_range")
+
+# Latency histogram buckets: the first holds everything up to MIN_LATENCY
+# and each one after that is GROWTH times as wide as the one before, so any
+# percentile is within 2% of the true latency
+MIN_LATENCY = 0.00001
+GROWTH = 1.02
+
+# Bytes read from a response at a time; bodies are counted, not kept
+READ_SIZE = 64 * 1024
+
+
+class LatencyHistogram:
+    """
+    Counts of request latencies in exponentially growing buckets.
+
+    A histogram takes the same memory however many latencies it counts,
+    and histograms from several threads can be merged.
+
+    Attributes:
+        buckets (Counter): Maps bucket number -> number of latencies in it
+        count (int): Number of latencies recorded
+        total (float): Sum of the latencies, in seconds
+        max (float): Longest latency, in seconds
+    """
+
+    def __init__(self):
+        self.buckets = Counter()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    @staticmethod
+    def upper_bound(bucket):
+        """
+        Args:
+            bucket (int): A bucket number
+
+        Returns:
+            float: The longest latency in the bucket, in seconds
+        """
+        return MIN_LATENCY * GROWTH**bucket
+
+    def record(self, seconds):
+        """
+        Count one latency.
+
+        Args:
+            seconds (float): The latency
+        """
+        bucket = 0
+        if seconds > MIN_LATENCY:
+            bucket = math.ceil(math.log(seconds / MIN_LATENCY, GROWTH))
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def merge(self, other):
+        """
+        Add the latencies counted by another histogram to this one.
+
+        Args:
+            other (LatencyHistogram): The histogram to add
+        """
+        self.buckets.update(other.buckets)
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentile(self, percentile):
+        """
+        Get a latency percentile.
+
+        Args:
+            percentile (float): Percentile to get, e.g. 99.9
+
+        Returns:
+            float: Latency in seconds that this percentage of the latencies
+            are at most, or None if there are none
+        """
+        if not self.count:
+            return None
+        rank = max(math.ceil(percentile / 100 * self.count), 1)
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.upper_bound(bucket), self.max)
+        return self.max
+
+    def to_dict(self):
+        """
+        Returns:
+            dict: Summary of the latencies in milliseconds, with "buckets"
+            listing [upper bound, count] of every bucket that isn't empty
+        """
+        summary = {"count": self.count}
+        for name, percentile in (("p50", 50), ("p95", 95), ("p99", 99), ("p999", 99.9)):
+            value = self.percentile(percentile)
+            summary[f"{name}_ms"] = None if value is None else round(value * 1000, 3)
+        summary["mean_ms"] = round(self.total / self.count * 1000, 3) if self.count else None
+        summary["max_ms"] = round(self.max * 1000, 3)
+        summary["buckets"] = [
+            [round(self.upper_bound(bucket) * 1000, 4), self.buckets[bucket]]
+            for bucket in sorted(self.buckets)
+        ]
+        return summary
+
+
+class EndpointStats:
+    """
+    Requests made to one endpoint.
+
+    Attributes:
+        latencies (LatencyHistogram): Latency of every request, including
+            failed ones
+        errors (Counter): Maps HTTP status (for 4xx and 5xx responses) or
+            exception name -> number of failed requests
+        bytes (int): Response body bytes received
+    """
+
+    def __init__(self):
+        self.latencies = LatencyHistogram()
+        self.errors = Counter()
+        self.bytes = 0
+
+    def merge(self, other):
+        self.latencies.merge(other.latencies)
+        self.errors.update(other.errors)
+        self.bytes += other.bytes
+
+    def to_dict(self, seconds):
+        """
+        Args:
+            seconds (float): Length of the measured period
+
+        Returns:
+            dict: Requests, throughput, error rate and latencies
+        """
+        requests = self.latencies.count
+        errors = sum(self.errors.values())
+        return {
+            "requests": requests,
+            "requests_per_second": round(requests / seconds, 2),
+            "megabytes_per_second": round(self.bytes / seconds / 1e6, 3),
+            "errors": errors,
+            "error_rate": round(errors / requests, 4) if requests else 0.0,
+            "errors_by_cause": {str(cause): count for cause, count in self.errors.items()},
+            "latency": self.latencies.to_dict(),
+        }
+
+
+class VirtualUser(threading.Thread):
+    """
+    A simulated user browsing the feed on its own connection.
+
+    Attributes:
+        stats (dict): Maps endpoint label, e.g. "GET /api/products" ->
+            EndpointStats of the requests made after the warm-up
+    """
+
+    def __init__(self, host, port, model, values, seed, measure_from, deadline, options):
+        """
+        Args:
+            host (str): Server host name
+            port (int): Server port
+            model (dict): Session model, like SESSION_MODEL
+            values (dict): Maps filter name -> (values, weights) to pick
+                from (see discover_values)
+            seed (int): Seed for this user's random choices
+            measure_from (float): time.monotonic() after which finished
+                requests are counted
+            deadline (float): time.monotonic() at which to stop
+            options (dict): "timeout" (seconds), "keep_alive" (bool) and
+                "accept_encoding" (str or None)
+        """
+        super().__init__(daemon=True)
+        self.connection = http.client.HTTPConnection(host, port, timeout=options["timeout"])
+        self.model = model
+        self.values = values
+        self.generator = random.Random(seed)
+        self.measure_from = measure_from
+        self.deadline = deadline
+        self.headers = {}
+        if options["accept_encoding"]:
+            self.headers["Accept-Encoding"] = options["accept_encoding"]
+        if not options["keep_alive"]:
+            self.headers["Connection"] = "close"
+        self.stats = {}
+
+    def running(self):
+        return time.monotonic() < self.deadline
+
+    def request(self, method, path, query=None, body=None):
+        """
+        Make one request and count it, unless the time is up.
+
+        Returns:
+            bool: False once the deadline has passed
+        """
+        if not self.running():
+            return False
+        url = path if query is None else f"{path}?{urlencode(query)}"
+        headers = dict(self.headers)
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+        start = time.monotonic()
+        error = None
+        size = 0
+        try:
+            self.connection.request(method, url, body, headers)
+            response = self.connection.getresponse()
+            while True:
+                chunk = response.read(READ_SIZE)
+                if not chunk:
+                    break
+                size += len(chunk)
+            if response.status >= 400:
+                error = response.status
+            if response.will_close:
+                self.connection.close()
+        except (OSError, http.client.HTTPException) as exception:
+            error = type(exception).__name__
+            # Connect again for the next request
+            self.connection.close()
+        end = time.monotonic()
+
+        # Counted by when they finish, so a request that has been waiting
+        # since the warm-up (e.g. for a busy single-threaded server) counts
+        if end >= self.measure_from:
+            stats = self.stats.setdefault(f"{method} {path}", EndpointStats())
+            stats.latencies.record(end - start)
+            stats.bytes += size
+            if error is not None:
+                stats.errors[error] += 1
+        think_time = self.model["think_time"]
+        if think_time > 0:
+            time.sleep(
+                max(min(self.generator.expovariate(1 / think_time), self.deadline - end), 0)
+            )
+        return True
+
+    def pick_filters(self):
+        filters = {}
+        for name in FILTER_NAMES:
+            if name in self.values and self.generator.random() < self.model["filter_rate"]:
+                values, weights = self.values[name]
+                filters[name] = self.generator.choices(values, weights)[0]
+        return filters
+
+    def page_through(self, filters, sort_by):
+        # A blank sort_by keeps the server from using saved filters when
+        # there are no others
+        query = {**filters, "sort_by": sort_by or "", "items_per_page": self.model["items_per_page"]}
+        page = 1
+        while self.request("GET", "/api/products", {**query, "page": page}):
+            if page >= self.model["max_pages"] or self.generator.random() >= self.model["next_page_rate"]:
+                return
+            page += 1
+
+    def run_session(self):
+        model = self.model
+        random_rate = self.generator.random
+        filters = self.pick_filters()
+        while self.running():
+            if random_rate() < model["set_filters_rate"]:
+                self.request("POST", "/api/set-filters", body=json.dumps(filters))
+            self.request("GET", "/api/facets", {**filters, "sort_by": ""})
+            sort_by = self.generator.choice((None,) + SORT_ORDERS)
+            self.page_through(filters, sort_by)
+            while random_rate() < model["change_sort_rate"]:
+                sort_by = self.generator.choice(
+                    [other for other in (None,) + SORT_ORDERS if other != sort_by]
+                )
+                self.page_through(filters, sort_by)
+            if random_rate() < model["download_rate"]:
+                self.request("GET", "/data.jsonl", {**filters, "sort_by": ""})
+            if random_rate() >= model["change_filters_rate"]:
+                return
+            filters = self.pick_filters()
+
+    def run(self):
+        try:
+            while self.running():
+                self.run_session()
+        finally:
+            self.connection.close()
+
+
+def discover_values(host, port, timeout=30):
+    """
+    Get the filter values that sessions pick from, from /api/facets.
+
+    Args:
+        host (str): Server host name
+        port (int): Server port
+        timeout (float): Seconds to wait for the response (default: 30)
+
+    Returns:
+        dict: Maps filter name -> (values, product counts) of the values
+        that some product has
+    """
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request("GET", "/api/facets?sort_by=")
+        response = connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"/api/facets returned {response.status}")
+    finally:
+        connection.close()
+    values = {}
+    for name, counts in json.loads(body)["facets"].items():
+        # Products without a value can't be filtered for
+        counts = {value: count for value, count in counts.items() if count and value != "null"}
+        if name in FILTER_NAMES and counts:
+            values[name] = (list(counts), list(counts.values()))
+    return values
+
+
+def run_load_test(url, model=None, users=16, duration=30, warmup=2, seed=0, options=None):
+    """
+    Simulate users browsing the feed and measure the server's responses.
+
+    Args:
+        url (str): Base URL of a running server, e.g. "http://localhost:3000"
+        model (dict, optional): Session model, like SESSION_MODEL (default:
+            SESSION_MODEL)
+        users (int): Number of simultaneous users (default: 16)
+        duration (float): Seconds to measure for (default: 30)
+        warmup (float): Seconds to run before measuring (default: 2)
+        seed (int): Seed for the users' choices (default: 0)
+        options (dict, optional): Connection options (see VirtualUser;
+            default: 30s timeout, keep-alive, gzip)
+
+    Returns:
+        dict: Report with "endpoints" mapping each endpoint label to its
+        statistics (see EndpointStats.to_dict), and "total" for all of them
+    """
+    model = {**SESSION_MODEL, **(model or {})}
+    options = {"timeout": 30, "keep_alive": True, "accept_encoding": "gzip", **(options or {})}
+    parts = urlsplit(url)
+    host, port = parts.hostname or "localhost", parts.port or 80
+    values = discover_values(host, port, options["timeout"])
+
+    measure_from = time.monotonic() + warmup
+    deadline = measure_from + duration
+    workers = [
+        VirtualUser(host, port, model, values, seed * 100003 + user, measure_from, deadline, options)
+        for user in range(users)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    endpoints = {}
+    total = EndpointStats()
+    for worker in workers:
+        for endpoint, stats in worker.stats.items():
+            endpoints.setdefault(endpoint, EndpointStats()).merge(stats)
+            total.merge(stats)
+    return {
+        "url": url,
+        "users": users,
+        "duration": duration,
+        "warmup": warmup,
+        "seed": seed,
+        "session_model": model,
+        "options": options,
+        "endpoints": {
+            endpoint: stats.to_dict(duration) for endpoint, stats in sorted(endpoints.items())
+        },
+        "total": total.to_dict(duration),
+    }
+
+
+def start_server(mode, port, workers, timeout=120):
+    """
+    Start server.py in a concurrency mode and wait until it answers.
+
+    Args:
+        mode (str): One of server.py's --mode choices
+        port (int): Port to listen on
+        workers (int): Worker threads, for the threaded and asyncio modes
+        timeout (float): Seconds to wait for the catalog to load
+            (default: 120)
+
+    Returns:
+        subprocess.Popen: The server process
+
+    Raises:
+        RuntimeError: If the server exits or doesn't answer in time
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    process = subprocess.Popen(
+        [sys.executable, "server.py", "--mode", mode, "--port", str(port), "--workers", str(workers)],
+        cwd=directory,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    give_up = time.monotonic() + timeout
+    while time.monotonic() < give_up:
+        if process.poll() is not None:
+            raise RuntimeError(f"server.py --mode {mode} exited with {process.returncode}")
+        connection = http.client.HTTPConnection("localhost", port, timeout=5)
+        try:
+            connection.request("GET", "/api/cache-stats")
+            if connection.getresponse().status == 200:
+                return process
+        except (OSError, http.client.HTTPException):
+            time.sleep(0.2)
+        finally:
+            connection.close()
+    stop_server(process)
+    raise RuntimeError(f"server.py --mode {mode} didn't answer within {timeout}s")
+
+
+def stop_server(process):
+    """Stop a server started by start_server, as Ctrl+C would."""
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def print_report(title, report):
+    """Print a load test report's statistics and latency histograms."""
+    print(title)
+    print(
+        f"{'endpoint':<22}{'requests':>10}{'req/s':>9}{'MB/s':>8}{'errors':>8}"
+        f"{'p50':>9}{'p95':>9}{'p99':>9}{'p99.9':>9}{'max':>9}"
+    )
+    rows = list(report["endpoints"].items()) + [("all", report["total"])]
+    for endpoint, stats in rows:
+        latency = stats["latency"]
+        cells = [
+            "-" if latency[name] is None else f"{latency[name]:.1f}"
+            for name in ("p50_ms", "p95_ms", "p99_ms", "p999_ms", "max_ms")
+        ]
+        print(
+            f"{endpoint:<22}{stats['requests']:>10}{stats['requests_per_second']:>9.1f}"
+            f"{stats['megabytes_per_second']:>8.2f}{stats['error_rate']:>8.1%}"
+            + "".join(f"{cell:>9}" for cell in cells)
+        )
+    print("Latencies in ms.")
+    for endpoint, stats in report["endpoints"].items():
+        causes = ", ".join(f"{cause}: {count}" for cause, count in stats["errors_by_cause"].items())
+        if causes:
+            print(f"{endpoint} errors: {causes}")
+    for endpoint, stats in report["endpoints"].items():
+        print(f"\n{endpoint} latency histogram")
+        print_histogram(stats["latency"]["buckets"])
+    print()
+
+
+def print_histogram(buckets, width=40):
+    """
+    Print latencies grouped into ranges that double in size.
+
+    Args:
+        buckets (list): [upper bound in ms, count] pairs, as in
+            LatencyHistogram.to_dict
+        width (int): Characters in the longest bar (default: 40)
+    """
+    ranges = Counter()
+    for upper_bound, count in buckets:
+        # The smallest power of two (from 1/16 ms) at least as big
+        ranges[2.0 ** max(math.ceil(math.log2(upper_bound)), -4)] += count
+    if not ranges:
+        return
+    largest = max(ranges.values())
+    limit = min(ranges)
+    while limit <= max(ranges):
+        count = ranges[limit]
+        bar = "#" * math.ceil(count / largest * width) if count else ""
+        print(f"  <= {limit:>9g} ms {count:>9}  {bar}")
+        limit *= 2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Simulate users browsing the product feed and report "
+        "throughput, errors and latency per endpoint."
+    )
+    parser.add_argument(
+        "--url", default="http://localhost:3000", help="server to test (default: %(default)s)"
+    )
+    parser.add_argument(
+        "--start-server",
+        nargs="+",
+        choices=["single", "threaded", "asyncio"],
+        metavar="MODE",
+        help="start server.py in each of these modes (single, threaded, asyncio) in "
+        "turn on the --url port, instead of testing a running server",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="worker threads for servers started with --start-server (default: 8)",
+    )
+    parser.add_argument(
+        "--users", type=int, default=16, help="simultaneous users (default: 16)"
+    )
+    parser.add_argument(
+        "--duration", type=float, default=30, help="seconds to measure for (default: 30)"
+    )
+    parser.add_argument(
+        "--warmup", type=float, default=2, help="seconds to run before measuring (default: 2)"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="random seed (default: 0)")
+    parser.add_argument(
+        "--session", help="JSON file overriding SESSION_MODEL's rates and think time"
+    )
+    parser.add_argument(
+        "--timeout", type=float, default=30, help="seconds before a request fails (default: 30)"
+    )
+    parser.add_argument(
+        "--no-keep-alive",
+        action="store_true",
+        help="open a new connection for every request",
+    )
+    parser.add_argument(
+        "--accept-encoding",
+        default="gzip",
+        help="Accept-Encoding header to send, or '' for none (default: gzip)",
+    )
+    parser.add_argument("--output", help="file to write the JSON report to")
+    args = parser.parse_args(argv)
+
+    model = {}
+    if args.session:
+        with open(args.session) as file:
+            model = json.load(file)
+        unknown = set(model) - set(SESSION_MODEL)
+        if unknown:
+            parser.error(f"unknown session model keys: {', '.join(sorted(unknown))}")
+    options = {
+        "timeout": args.timeout,
+        "keep_alive": not args.no_keep_alive,
+        "accept_encoding": args.accept_encoding or None,
+    }
+
+    def run(title):
+        report = run_load_test(
+            args.url, model, args.users, args.duration, args.warmup, args.seed, options
+        )
+        print_report(f"{title}: {args.users} users for {args.duration:g}s", report)
+        return report
+
+    if args.start_server:
+        port = urlsplit(args.url).port or 80
+        reports = {}
+        for mode in args.start_server:
+            process = start_server(mode, port, args.workers)
+            try:
+                reports[mode] = run(f"server.py --mode {mode}")
+            finally:
+                stop_server(process)
+        if len(reports) > 1:
+            print(f"{'mode':<12}{'req/s':>9}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'p99.9':>9}")
+            for mode, report in reports.items():
+                total = report["total"]
+                latency = total["latency"]
+                cells = [
+                    "-" if latency[name] is None else f"{latency[name]:.1f}"
+                    for name in ("p50_ms", "p95_ms", "p99_ms", "p999_ms")
+                ]
+                print(
+                    f"{mode:<12}{total['requests_per_second']:>9.1f}{total['error_rate']:>8.1%}"
+                    + "".join(f"{cell:>9}" for cell in cells)
+                )
+            print("Latencies in ms, for all endpoints together.")
+        output = {"modes": reports}
+    else:
+        output = run(args.url)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=2)
+            file.write("\n")
+        print(f"Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
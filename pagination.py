@@ -5,7 +5,11 @@ This module contains functions to paginate product data.
 Students will implement the pagination logic for each function below.
 """
 
+import base64
+import json
 import math
+from bisect import bisect_right
+from itertools import islice
 
 
 def get_total_pages(products, items_per_page=50):
@@ -36,7 +40,9 @@ def get_page_data(products, page_number, items_per_page=50):
     Get the products for a specific page.
 
     Args:
-        products (list): List of product dictionaries
+        products (list): List of product dictionaries. Any other iterable
+            (such as a generator of filtered products) is consumed lazily
+            and only read as far as the end of the requested page.
         page_number (int): The page number to retrieve (1-indexed, so page 1 is the first page)
         items_per_page (int): Number of items to display per page (default: 50)
 
@@ -53,11 +59,24 @@ def get_page_data(products, page_number, items_per_page=50):
     Hint: Calculate the start_index and end_index based on page_number and items_per_page.
     """
     # YOUR CODE HERE
-    end_index = items_per_page * page_number
-    start_index = end_index - items_per_page
-    end_index -= 1
-    start_index -= 1
-    return [start_index, end_index]
+    start_index = get_page_offset(page_number, items_per_page)
+    if not hasattr(products, "__getitem__"):
+        return list(islice(products, start_index, start_index + items_per_page))
+    return products[start_index:start_index + items_per_page]
+
+
+def get_page_offset(page_number, items_per_page=50):
+    """
+    Get the index of the first product on a page.
+
+    Args:
+        page_number (int): The page number (1-indexed)
+        items_per_page (int): Number of items to display per page (default: 50)
+
+    Returns:
+        int: Index of the first item on the page (0-indexed)
+    """
+    return (page_number - 1) * items_per_page
 
 
 def create_pagination_info(products, page_number, items_per_page=50):
@@ -99,16 +118,38 @@ def create_pagination_info(products, page_number, items_per_page=50):
     Hint: has_next is True if current_page < total_pages
     """
     # YOUR CODE HERE
-    
-    x = get_page_data(products, page_number, items_per_page=50)
+    return create_pagination_info_from_count(len(products), page_number, items_per_page)
+
+
+def create_pagination_info_from_count(total_items, page_number, items_per_page=50, margin=None):
+    """
+    Create a dictionary with pagination information from a count of items.
+
+    This gives the same information as create_pagination_info(), but only
+    needs to know how many items there are, so the full list never has to
+    be built.
+
+    Args:
+        total_items (int): Total number of items
+        page_number (int): The current page number (1-indexed)
+        items_per_page (int): Number of items to display per page (default: 50)
+        margin (int, optional): If the count is an estimate, how far off it
+            may be. The returned dictionary then also has 'total_is_estimate'
+            (True) and 'total_items_margin' keys.
+
+    Returns:
+        dict: Dictionary containing pagination info (see create_pagination_info)
+    """
+    start_index = get_page_offset(page_number, items_per_page)
+    total_pages = math.ceil(total_items / items_per_page)
 
     pagination_info = {}
     pagination_info.update({"current_page":page_number})
-    pagination_info.update({"total_pages":get_total_pages(products, items_per_page=50)})
+    pagination_info.update({"total_pages":total_pages})
     pagination_info.update({"items_per_page":items_per_page})
-    pagination_info.update({"total_items":len(products)})
+    pagination_info.update({"total_items":total_items})
 
-    if pagination_info["current_page"] >= 1:
+    if pagination_info["current_page"] > 1:
         pagination_info.update({"has_previous":True})
     else:
         pagination_info.update({"has_previous":False})
@@ -118,10 +159,104 @@ def create_pagination_info(products, page_number, items_per_page=50):
     else:
         pagination_info.update({"has_next":False})
 
-    pagination_info.update({"start_index":x[0]})
-    pagination_info.update({"end_index":x[1]})
+    pagination_info.update({"start_index":start_index})
+    pagination_info.update({"end_index":min(start_index + items_per_page, total_items) - 1})
 
-    
+    if margin is not None:
+        pagination_info.update({"total_is_estimate":True})
+        pagination_info.update({"total_items_margin":margin})
 
+    return pagination_info
 
-    
+
+def encode_cursor(sort_key, product_id):
+    """
+    Encode the position of the last item on a page as an opaque cursor.
+
+    Args:
+        sort_key (float): The item's value in the sort order (e.g. its price)
+        product_id: The item's product_id, which tells apart items with the
+            same sort key
+
+    Returns:
+        str: URL-safe cursor to pass back for the next page
+    """
+    data = json.dumps([sort_key, product_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor made by encode_cursor().
+
+    Args:
+        cursor (str): The cursor
+
+    Returns:
+        tuple: (sort_key, product_id)
+
+    Raises:
+        ValueError: If the cursor isn't valid
+    """
+    padded_cursor = cursor + "=" * (-len(cursor) % 4)
+    try:
+        sort_key, product_id = json.loads(base64.urlsafe_b64decode(padded_cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("invalid cursor") from None
+    if isinstance(sort_key, bool) or not isinstance(sort_key, (int, float)):
+        raise ValueError("invalid cursor")
+    # json.loads() accepts NaN and Infinity, which no item sorts next to
+    if not math.isfinite(sort_key):
+        raise ValueError("invalid cursor")
+    # Product ids are looked up in a dictionary, so they must be scalars
+    if product_id is not None and not isinstance(product_id, (str, int, float)):
+        raise ValueError("invalid cursor")
+    if isinstance(product_id, float) and not math.isfinite(product_id):
+        raise ValueError("invalid cursor")
+    return sort_key, product_id
+
+
+def get_keyset_page(items, after=None, items_per_page=50, key=None):
+    """
+    Get the page of items that follows a position in a sorted list.
+
+    Unlike get_page_data() this doesn't need to know how many items came
+    before the page: the start of the page is found with a binary search,
+    so a page deep into the list costs the same as the first one.
+
+    Args:
+        items (list): Items sorted in ascending order of key(item)
+        after: key() of the last item already seen, or None for the first page
+        items_per_page (int): Number of items to display per page (default: 50)
+        key (callable, optional): Gives each item's position in the order
+            (default: the item itself)
+
+    Returns:
+        tuple: (page, has_next) where page is the items after `after` and
+        has_next is True if there are more items after the page
+    """
+    start = 0 if after is None else bisect_right(items, after, key=key)
+    end = start + items_per_page
+    return items[start:end], end < len(items)
+
+
+def create_keyset_info(page, items_per_page, has_next, next_cursor):
+    """
+    Create a dictionary with pagination information for a cursor-based page.
+
+    Args:
+        page (list): The items on the page
+        items_per_page (int): Number of items to display per page
+        has_next (bool): True if there is a next page
+        next_cursor (str): Cursor for the next page, or None if there isn't one
+
+    Returns:
+        dict: Dictionary with 'items_per_page', 'item_count', 'has_next'
+        and 'next_cursor' keys
+    """
+    return {
+        "items_per_page": items_per_page,
+        "item_count": len(page),
+        "has_next": has_next,
+        "next_cursor": next_cursor if has_next else None,
+    }
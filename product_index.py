@@ -0,0 +1,722 @@
+"""
+Product Index Module
+
+This module builds lookup structures over a list of products so that filters
+can be answered without scanning every product.
+
+Each product is identified by its row id, which is its position in the
+product list. For every categorical field an inverted index (a "posting
+list") maps each value to the sorted row ids of the products that have it.
+The length of each posting list is also an exact count of how many products
+have that value, which the query planner (see query_planner.py) uses to
+apply the most selective filters first, so the work done depends on the
+number of matches rather than on the size of the catalog.
+
+Prices are indexed separately: the effective price of every product is kept
+in a sorted array alongside its row id, so a price range is found with two
+binary searches.
+
+Every supported sort order is also computed once, as a permutation of the
+row ids plus the rank of each row in that permutation, so filtered results
+can be put in order without comparing products again.
+"""
+
+import heapq
+from array import array
+from collections import deque
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, chain, compress, islice, repeat
+
+from query_planner import make_row_check, plan_query
+
+
+# Fields that get a posting list for every distinct value
+CATEGORICAL_FIELDS = ("color", "designer", "gender", "on_sale")
+
+# Sort orders offered by the feed, matching the "sort_by" filter values
+SORT_ORDERS = ("price_high_to_low", "price_low_to_high", "popularity")
+
+EMPTY_POSTING_LIST = array("l")
+
+
+def column_values(products, field):
+    """
+    Get every product's value for one field.
+
+    Product lists that store their products as columns (such as
+    snapshot.SnapshotProducts) provide a column_values() method, which is
+    used so that the products don't have to be built.
+
+    Args:
+        products (list): Product dictionaries, or a columnar product list
+        field (str): Field name
+
+    Returns:
+        Sequence of values (None where a product doesn't have the field)
+    """
+    get_column = getattr(products, "column_values", None)
+    if get_column is not None:
+        return get_column(field)
+    return [product.get(field) for product in products]
+
+
+def _positions(order, positions=None, start=0, end=None):
+    # The inverse of a permutation: the position of each row id in order.
+    # Given the positions of an earlier order that only differs between
+    # start and end, only those positions are set again.
+    if positions is None:
+        positions = array("l", bytes(array("l").itemsize * len(order)))
+    if end is None:
+        end = len(order)
+    # Equivalent to setting positions[row_id] = position in a loop, but the
+    # loop runs in C
+    deque(map(positions.__setitem__, order[start:end], range(start, end)), maxlen=0)
+    return positions
+
+
+def _copy(values, typecode):
+    # A copy of an array, or of a memoryview onto a snapshot, as an array
+    copied = array(typecode)
+    copied.frombytes(memoryview(values).cast("B"))
+    return copied
+
+
+def _common_length(a, b, from_end=False):
+    # Length of the longest common prefix (or suffix) of two arrays, found
+    # by comparing slices, which is done in C
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        middle = (low + high + 1) // 2
+        if from_end:
+            same = a[len(a) - middle :] == b[len(b) - middle :]
+        else:
+            same = a[:middle] == b[:middle]
+        if same:
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def _effective_price(product):
+    # The same as filter.get_effective_price(), for a product dictionary
+    if product.get("on_sale"):
+        return product.get("discount_price")
+    return product.get("regular_price")
+
+
+def _merge_rows(row_ids, removed, added):
+    # A sorted array of row ids with some taken out and others put in,
+    # copying the rows in between rather than looking at each of them
+    merged = array("l")
+    start = 0
+    # A row that is both removed and added is removed first
+    changes = chain(zip(removed, repeat(False)), zip(added, repeat(True)))
+    for row_id, is_added in sorted(changes):
+        position = bisect_left(row_ids, row_id, start)
+        merged.extend(row_ids[start:position])
+        if is_added:
+            merged.append(row_id)
+            start = position
+        else:
+            start = position + 1
+    merged.extend(row_ids[start:])
+    return merged
+
+
+def _insert_rows(order, row_ids, key):
+    # Insert row ids into an order sorted by key. A few rows are placed with
+    # binary searches, copying the rows between them; many rows are sorted
+    # in with everything else.
+    if len(row_ids) * max(len(order).bit_length(), 1) > len(order):
+        return array("l", sorted(chain(order, row_ids), key=key))
+    merged = array("l")
+    start = 0
+    for row_id in sorted(row_ids, key=key):
+        position = bisect_left(order, key(row_id), start, key=key)
+        merged.extend(order[start:position])
+        merged.append(row_id)
+        start = position
+    merged.extend(order[start:])
+    return merged
+
+
+class ProductIndex:
+    """
+    Inverted index over the categorical fields of a product list.
+
+    Attributes:
+        products (list): The product dictionaries the index was built from
+        field_values (dict): Maps each of CATEGORICAL_FIELDS -> the value of
+            that field for each product, by row id
+        postings (dict): Maps field name -> {value: sorted array of row ids}
+        effective_prices (array): Effective price of each product, by row id
+        price_order (array): Row ids ordered by effective price (ascending)
+        sorted_prices (array): Effective prices in price_order order
+        item_scores (array): Popularity score of each product, by row id
+        row_ids_by_product_id (dict): Maps each product_id -> its row id
+        sort_orders (dict): Maps each of SORT_ORDERS -> row ids in that order
+        ranks (dict): Maps each of SORT_ORDERS -> position of each row id
+            in the corresponding sort order
+    """
+
+    def __init__(self, products):
+        self.products = products
+        # Each field is read a column at a time, so products stored as
+        # columns (see snapshot.py) don't have to be built one by one
+        self.field_values = {
+            field: column_values(products, field) for field in CATEGORICAL_FIELDS
+        }
+        self.postings = {}
+        for field, field_values in self.field_values.items():
+            values = self.postings[field] = {}
+            for row_id, value in enumerate(field_values):
+                posting_list = values.get(value)
+                if posting_list is None:
+                    posting_list = values[value] = array("l")
+                posting_list.append(row_id)
+        self.row_ids_by_product_id = dict(
+            zip(column_values(products, "product_id"), range(len(products)))
+        )
+
+        # The same as filter.get_effective_price() for each product
+        self.effective_prices = array(
+            "d",
+            (
+                discount_price if on_sale else regular_price
+                for on_sale, discount_price, regular_price in zip(
+                    self.field_values["on_sale"],
+                    column_values(products, "discount_price"),
+                    column_values(products, "regular_price"),
+                )
+            ),
+        )
+        self.price_order = array(
+            "l", sorted(range(len(products)), key=self.effective_prices.__getitem__)
+        )
+        self.sorted_prices = array(
+            "d", (self.effective_prices[row_id] for row_id in self.price_order)
+        )
+
+        # sorted() is stable, and so is reverse=True, so products with equal
+        # keys stay in catalog order just like the sort_by_* functions
+        all_rows = range(len(products))
+        self.item_scores = array("d", column_values(products, "item_score"))
+        self.sort_orders = {
+            "price_low_to_high": self.price_order,
+            "price_high_to_low": array(
+                "l",
+                sorted(all_rows, key=self.effective_prices.__getitem__, reverse=True),
+            ),
+            "popularity": array(
+                "l", sorted(all_rows, key=self.item_scores.__getitem__, reverse=True)
+            ),
+        }
+        self.ranks = {
+            sort_by: _positions(order) for sort_by, order in self.sort_orders.items()
+        }
+
+    @classmethod
+    def from_arrays(cls, products, arrays, metadata):
+        """
+        Rebuild an index from the output of to_arrays(), without sorting.
+
+        The arrays can be any sequences of integers or floats, such as
+        memoryviews onto a memory-mapped snapshot (see snapshot.py).
+
+        Args:
+            products (list): The products the index was built from
+            arrays (dict): The arrays returned by to_arrays()
+            metadata (dict): The metadata returned by to_arrays()
+
+        Returns:
+            ProductIndex: The index
+        """
+        index = cls.__new__(cls)
+        index.products = products
+        index.field_values = {
+            field: column_values(products, field) for field in CATEGORICAL_FIELDS
+        }
+        index.postings = {}
+        for field in CATEGORICAL_FIELDS:
+            rows = arrays[f"postings.{field}"]
+            offsets = arrays[f"postings_offsets.{field}"]
+            index.postings[field] = {
+                value: rows[offsets[i] : offsets[i + 1]]
+                for i, value in enumerate(metadata["posting_values"][field])
+            }
+        index.row_ids_by_product_id = dict(
+            zip(column_values(products, "product_id"), range(len(products)))
+        )
+        index.effective_prices = arrays["effective_prices"]
+        index.price_order = arrays["price_order"]
+        index.sorted_prices = arrays["sorted_prices"]
+        index.item_scores = arrays["item_scores"]
+        index.sort_orders = {
+            sort_by: arrays[f"sort_order.{sort_by}"] for sort_by in SORT_ORDERS
+        }
+        index.ranks = {sort_by: arrays[f"rank.{sort_by}"] for sort_by in SORT_ORDERS}
+        return index
+
+    def to_arrays(self):
+        """
+        Export the index's arrays, so it can be saved and rebuilt later.
+
+        Returns:
+            tuple: (arrays, metadata) where arrays maps names -> arrays and
+            metadata is a JSON-compatible dictionary of everything else
+            needed by from_arrays()
+        """
+        arrays = {
+            "effective_prices": self.effective_prices,
+            "price_order": self.price_order,
+            "sorted_prices": self.sorted_prices,
+            "item_scores": self.item_scores,
+        }
+        for sort_by in SORT_ORDERS:
+            arrays[f"sort_order.{sort_by}"] = self.sort_orders[sort_by]
+            arrays[f"rank.{sort_by}"] = self.ranks[sort_by]
+
+        posting_values = {}
+        for field, postings in self.postings.items():
+            posting_values[field] = list(postings)
+            # Every posting list of the field, one after another
+            arrays[f"postings.{field}"] = array("l", chain.from_iterable(postings.values()))
+            arrays[f"postings_offsets.{field}"] = array(
+                "l", accumulate((len(rows) for rows in postings.values()), initial=0)
+            )
+        return arrays, {"posting_values": posting_values}
+
+    def apply_changes(self, products, changed_rows=(), deleted_rows=()):
+        """
+        Build the index of an updated product list from this index.
+
+        Only the products that were added or changed are read. Everything
+        else is carried over: posting lists that didn't change are shared,
+        and each sort order is updated by taking the changed rows out and
+        inserting them again where they now belong. This index isn't
+        modified, so requests still using it aren't affected.
+
+        Args:
+            products (list): The updated products: this index's products,
+                with changed_rows replaced and deleted_rows left out,
+                followed by any new products
+            changed_rows (iterable): Row ids (in this index) of products
+                that have been replaced
+            deleted_rows (iterable): Row ids (in this index) of products
+                that have been removed
+
+        Returns:
+            ProductIndex: The index of the updated products, the same as
+            ProductIndex(products) would build
+        """
+        old_count = len(self)
+        deleted = set(deleted_rows)
+        changed = set(changed_rows) - deleted
+        # Rows to take out of the posting lists and sort orders
+        dirty_rows = list(chain(changed, deleted))
+        dirty = bytearray(old_count)
+        for row_id in dirty_rows:
+            dirty[row_id] = 1
+
+        if deleted:
+            # Every row after a deleted one moves up
+            keep = bytearray(b"\x01") * old_count
+            for row_id in deleted:
+                keep[row_id] = 0
+            new_ids = array("l", accumulate(keep, initial=0))
+
+            def carry_over(values, typecode=None):
+                kept = compress(values, keep)
+                return list(kept) if typecode is None else array(typecode, kept)
+
+            def renumber(row_ids):
+                # The row ids that are left, moved up
+                return array(
+                    "l", [new_ids[row_id] for row_id in row_ids if not dirty[row_id]]
+                )
+
+            changed = {new_ids[row_id] for row_id in changed}
+        else:
+
+            def carry_over(values, typecode=None):
+                return list(values) if typecode is None else _copy(values, typecode)
+        added = range(old_count - len(deleted), len(products))
+        inserted = sorted(changed) + list(added)
+        inserted_products = [products[row_id] for row_id in inserted]
+
+        index = ProductIndex.__new__(ProductIndex)
+        index.products = products
+        index.field_values = {}
+        for field, values in self.field_values.items():
+            values = list(carry_over(values))
+            values.extend([None] * len(added))
+            for row_id, product in zip(inserted, inserted_products):
+                values[row_id] = product.get(field)
+            index.field_values[field] = values
+
+        index.postings = {}
+        for field, postings in self.postings.items():
+            # The rows each value's posting list loses and gains
+            old_values = self.field_values[field]
+            removals = {}
+            for row_id in dirty_rows:
+                removals.setdefault(old_values[row_id], []).append(row_id)
+            additions = {}
+            for row_id in inserted:
+                additions.setdefault(index.field_values[field][row_id], []).append(row_id)
+            new_postings = index.postings[field] = {}
+            for value, row_ids in postings.items():
+                if deleted:
+                    row_ids = _merge_rows(renumber(row_ids), (), additions.pop(value, ()))
+                elif value in removals or value in additions:
+                    row_ids = _merge_rows(
+                        _copy(row_ids, "l"),
+                        removals.get(value, ()),
+                        additions.pop(value, ()),
+                    )
+                if row_ids:
+                    new_postings[value] = row_ids
+            for value, row_ids in additions.items():
+                new_postings[value] = array("l", row_ids)
+
+        index.effective_prices = carry_over(self.effective_prices, "d")
+        index.item_scores = carry_over(self.item_scores, "d")
+        index.effective_prices.extend(array("d", bytes(8 * len(added))))
+        index.item_scores.extend(array("d", bytes(8 * len(added))))
+        for row_id, product in zip(inserted, inserted_products):
+            index.effective_prices[row_id] = _effective_price(product)
+            index.item_scores[row_id] = product.get("item_score")
+
+        # The same order as the stable sorts in __init__: equal keys stay in
+        # row id order, in descending orders too
+        prices, scores = index.effective_prices, index.item_scores
+        sort_keys = {
+            "price_low_to_high": lambda row_id: (prices[row_id], row_id),
+            "price_high_to_low": lambda row_id: (-prices[row_id], row_id),
+            "popularity": lambda row_id: (-scores[row_id], row_id),
+        }
+        index.sort_orders = {}
+        index.ranks = {}
+        for sort_by, order in self.sort_orders.items():
+            if deleted:
+                new_order = _insert_rows(renumber(order), inserted, sort_keys[sort_by])
+                index.ranks[sort_by] = _positions(new_order)
+            else:
+                # Row ids are unchanged, so the changed rows can be cut out
+                # of the order at their ranks
+                rank = self.ranks[sort_by]
+                order = _copy(order, "l")
+                kept = array("l")
+                start = 0
+                for position in sorted(rank[row_id] for row_id in dirty_rows):
+                    kept.extend(order[start:position])
+                    start = position + 1
+                kept.extend(order[start:])
+                new_order = _insert_rows(kept, inserted, sort_keys[sort_by])
+                # Rows before the first change keep their positions, and so
+                # do rows after the last one if no rows were added
+                start = _common_length(order, new_order)
+                end = len(new_order)
+                if len(order) == end:
+                    end -= _common_length(order, new_order, from_end=True)
+                positions = _copy(rank, "l")
+                positions.extend(array("l", bytes(positions.itemsize * len(added))))
+                index.ranks[sort_by] = _positions(new_order, positions, start, end)
+            index.sort_orders[sort_by] = new_order
+        index.price_order = index.sort_orders["price_low_to_high"]
+        index.sorted_prices = array("d", map(prices.__getitem__, index.price_order))
+
+        if deleted:
+            # product_ids are unique, so a deleted row's id isn't on any
+            # other row
+            index.row_ids_by_product_id = {
+                product_id: new_ids[row_id]
+                for product_id, row_id in self.row_ids_by_product_id.items()
+                if keep[row_id]
+            }
+        else:
+            index.row_ids_by_product_id = dict(self.row_ids_by_product_id)
+        row_ids_by_product_id = index.row_ids_by_product_id
+        for row_id, product in zip(inserted, inserted_products):
+            product_id = product.get("product_id")
+            # Like __init__, the last row with a product_id wins
+            if row_ids_by_product_id.get(product_id, -1) <= row_id:
+                row_ids_by_product_id[product_id] = row_id
+        return index
+
+    def __len__(self):
+        return len(self.products)
+
+    def posting_list(self, field, value):
+        """
+        Get the row ids of products whose field equals value.
+
+        Args:
+            field (str): One of CATEGORICAL_FIELDS
+            value: The value to look up (e.g. "black", "gucci", True)
+
+        Returns:
+            array: Sorted row ids (empty if no product has that value)
+        """
+        return self.postings[field].get(value, EMPTY_POSTING_LIST)
+
+    def rows_in_price_range(self, min_price, max_price):
+        """
+        Get the row ids of products whose effective price is in a range.
+
+        Args:
+            min_price (float): Minimum price (inclusive)
+            max_price (float): Maximum price (inclusive)
+
+        Returns:
+            memoryview: Row ids ordered by price (not by row id). This is a
+            view onto price_order, so no rows are copied.
+        """
+        start = bisect_left(self.sorted_prices, min_price)
+        end = bisect_right(self.sorted_prices, max_price)
+        return memoryview(self.price_order)[start:end]
+
+    def lookup(self, criteria, price_range=None):
+        """
+        Find the products matching every field/value pair in criteria.
+
+        Args:
+            criteria (dict): Maps field name -> required value
+            price_range (tuple, optional): Tuple of (min_price, max_price)
+
+        Returns:
+            Sorted row ids of the matching products. If there are no criteria
+            and no price range every row matches and a range over all rows is
+            returned.
+        """
+        return plan_query(self, criteria, price_range).execute()
+
+    def count(self, criteria, price_range=None):
+        """
+        Count the products matching a lookup without listing them.
+
+        Args:
+            criteria (dict): Maps field name -> required value
+            price_range (tuple, optional): Tuple of (min_price, max_price)
+
+        Returns:
+            int: Exact number of matching products
+        """
+        return plan_query(self, criteria, price_range).count()
+
+    def estimate_count(self, criteria, price_range=None, sample_size=1000):
+        """
+        Estimate the number of products matching a lookup from a sample.
+
+        Args:
+            criteria (dict): Maps field name -> required value
+            price_range (tuple, optional): Tuple of (min_price, max_price)
+            sample_size (int): Maximum number of rows to check (default: 1000)
+
+        Returns:
+            tuple: (count, margin), see QueryPlan.estimate_count
+        """
+        return plan_query(self, criteria, price_range).estimate_count(sample_size)
+
+    def lookup_page(self, criteria, price_range=None, sort_by=None, offset=0, limit=50, start=0):
+        """
+        Find one page of the products matching a lookup, in sort order.
+
+        The sort order is walked from the start (or from a pagination
+        cursor's position), checking each row against the filters, until the
+        end of the page has been found. This only
+        pays off when matches are common enough to reach the end of the page
+        quickly; otherwise None is returned and the caller should use
+        lookup() and sort_row_ids() instead.
+
+        Args:
+            criteria (dict): Maps field name -> required value
+            price_range (tuple, optional): Tuple of (min_price, max_price)
+            sort_by (str, optional): One of SORT_ORDERS (default: catalog order)
+            offset (int): Number of matching rows to skip (default: 0)
+            limit (int): Maximum number of rows to return (default: 50)
+            start (int): Rank in the sort order to start walking from, e.g.
+                one past cursor_rank() (default: 0)
+
+        Returns:
+            array: Row ids of the page, or None if walking the sort order is
+            estimated to cost more than finding every match
+        """
+        order = self.sort_orders.get(sort_by)
+        if order is None:
+            order = range(len(self))
+        end = offset + limit
+        plan = plan_query(self, criteria, price_range)
+        if not plan.steps:
+            return array("l", order[start + offset:start + end])
+
+        # Costs are counted in row checks. Walking checks every row until the
+        # end of the page, assuming matches are spread evenly through the
+        # sort order.
+        expected_matches = max(plan.steps[-1].estimated_rows, 1)
+        walk_cost = min(len(self) - start, end * len(self) // expected_matches)
+        # Finding every match checks (or intersects) the first step's rows
+        # against every other step, then sorts them. Sorting costs about a
+        # check per comparison, but never more than a walk of the sort order,
+        # which takes about a third of a check per row.
+        lookup_cost = plan.steps[0].matching_rows * (len(plan.steps) - 1)
+        if sort_by in self.sort_orders:
+            lookup_cost += min(
+                len(self) // 3,
+                expected_matches * expected_matches.bit_length() // 3,
+            )
+        if walk_cost >= lookup_cost:
+            return None
+
+        matches = islice(order, start, None)
+        for step in plan.steps:
+            matches = filter(make_row_check(self, step), matches)
+        return array("l", islice(matches, offset, end))
+
+    def explain(self, criteria, price_range=None):
+        """
+        Run a lookup and report how it was planned and executed.
+
+        Args:
+            criteria (dict): Maps field name -> required value
+            price_range (tuple, optional): Tuple of (min_price, max_price)
+
+        Returns:
+            list: One dictionary per filter step, in the order they were
+            applied, with the method used and estimated/actual row counts
+        """
+        plan = plan_query(self, criteria, price_range)
+        plan.execute()
+        return plan.explain()
+
+    def sort_row_ids(self, row_ids, sort_by, offset=0, limit=None):
+        """
+        Put row ids into one of the precomputed sort orders.
+
+        Small results are ordered by looking up each row's rank. Large
+        results are ordered by walking the full sort order and keeping the
+        rows that are in the result. When a limit is given only the rows up
+        to offset + limit are ordered: the rank path keeps them in a heap and
+        the walk stops as soon as it has found enough rows.
+
+        Args:
+            row_ids: Row ids to order
+            sort_by (str): One of SORT_ORDERS. Any other value (including
+                None) leaves the row ids in their current order.
+            offset (int): Number of sorted rows to skip (default: 0)
+            limit (int, optional): Maximum number of rows to return
+
+        Returns:
+            The row ids in the requested order, from offset up to offset + limit
+        """
+        end = None if limit is None else offset + limit
+        order = self.sort_orders.get(sort_by)
+        if order is None:
+            return row_ids[offset:end] if offset or end is not None else row_ids
+
+        count = len(row_ids)
+        needed = count if end is None else min(end, count)
+        # Rough number of steps for each strategy
+        rank_cost = count * max(needed.bit_length(), 1)
+        walk_cost = len(order) if count == 0 else len(order) * needed // count
+
+        if rank_cost < walk_cost:
+            rank = self.ranks[sort_by].__getitem__
+            if needed < count:
+                return array("l", heapq.nsmallest(needed, row_ids, key=rank)[offset:])
+            return array("l", sorted(row_ids, key=rank)[offset:end])
+
+        in_result = bytearray(len(order))
+        for row_id in row_ids:
+            in_result[row_id] = 1
+        matches = compress(order, map(in_result.__getitem__, order))
+        return array("l", islice(matches, offset, end))
+
+    def sort_key(self, row_id, sort_by):
+        """
+        Get the value a row is sorted on, for use in a pagination cursor.
+
+        Args:
+            row_id (int): The row
+            sort_by (str): One of SORT_ORDERS, or None for catalog order
+
+        Returns:
+            The row's effective price or popularity score, or its row id if
+            sort_by isn't one of SORT_ORDERS
+        """
+        if sort_by in ("price_high_to_low", "price_low_to_high"):
+            return self.effective_prices[row_id]
+        if sort_by == "popularity":
+            return self.item_scores[row_id]
+        return row_id
+
+    def cursor_rank(self, sort_by, sort_key, product_id):
+        """
+        Find the position in a sort order that a pagination cursor points to.
+
+        The cursor's product is normally found by its product_id. If it is no
+        longer in the catalog, or its sort key has changed, the position is
+        found from the sort key alone with a binary search, and the cursor
+        points past every row with that same key. In catalog order the key
+        is a row id, which shifts when earlier products are removed, so the
+        product's current row is used whenever it is found.
+
+        Args:
+            sort_by (str): One of SORT_ORDERS, or None for catalog order
+            sort_key: sort_key() of the last row seen
+            product_id: product_id of the last row seen
+
+        Returns:
+            int: Rank of the last row seen (-1 if no row has been seen), so the
+            next page starts at the first row with a greater rank
+        """
+        rank = self.ranks.get(sort_by)
+        row_id = self.row_ids_by_product_id.get(product_id)
+        if row_id is not None and rank is None:
+            return row_id
+        if row_id is not None and self.sort_key(row_id, sort_by) == sort_key:
+            return rank[row_id]
+
+        if rank is None:
+            # The key is a row id from the client, so keep it in range
+            if sort_key < 0:
+                return -1
+            if sort_key >= len(self.products) - 1:
+                return len(self.products) - 1
+            return int(sort_key)
+        if sort_by == "price_low_to_high":
+            return bisect_right(self.sorted_prices, sort_key) - 1
+        # The other orders are descending, so search on the negated key
+        return bisect_right(
+            self.sort_orders[sort_by],
+            -sort_key,
+            key=lambda row_id: -self.sort_key(row_id, sort_by),
+        ) - 1
+
+    def iter_products(self, row_ids):
+        """
+        Lazily turn row ids back into product dictionaries.
+
+        Args:
+            row_ids: Iterable of row ids
+
+        Yields:
+            dict: Each product, in the order of row_ids
+        """
+        products = self.products
+        for row_id in row_ids:
+            yield products[row_id]
+
+    def get_products(self, row_ids):
+        """
+        Turn row ids back into product dictionaries.
+
+        Args:
+            row_ids: Iterable of row ids
+
+        Returns:
+            list: The matching product dictionaries, in row id order
+        """
+        products = self.products
+        return [products[row_id] for row_id in row_ids]
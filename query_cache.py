@@ -0,0 +1,154 @@
+"""
+Query Cache Module
+
+This module keeps the results of recent filter + sort queries so that
+flipping through the pages of the same feed doesn't re-run the query.
+
+Results are stored under a normalised form of the query, so the same filters
+given in a different order or with unused (None) values share one entry. The
+cache is bounded both by number of entries and by an approximate byte budget,
+and evicts the least recently used entries first.
+"""
+
+import sys
+import threading
+from collections import OrderedDict
+
+
+def make_query_key(filters, sort_by=None):
+    """
+    Build a canonical, hashable cache key for a query.
+
+    Args:
+        filters (dict): apply_filters keyword arguments (e.g. from parse_filters)
+        sort_by (str, optional): The requested sort order
+
+    Returns:
+        tuple: The non-None filters sorted by name, plus the sort order
+    """
+    items = []
+    for name, value in sorted(filters.items()):
+        if value is None:
+            continue
+        if isinstance(value, list):
+            value = tuple(value)
+        items.append((name, value))
+    return (tuple(items), sort_by or None)
+
+
+def _estimate_size(value):
+    # Arrays report their buffer size; anything else falls back to getsizeof
+    itemsize = getattr(value, "itemsize", None)
+    if itemsize is not None:
+        return sys.getsizeof(value) + itemsize * len(value)
+    return sys.getsizeof(value)
+
+
+class QueryCache:
+    """
+    A thread-safe LRU cache bounded by entry count and byte budget.
+
+    Attributes:
+        max_entries (int): Maximum number of cached results
+        max_bytes (int): Maximum approximate total size of cached results
+        hits (int): Number of lookups that found a cached result
+        misses (int): Number of lookups that didn't
+        evictions (int): Number of results dropped to stay within budget
+        generation: The catalog version the cached results belong to
+    """
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.generation = None
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, generation=None):
+        """
+        Look up a cached result.
+
+        Args:
+            key: A key from make_query_key()
+            generation (optional): The current catalog version. If it differs
+                from the version the cache was filled for, the cache is
+                cleared first.
+
+        Returns:
+            The cached result, or None if there isn't one
+        """
+        with self._lock:
+            self._check_generation(generation)
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value[0]
+
+    def put(self, key, value, generation=None):
+        """
+        Store a result, evicting the least recently used ones if needed.
+
+        Results larger than the whole byte budget are not stored.
+
+        Args:
+            key: A key from make_query_key()
+            value: The result to cache (e.g. an array of row ids)
+            generation (optional): The catalog version the result was
+                computed from
+        """
+        size = _estimate_size(value)
+        if size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._check_generation(generation)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._entries[key] = (value, size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every cached result (the counters are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """
+        Report the cache's size and hit/miss/eviction counters.
+
+        Returns:
+            dict: Counters and current usage
+        """
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def _check_generation(self, generation):
+        if generation is not None and generation != self.generation:
+            self._entries.clear()
+            self._bytes = 0
+            self.generation = generation
@@ -0,0 +1,457 @@
+"""
+Query Planner Module
+
+This module decides how a filter query is answered from a ProductIndex.
+
+Each filter becomes a step. The planner estimates how many rows each step
+matches from the index statistics, starts from the cheapest step to read
+straight out of the index (the "driver"), and then applies the remaining
+steps from most to least selective. For every later step it chooses between
+intersecting with the index ("intersect") and checking the value on each
+candidate row ("check"), whichever is estimated to be cheaper.
+
+A plan can be explained: after it has run every step reports the rows it was
+estimated to leave and the rows it actually left.
+
+A plan can also just count its matches, without building the final list of
+row ids, or estimate the count from a sample of the rows when an exact count
+would be too slow.
+
+A categorical filter can accept several values (a list of them), or every
+value but some (an Exclude). Each row has a single value per field, so the
+posting lists of a field's values have no rows in common: the rows of
+several values are the union of their posting lists, and the rows of all
+but some values are every row minus the union of theirs. Whichever of the
+two has fewer posting list rows to read is used.
+"""
+
+import math
+from array import array
+from bisect import bisect_left
+from itertools import chain
+
+
+# Relative cost of checking one field on one candidate row, measured against
+# one step of a binary search into a posting list. Checking a row is a dict
+# lookup and compare; each binary search step creates a Python int, so a
+# full binary search is several times more expensive than a check.
+CHECK_COST = 3
+
+
+def intersect_posting_lists(small, large):
+    """
+    Intersect two sorted lists of row ids.
+
+    Every row id in the smaller list is looked up in the larger one with a
+    binary search, so the cost is proportional to len(small), not len(large).
+
+    Args:
+        small (array): Sorted row ids, ideally the shorter of the two lists
+        large (array): Sorted row ids
+
+    Returns:
+        array: Sorted row ids present in both lists
+    """
+    result = array("l")
+    position = 0
+    end = len(large)
+    for row_id in small:
+        position = bisect_left(large, row_id, position)
+        if position == end:
+            break
+        if large[position] == row_id:
+            result.append(row_id)
+    return result
+
+
+def union_posting_lists(posting_lists):
+    """
+    Merge sorted lists of row ids that have no row id in common.
+
+    Args:
+        posting_lists (list): Sorted row ids of different values of one field
+
+    Returns:
+        array: Sorted row ids in any of the lists
+    """
+    if len(posting_lists) == 1:
+        return posting_lists[0]
+    # Timsort finds the sorted runs and merges them
+    return array("l", sorted(chain.from_iterable(posting_lists)))
+
+
+def complement_row_ids(row_ids, total_rows):
+    """
+    Get the row ids not in a sorted list.
+
+    Args:
+        row_ids (array): Sorted row ids to leave out
+        total_rows (int): Number of rows in the catalog
+
+    Returns:
+        array: Sorted row ids from 0 to total_rows - 1 that aren't in row_ids
+    """
+    result = array("l")
+    start = 0
+    for row_id in row_ids:
+        result.extend(range(start, row_id))
+        start = row_id + 1
+    result.extend(range(start, total_rows))
+    return result
+
+
+class Exclude:
+    """
+    A filter value that accepts every value of a field except some.
+
+    For example color=Exclude(["red", "pink"]) matches products of any
+    color but red and pink.
+
+    Attributes:
+        values (tuple): The values that aren't accepted, without duplicates
+    """
+
+    __slots__ = ("values",)
+
+    def __init__(self, values):
+        self.values = tuple(dict.fromkeys(values))
+
+    def __eq__(self, other):
+        return isinstance(other, Exclude) and set(self.values) == set(other.values)
+
+    def __hash__(self):
+        return hash(frozenset(self.values))
+
+    def __repr__(self):
+        return f"Exclude({list(self.values)!r})"
+
+
+def accepted_values(index, field, value):
+    """
+    Get the values of a field that a categorical filter accepts.
+
+    Args:
+        index (ProductIndex): Index built over the product list
+        field (str): One of the index's categorical fields
+        value: A single value, a list (or tuple or set) of values, or an
+            Exclude
+
+    Returns:
+        tuple: The accepted values, without duplicates. For an Exclude these
+        are the other values that some product has.
+    """
+    if isinstance(value, Exclude):
+        excluded = set(value.values)
+        return tuple(other for other in index.postings[field] if other not in excluded)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return tuple(dict.fromkeys(value))
+    return (value,)
+
+
+def count_intersection(small, large):
+    """
+    Count the row ids two sorted lists have in common.
+
+    This does the same work as intersect_posting_lists but doesn't build
+    the intersection.
+
+    Args:
+        small (array): Sorted row ids, ideally the shorter of the two lists
+        large (array): Sorted row ids
+
+    Returns:
+        int: Number of row ids present in both lists
+    """
+    count = 0
+    position = 0
+    end = len(large)
+    for row_id in small:
+        position = bisect_left(large, row_id, position)
+        if position == end:
+            break
+        if large[position] == row_id:
+            count += 1
+    return count
+
+
+def make_row_check(index, step):
+    """
+    Build a function that checks one row against a plan step.
+
+    Args:
+        index (ProductIndex): The index the plan runs against
+        step (PlanStep): The step to check
+
+    Returns:
+        callable: Takes a row id and returns True if the row matches the step
+    """
+    if step.field == "price":
+        min_price, max_price = step.value
+        prices = index.effective_prices
+        return lambda row_id: min_price <= prices[row_id] <= max_price
+    values = index.field_values[step.field]
+    if len(step.values) == 1:
+        (value,) = step.values
+        return lambda row_id: values[row_id] == value
+    if isinstance(step.value, Exclude):
+        excluded = frozenset(step.value.values)
+        return lambda row_id: values[row_id] not in excluded
+    accepted = frozenset(step.values)
+    return lambda row_id: values[row_id] in accepted
+
+
+class PlanStep:
+    """
+    One filter in a query plan.
+
+    Attributes:
+        field (str): Product field the step filters on ("price" for a price range)
+        value: Required value (or values, or Exclude), or (min_price,
+            max_price) for a price range
+        values (tuple): The values the step accepts (see accepted_values),
+            or None for a price range
+        matching_rows (int): Number of catalog rows matching this filter alone
+        method (str): "index" for the driver step, otherwise "intersect" or "check"
+        estimated_rows (int): Rows expected to remain after this step
+        actual_rows (int): Rows that did remain, or None if not run yet
+    """
+
+    def __init__(self, field, value, matching_rows, values=None):
+        self.field = field
+        self.value = value
+        self.values = values
+        self.matching_rows = matching_rows
+        self.method = None
+        self.estimated_rows = None
+        self.actual_rows = None
+
+    def to_dict(self):
+        """
+        Describe the step for explain output.
+
+        Returns:
+            dict: The step's field, value, method and row counts
+        """
+        value = self.value
+        if isinstance(value, Exclude):
+            value = {"not": list(value.values)}
+        elif isinstance(value, (tuple, list, set, frozenset)):
+            value = list(value)
+        return {
+            "field": self.field,
+            "value": value,
+            "method": self.method,
+            "matching_rows": self.matching_rows,
+            "estimated_rows": self.estimated_rows,
+            "actual_rows": self.actual_rows,
+        }
+
+
+class QueryPlan:
+    """
+    An ordered list of PlanSteps for one query against a ProductIndex.
+
+    Attributes:
+        index (ProductIndex): The index the plan runs against
+        steps (list): PlanSteps in the order they are applied
+    """
+
+    def __init__(self, index, steps):
+        self.index = index
+        self.steps = steps
+
+    def execute(self):
+        """
+        Run the plan.
+
+        Returns:
+            Sorted row ids of the matching products
+        """
+        if not self.steps:
+            return range(len(self.index))
+
+        row_ids = None
+        for step in self.steps:
+            row_ids = self._run_step(step, row_ids)
+        return row_ids
+
+    def count(self):
+        """
+        Count the matching products without listing them.
+
+        With a single filter the count is read straight from the index. With
+        several, every step but the last is run as usual and the last one
+        only counts the rows it would keep.
+
+        Returns:
+            int: Exact number of matching products
+        """
+        if not self.steps:
+            return len(self.index)
+        if len(self.steps) == 1:
+            return self.steps[0].matching_rows
+
+        row_ids = None
+        for step in self.steps[:-1]:
+            row_ids = self._run_step(step, row_ids)
+
+        last = self.steps[-1]
+        if not row_ids:
+            count = 0
+        elif last.method == "intersect":
+            step_rows = self._read_rows(last)
+            if len(step_rows) < len(row_ids):
+                count = count_intersection(step_rows, row_ids)
+            else:
+                count = count_intersection(row_ids, step_rows)
+        else:
+            count = sum(map(make_row_check(self.index, last), row_ids))
+        last.actual_rows = count
+        return count
+
+    def estimate_count(self, sample_size=1000):
+        """
+        Estimate the number of matching products from a sample.
+
+        An evenly spaced sample of at most sample_size rows is taken from the
+        rows matching the first step, and checked against the other steps.
+        Queries with a single filter, or with few enough rows to check them
+        all, are counted exactly.
+
+        Args:
+            sample_size (int): Maximum number of rows to check (default: 1000)
+
+        Returns:
+            tuple: (count, margin) where the true count is within count ±
+            margin with 95% confidence (margin is 0 for an exact count)
+        """
+        if len(self.steps) < 2 or self.steps[0].matching_rows <= sample_size:
+            return self.count(), 0
+
+        driver = self.steps[0]
+        if driver.field == "price":
+            # Sampling doesn't need the rows in row id order, so skip sorting
+            driver_rows = self.index.rows_in_price_range(*driver.value)
+        else:
+            driver_rows = self._read_rows(driver)
+        stride = math.ceil(len(driver_rows) / sample_size)
+        sample = driver_rows[::stride]
+
+        checks = [make_row_check(self.index, step) for step in self.steps[1:]]
+        matched = sum(1 for row_id in sample if all(check(row_id) for check in checks))
+        fraction = matched / len(sample)
+        # Normal approximation to the binomial, at 95% confidence
+        standard_error = math.sqrt(fraction * (1 - fraction) / len(sample))
+        count = round(fraction * driver.matching_rows)
+        margin = math.ceil(1.96 * standard_error * driver.matching_rows)
+        return count, margin
+
+    def explain(self):
+        """
+        Describe the plan, including actual row counts if it has been run.
+
+        Returns:
+            list: One dictionary per step (see PlanStep.to_dict)
+        """
+        return [step.to_dict() for step in self.steps]
+
+    def _run_step(self, step, row_ids):
+        # Apply one step to the rows left by the previous steps
+        if row_ids is not None and not row_ids:
+            step.actual_rows = 0
+            return row_ids
+
+        if step.method == "index":
+            row_ids = self._read_rows(step)
+        elif step.method == "intersect":
+            step_rows = self._read_rows(step)
+            if len(step_rows) < len(row_ids):
+                row_ids = intersect_posting_lists(step_rows, row_ids)
+            else:
+                row_ids = intersect_posting_lists(row_ids, step_rows)
+        else:
+            row_ids = array("l", filter(make_row_check(self.index, step), row_ids))
+        step.actual_rows = len(row_ids)
+        return row_ids
+
+    def _read_rows(self, step):
+        # Sorted row ids for a step, read straight from the index
+        index = self.index
+        if step.field == "price":
+            return array("l", sorted(index.rows_in_price_range(*step.value)))
+        if step.matching_rows * 2 <= len(index):
+            return union_posting_lists(
+                [index.posting_list(step.field, value) for value in step.values]
+            )
+        # Most rows match, so leave out the rows of the other values instead
+        accepted = set(step.values)
+        rejected = [
+            rows for value, rows in index.postings[step.field].items() if value not in accepted
+        ]
+        return complement_row_ids(union_posting_lists(rejected) if rejected else (), len(index))
+
+
+def _driver_cost(step):
+    # Reading a posting list is free; a price range has to be sorted by row id
+    if step.field == "price":
+        return step.matching_rows * max(step.matching_rows.bit_length(), 1)
+    return step.matching_rows
+
+
+def plan_query(index, criteria, price_range=None):
+    """
+    Build a plan for finding the products matching a query.
+
+    Args:
+        index (ProductIndex): Index built over the product list
+        criteria (dict): Maps categorical field name -> required value, a
+            list (or tuple or set) of accepted values, or an Exclude
+        price_range (tuple, optional): Tuple of (min_price, max_price)
+
+    Returns:
+        QueryPlan: The steps to run, in order, with their chosen methods and
+        estimated row counts
+    """
+    steps = []
+    for field, value in criteria.items():
+        values = accepted_values(index, field, value)
+        matching_rows = sum(len(index.posting_list(field, accepted)) for accepted in values)
+        steps.append(PlanStep(field, value, matching_rows, values))
+    if price_range is not None:
+        min_price, max_price = price_range
+        steps.append(
+            PlanStep(
+                "price",
+                (min_price, max_price),
+                len(index.rows_in_price_range(min_price, max_price)),
+            )
+        )
+    if not steps:
+        return QueryPlan(index, steps)
+
+    # Most selective first, but start from whichever step is cheapest to read
+    steps.sort(key=lambda step: step.matching_rows)
+    driver = min(steps, key=_driver_cost)
+    steps.remove(driver)
+    steps.insert(0, driver)
+
+    total_rows = max(len(index), 1)
+    driver.method = "index"
+    driver.estimated_rows = driver.matching_rows
+    estimated_rows = driver.estimated_rows
+    for step in steps[1:]:
+        # Merging walks the shorter list and binary searches the longer one
+        shorter = min(estimated_rows, step.matching_rows)
+        longer = max(estimated_rows, step.matching_rows)
+        intersect_cost = shorter * max(longer.bit_length(), 1)
+        if step.field == "price":
+            # The price range has to be sorted by row id before merging
+            intersect_cost += step.matching_rows * max(step.matching_rows.bit_length(), 1)
+        check_cost = CHECK_COST * estimated_rows
+        step.method = "intersect" if intersect_cost < check_cost else "check"
+
+        # Assume the filters are independent of each other
+        estimated_rows = round(estimated_rows * step.matching_rows / total_rows)
+        step.estimated_rows = estimated_rows
+
+    return QueryPlan(index, steps)
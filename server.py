@@ -1,23 +1,113 @@
+from http import HTTPStatus
 from http.server import HTTPServer, SimpleHTTPRequestHandler
+import argparse
+import asyncio
+import base64
+import hashlib
 import json
+import mimetypes
 import os
+import selectors
+import socket
 import sys
 import time
 import importlib
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Thread
+from urllib.parse import parse_qs, unquote, urlparse
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import filter as filter_module
+import http_compression
 import pagination as pagination_module
+import text_search
+from catalog import CatalogError, CatalogStore
+from product_index import SORT_ORDERS
+from query_cache import QueryCache, make_query_key
+
+
+# Products are parsed once and kept in memory until data.jsonl changes. A
+# snapshot is saved after parsing so the next start-up doesn't parse again.
+catalog_store = CatalogStore("data.jsonl", save_snapshots=True)
+
+# Ordered row ids of recent queries, so paging through a feed is just slicing
+result_cache = QueryCache(max_entries=256, max_bytes=64 * 1024 * 1024)
+
+# Compressed bodies of recent responses, keyed by ETag, so popular responses
+# are only compressed once per catalog
+compressed_cache = QueryCache(max_entries=256, max_bytes=64 * 1024 * 1024)
+
+# Held while compressed copies of files (e.g. data.jsonl.gz) are checked and
+# written, so that each is only written once
+compressed_files_lock = Lock()
+
+# Increases every time the code is reloaded, so that ETags issued by the old
+# code no longer match
+code_version = 0
+
+# Filters saved by /api/set-filters. Requests that pass their own filters in
+# the query string ignore these; they are only kept for older clients, and
+# are held in memory so reading them doesn't touch the disk.
+saved_filters = None
+
+# Query string parameters that can be used instead of saved filters ("q" is
+# a text search query)
+FILTER_PARAMS = (
+    "color",
+    "brand",
+    "gender",
+    "exclude_color",
+    "exclude_brand",
+    "exclude_gender",
+    "on_sale",
+    "price_range",
+    "sort_by",
+    "q",
+)
+# Filters that take several values, separated by commas or given more than
+# once (e.g. "color=black,navy" or "color=black&color=navy"). Values given
+# as "exclude_" + name (e.g. "exclude_brand=gucci") are left out instead.
+MULTI_VALUE_PARAMS = ("color", "brand", "gender")
+BOOLEAN_PARAMS = {"1": True, "true": True, "0": False, "false": False}
+
+# Names of the facets in /api/facets responses: the filter parameter each
+# facet's values are passed in
+FACET_PARAMS = {
+    "color": "color",
+    "designer": "brand",
+    "gender": "gender",
+    "on_sale": "on_sale",
+    "price": "price_range",
+}
 
 
 # Auto-reload handler
 class ReloadHandler(FileSystemEventHandler):
-    def __init__(self, modules_to_reload):
+    def __init__(self, modules_to_reload, on_reload=(), data_files=(), on_data_change=()):
         self.modules_to_reload = modules_to_reload
+        self.on_reload = on_reload
+        self.data_files = {os.path.abspath(path) for path in data_files}
+        self.on_data_change = on_data_change
         self.last_reload = time.time()
 
+    def on_created(self, event):
+        # A change log that didn't exist yet
+        if os.path.abspath(event.src_path) in self.data_files:
+            self.data_changed()
+
+    def data_changed(self):
+        # Apply new products and changes now, rather than when the next
+        # request finds them
+        for callback in self.on_data_change:
+            try:
+                callback()
+            except Exception as e:
+                print(f"Error updating the catalog: {e}")
+
     def on_modified(self, event):
+        if os.path.abspath(event.src_path) in self.data_files:
+            self.data_changed()
+            return
         if event.src_path.endswith(".py") and not event.is_directory:
             # Debounce: only reload if at least 1 second has passed
             if time.time() - self.last_reload > 1:
@@ -28,201 +118,1371 @@ class ReloadHandler(FileSystemEventHandler):
                         print(f"Reloaded {module.__name__}")
                     except Exception as e:
                         print(f"Error reloading {module.__name__}: {e}")
+                for callback in self.on_reload:
+                    callback()
                 print("✨ Ready for requests!\n")
                 self.last_reload = time.time()
 
 
-class Handler(SimpleHTTPRequestHandler):
-    def do_GET(self):
-        if self.path == "/data.jsonl":
-            # Check if there are active filters
-            if os.path.exists("current_filters.json"):
-                with open("current_filters.json", "r") as f:
-                    filters = json.load(f)
-
-                # Load all products
-                all_products = filter_module.load_products("data.jsonl")
-
-                # Apply filters using the filter.py functions
-                color = filters.get("color") or None
-                brand = filters.get("brand") or None
-                gender = filters.get("gender") or None
-                on_sale = (
-                    filters.get("on_sale")
-                    if filters.get("on_sale") is not None
-                    else None
-                )
+def parse_values(value):
+    """
+    Split the value of a multi-value filter into its values.
 
-                # Parse price range
-                price_range = None
-                if filters.get("price_range"):
-                    price_parts = filters["price_range"].split("-")
-                    price_range = (float(price_parts[0]), float(price_parts[1]))
-
-                # Apply the filters
-                filtered_products = filter_module.apply_filters(
-                    all_products,
-                    color=color,
-                    price_range=price_range,
-                    on_sale=on_sale,
-                    brand=brand,
-                    gender=gender
-                )
+    Args:
+        value: A comma-separated string or a list of strings (from a filters
+            token), or None
 
-                # Apply sorting if specified
-                sort_by = filters.get("sort_by")
-                if sort_by == "price_high_to_low":
-                    filtered_products = filter_module.sort_by_price_high_to_low(
-                        filtered_products
-                    )
-                elif sort_by == "price_low_to_high":
-                    filtered_products = filter_module.sort_by_price_low_to_high(
-                        filtered_products
-                    )
-                elif sort_by == "popularity":
-                    filtered_products = filter_module.sort_by_popularity(
-                        filtered_products
-                    )
+    Returns:
+        list: The values, sorted and without blanks or duplicates
 
-                # Convert filtered products back to JSONL format
-                data = "\n".join([json.dumps(product) for product in filtered_products])
-            else:
-                # No filters, return all data
-                with open("data.jsonl", "r") as f:
-                    data = f.read()
+    Raises:
+        ValueError: If the value isn't a string or a list of strings
+    """
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(",")
+    elif not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        raise ValueError(f"invalid filter value: {value!r}")
+    return sorted({item.strip() for item in value if item and item.strip()})
 
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(data.encode())
-        elif self.path.startswith("/api/products"):
-            # Handle paginated product requests
-            # Parse query parameters for page number
-            from urllib.parse import urlparse, parse_qs
-
-            parsed_url = urlparse(self.path)
-            query_params = parse_qs(parsed_url.query)
-
-            # Get page number from query params (default to 1)
-            page_number = int(query_params.get("page", [1])[0])
-            items_per_page = int(query_params.get("items_per_page", [50])[0])
-
-            # Load and filter products (same logic as /data.jsonl)
-            if os.path.exists("current_filters.json"):
-                with open("current_filters.json", "r") as f:
-                    filters = json.load(f)
-
-                # Load all products
-                all_products = filter_module.load_products("data.jsonl")
-
-                # Apply filters
-                color = filters.get("color") or None
-                brand = filters.get("brand") or None
-                gender = filters.get("gender") or None
-                on_sale = (
-                    filters.get("on_sale")
-                    if filters.get("on_sale") is not None
-                    else None
-                )
 
-                # Parse price range
-                price_range = None
-                if filters.get("price_range"):
-                    price_parts = filters["price_range"].split("-")
-                    price_range = (float(price_parts[0]), float(price_parts[1]))
-
-                # Apply the filters
-                filtered_products = filter_module.apply_filters(
-                    all_products,
-                    color=color,
-                    price_range=price_range,
-                    on_sale=on_sale,
-                    brand=brand,
-                    gender=gender
-                )
+def parse_condition(filters, name):
+    """
+    Get the apply_filters argument for one of the multi-value filters.
 
-                # Apply sorting if specified
-                sort_by = filters.get("sort_by")
-                if sort_by == "price_high_to_low":
-                    filtered_products = filter_module.sort_by_price_high_to_low(
-                        filtered_products
-                    )
-                elif sort_by == "price_low_to_high":
-                    filtered_products = filter_module.sort_by_price_low_to_high(
-                        filtered_products
-                    )
-                elif sort_by == "popularity":
-                    filtered_products = filter_module.sort_by_popularity(
-                        filtered_products
+    Args:
+        filters (dict): Filter settings posted by the frontend
+        name (str): One of MULTI_VALUE_PARAMS. The values given for name are
+            accepted and those given for "exclude_" + name aren't.
+
+    Returns:
+        A single value, a tuple of values, an Exclude, or None if the filter
+        isn't used. Excluding every value that was asked for gives an empty
+        tuple, which matches nothing.
+    """
+    values = parse_values(filters.get(name))
+    excluded = parse_values(filters.get("exclude_" + name))
+    if excluded:
+        if not values:
+            return filter_module.Exclude(excluded)
+        values = [value for value in values if value not in excluded]
+        if not values:
+            return ()
+    if not values:
+        return None
+    return values[0] if len(values) == 1 else tuple(values)
+
+
+def parse_filters(filters):
+    """
+    Turn the filter settings posted by the frontend into apply_filters arguments.
+
+    Args:
+        filters (dict): Filter settings posted by the frontend
+
+    Returns:
+        dict: Keyword arguments for filter_row_ids/apply_filters
+
+    Raises:
+        ValueError: If a filter's value doesn't have the right type or form
+    """
+    color = parse_condition(filters, "color")
+    brand = parse_condition(filters, "brand")
+    gender = parse_condition(filters, "gender")
+    on_sale = filters.get("on_sale")
+    if isinstance(on_sale, str):
+        # As in the query string, anything other than true/false is "either"
+        on_sale = BOOLEAN_PARAMS.get(on_sale.lower())
+    elif on_sale is not None and not isinstance(on_sale, bool):
+        raise ValueError(f"invalid on_sale: {on_sale!r}")
+
+    # Parse price range, given as "min-max"
+    price_range = None
+    if filters.get("price_range"):
+        price_parts = filters["price_range"]
+        if isinstance(price_parts, str):
+            price_parts = price_parts.split("-")
+        if not isinstance(price_parts, list) or len(price_parts) != 2:
+            raise ValueError(f"invalid price_range: {filters['price_range']!r}")
+        # float() raises ValueError for anything that isn't a number
+        price_range = (float(price_parts[0]), float(price_parts[1]))
+
+    return {
+        "color": color,
+        "price_range": price_range,
+        "on_sale": on_sale,
+        "brand": brand,
+        "gender": gender,
+    }
+
+
+def encode_filter_token(filters):
+    """
+    Encode filter settings as a compact token for the "filters" query parameter.
+
+    Args:
+        filters (dict): Filter settings, in the same form /api/set-filters takes
+
+    Returns:
+        str: URL-safe base64 of the filters' JSON, without padding
+    """
+    used_filters = {
+        name: value for name, value in filters.items() if value not in (None, "")
+    }
+    data = json.dumps(used_filters, sort_keys=True, separators=(",", ":"))
+    return base64.urlsafe_b64encode(data.encode()).decode().rstrip("=")
+
+
+def decode_filter_token(token):
+    """
+    Decode a token made by encode_filter_token().
+
+    Args:
+        token (str): The token
+
+    Returns:
+        dict: The filter settings
+
+    Raises:
+        ValueError: If the token isn't a valid encoded filter dictionary
+    """
+    padded_token = token + "=" * (-len(token) % 4)
+    try:
+        filters = json.loads(base64.urlsafe_b64decode(padded_token.encode()))
+    except ValueError:
+        raise ValueError("invalid filters token") from None
+    check_filters(filters)
+    return filters
+
+
+def check_filters(filters):
+    """
+    Check filter settings that came as JSON rather than a query string.
+
+    Query string values are always strings, but a filters token or a body
+    posted to /api/set-filters can hold any JSON value.
+
+    Args:
+        filters: The decoded filter settings
+
+    Raises:
+        ValueError: If the settings aren't a dictionary, or a filter's value
+            doesn't have the right type or form (see parse_filters)
+    """
+    if not isinstance(filters, dict):
+        raise ValueError("filters must be a JSON object")
+    for name in ("sort_by", "q"):
+        if filters.get(name) is not None and not isinstance(filters[name], str):
+            raise ValueError(f"invalid {name}: {filters[name]!r}")
+    parse_filters(filters)
+
+
+def get_request_filters(query_params):
+    """
+    Get the filters for a request from its query string.
+
+    Filters can be given as a "filters" token or as individual parameters
+    (see FILTER_PARAMS). If neither is present the filters saved with
+    /api/set-filters are used instead.
+
+    Args:
+        query_params (dict): Parsed query string, as from parse_qs()
+
+    Returns:
+        dict: Filter settings, or None if there are no filters
+
+    Raises:
+        ValueError: If the "filters" token can't be decoded
+    """
+    if "filters" in query_params:
+        return decode_filter_token(query_params["filters"][0])
+
+    if not any(name in query_params for name in FILTER_PARAMS):
+        return saved_filters
+
+    filters = {
+        name: query_params[name][0] for name in FILTER_PARAMS if name in query_params
+    }
+    for name in MULTI_VALUE_PARAMS:
+        for param in (name, "exclude_" + name):
+            if len(query_params.get(param, ())) > 1:
+                filters[param] = ",".join(query_params[param])
+    if "on_sale" in filters:
+        # Anything other than true/false (e.g. blank) means "either"
+        filters["on_sale"] = BOOLEAN_PARAMS.get(filters["on_sale"].lower())
+    return filters
+
+
+def get_search_terms(filters):
+    """
+    Get the terms of the text search query in a request's filters.
+
+    Args:
+        filters (dict): Filter settings posted by the frontend
+
+    Returns:
+        tuple: The query's terms, or an empty tuple if there is no query
+    """
+    return text_search.query_terms(filters.get("q") or "")
+
+
+def get_query_key(filters):
+    """
+    Build the cache key for a request's filters and sort order.
+
+    Args:
+        filters (dict): Filter settings posted by the frontend
+
+    Returns:
+        tuple: A key from make_query_key()
+    """
+    sort_by = filters.get("sort_by")
+    if sort_by not in SORT_ORDERS:
+        sort_by = None
+    # Queries with the same terms ("Dresses" and "dress") share results
+    terms = get_search_terms(filters)
+    return make_query_key({**parse_filters(filters), "q": terms or None}, sort_by)
+
+
+def get_ordered_row_ids(filters, catalog=None):
+    """
+    Find the catalog rows matching the filters, in the requested order.
+
+    Args:
+        filters (dict): Filter settings posted by the frontend
+        catalog (Catalog, optional): Catalog to search (default: the current one)
+
+    Returns:
+        tuple: (catalog, row_ids) where row_ids index into catalog.products
+    """
+    if catalog is None:
+        catalog = catalog_store.get()
+
+    # Results are cached per catalog version, so a reload starts afresh
+    row_ids = result_cache.get(get_query_key(filters), catalog.version)
+    if row_ids is None:
+        row_ids = find_ordered_row_ids(filters, catalog)
+    return catalog, row_ids
+
+
+def find_ordered_row_ids(filters, catalog):
+    """
+    Run a query against the catalog's index and cache its ordered rows.
+
+    Args:
+        filters (dict): Filter settings posted by the frontend
+        catalog (Catalog): Catalog to search
+
+    Returns:
+        Row ids of the matching products, in the requested order
+    """
+    # Find matching rows using the catalog's index and put them in order
+    # using the precomputed sort orders, or by relevance to a search query
+    cache_key = get_query_key(filters)
+    terms = get_search_terms(filters)
+    if terms:
+        row_ids = filter_module.search_row_ids(
+            catalog.index,
+            catalog.text_index,
+            terms,
+            cache_key[1],
+            **parse_filters(filters),
+        )
+    else:
+        row_ids = filter_module.filter_row_ids(catalog.index, **parse_filters(filters))
+        row_ids = catalog.index.sort_row_ids(row_ids, cache_key[1])
+    result_cache.put(cache_key, row_ids, catalog.version)
+    return row_ids
+
+
+def iter_jsonl_chunks(encoded_products, chunk_size=64 * 1024):
+    """
+    Join pre-encoded products into JSONL, a chunk at a time.
+
+    Args:
+        encoded_products (iterable): Each product's JSON as bytes (see
+            Catalog.encoded_products), consumed lazily
+        chunk_size (int): Approximate number of bytes per chunk
+
+    Yields:
+        bytes: One or more complete JSONL lines
+    """
+    lines = []
+    size = 0
+    for line in encoded_products:
+        lines.append(line)
+        size += len(line) + 1
+        if size >= chunk_size:
+            lines.append(b"")
+            yield b"\n".join(lines)
+            lines = []
+            size = 0
+    if lines:
+        lines.append(b"")
+        yield b"\n".join(lines)
+
+
+def encode_products_response(encoded_products, row_ids, pagination_info, extra=None):
+    """
+    Build the /api/products JSON body around pre-encoded products.
+
+    The result is byte-for-byte what json.dumps() would produce for
+    {"products": [...], "pagination": pagination_info, **extra}, but the
+    products themselves are not encoded again.
+
+    Args:
+        encoded_products (list): Each product's JSON as bytes, by row id
+        row_ids: Row ids of the products on the page, in order
+        pagination_info (dict): Pagination information for the page
+        extra (dict, optional): Any other top-level keys to include
+
+    Returns:
+        bytes: The encoded response body
+    """
+    parts = [
+        b'{"products": [',
+        b", ".join([encoded_products[row_id] for row_id in row_ids]),
+        b'], "pagination": ',
+        json.dumps(pagination_info).encode(),
+    ]
+    for key, value in (extra or {}).items():
+        parts.append(b", " + json.dumps(key).encode() + b": ")
+        parts.append(json.dumps(value).encode())
+    parts.append(b"}")
+    return b"".join(parts)
+
+
+class Response:
+    """
+    An HTTP response produced by the routing code.
+
+    The same Response is written out by whichever server mode is running,
+    so the routes don't need to know how requests are being served.
+
+    The body comes from exactly one of three places: body bytes held in
+    memory, a file sent straight from disk with sendfile, or an iterator of
+    chunks streamed with chunked transfer encoding as they are produced.
+
+    Attributes:
+        status (int): HTTP status code
+        body (bytes): Response body
+        headers (list): (name, value) pairs to send
+        file_path (str): File to send as the body, or None
+        chunks (iterable): Byte strings to stream as the body, or None
+    """
+
+    def __init__(self, status=200, body=b"", content_type="application/json", file_path=None, chunks=None):
+        self.status = status
+        self.body = body
+        self.file_path = file_path
+        self.chunks = chunks
+        self.headers = []
+        if content_type is not None:
+            self.headers.append(("Content-type", content_type))
+
+
+def json_response(data, status=200):
+    """
+    Build a JSON response.
+
+    Args:
+        data: Anything json.dumps() can encode
+        status (int): HTTP status code (default: 200)
+
+    Returns:
+        Response: The encoded response
+    """
+    return Response(status, json.dumps(data).encode())
+
+
+def read_filters_file():
+    """
+    Read the filters persisted by /api/set-filters from current_filters.json.
+
+    Returns:
+        dict: The saved filter settings, or None if no filters are set
+    """
+    if not os.path.exists("current_filters.json"):
+        return None
+    with open("current_filters.json", "r") as f:
+        return json.load(f)
+
+
+def make_etag(catalog, query, encoding=None):
+    """
+    Build a strong ETag for a response.
+
+    The tag changes whenever the catalog, the query, the content encoding or
+    the server's code changes, and is the same for repeat requests otherwise.
+
+    Args:
+        catalog (Catalog): The catalog the response is built from
+        query (tuple): Everything else the response depends on (endpoint,
+            filters, page, ...)
+        encoding (str, optional): The response's Content-Encoding
+
+    Returns:
+        str: The quoted entity tag
+    """
+    # The files' sizes and modification times tell catalogs apart across
+    # restarts, when version numbers start again from 1
+    changes_mark = catalog.changes_mark
+    changes = changes_mark and (changes_mark.size, changes_mark.mtime_ns)
+    identity = (catalog.mtime_ns, catalog.size, changes, code_version, query)
+    digest = hashlib.blake2b(repr(identity).encode(), digest_size=8).hexdigest()
+    suffix = f"-{encoding}" if encoding else ""
+    return f'"{catalog.version}-{digest}{suffix}"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Check an If-None-Match header against a response's ETag.
+
+    Args:
+        if_none_match (str): The header's value, or None
+        etag (str): The response's ETag
+
+    Returns:
+        bool: True if the client already has this response
+    """
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        # If-None-Match uses weak comparison, so a W/ prefix is ignored
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def conditional_response(request_headers, catalog, query, build_response):
+    """
+    Answer a request with a cacheable, compressed response.
+
+    The ETag is worked out before the response is built, so a client that
+    already has the response gets a 304 Not Modified without any work being
+    done. Otherwise the response is built and compressed with the best
+    encoding the client accepts. Compressed bodies are cached under their
+    ETag, except for streamed responses, which are compressed as they go,
+    and files, which are sent from a compressed copy on disk.
+
+    Args:
+        request_headers: The request's headers (anything with .get(name))
+        catalog (Catalog): The catalog the response is built from
+        query (tuple): Everything else the response depends on
+        build_response (callable): Builds the uncompressed 200 Response
+
+    Returns:
+        Response: The response to send
+    """
+    accept_encoding = request_headers.get("accept-encoding")
+    encoding = http_compression.choose_encoding(accept_encoding)
+    etag = make_etag(catalog, query, encoding)
+    validator_headers = [("ETag", etag), ("Vary", "Accept-Encoding")]
+
+    if etag_matches(request_headers.get("if-none-match"), etag):
+        response = Response(304, content_type=None)
+        response.headers.extend(validator_headers)
+        return response
+
+    body = None
+    if encoding is not None:
+        body = compressed_cache.get(etag, catalog.version)
+    if body is not None:
+        response = Response(200, body)
+    else:
+        response = build_response()
+        if encoding is not None:
+            if response.chunks is not None:
+                response.chunks = http_compression.iter_compressed(
+                    response.chunks, encoding
+                )
+            elif response.file_path is not None:
+                try:
+                    response.file_path = get_compressed_file(response.file_path, encoding)
+                except OSError:
+                    # The copy can't be written (e.g. the directory is read
+                    # only), so compress the file as it is sent instead
+                    response.chunks = http_compression.iter_compressed(
+                        http_compression.iter_file(response.file_path), encoding
                     )
+                    response.file_path = None
             else:
-                # No filters, load all products
-                filtered_products = filter_module.load_products("data.jsonl")
+                body = http_compression.compress(response.body, encoding)
+                response.body = body
+                compressed_cache.put(etag, body, catalog.version)
+
+    response.headers.extend(validator_headers)
+    if encoding is not None:
+        response.headers.append(("Content-Encoding", encoding))
+    return response
+
+
+def get_compressed_file(path, encoding):
+    """
+    Get a compressed copy of a file, writing it first if needed.
+
+    The copy sits next to the file (e.g. data.jsonl.gz) and is given the
+    file's modification time, so it is reused until the file changes, even
+    across restarts. It is written a chunk at a time, however big the file.
+
+    Args:
+        path (str): Path of the file
+        encoding (str): One of http_compression.COMPRESSORS' encodings
+
+    Returns:
+        str: Path of the compressed copy
+    """
+    compressed_path = path + http_compression.FILE_SUFFIXES[encoding]
+    with compressed_files_lock:
+        mtime_ns = os.stat(path).st_mtime_ns
+        try:
+            if os.stat(compressed_path).st_mtime_ns == mtime_ns:
+                return compressed_path
+        except FileNotFoundError:
+            pass
+        http_compression.compress_file(path, compressed_path, encoding)
+        os.utime(compressed_path, ns=(mtime_ns, mtime_ns))
+    return compressed_path
+
+
+def handle_data_jsonl(query_params, request_headers):
+    # Check if there are active filters
+    filters = get_request_filters(query_params)
+    catalog = catalog_store.get()
+    # Once changes have been logged the file no longer matches the catalog
+    if filters is None and not (catalog.changes_mark and catalog.changes_mark.size):
+        # No filters, send the data file (or its compressed copy) straight
+        # from disk
+        return conditional_response(
+            request_headers,
+            catalog,
+            ("data.jsonl",),
+            lambda: Response(200, file_path=catalog.filename),
+        )
+
+    def build_response():
+        # Stream the filtered products back in JSONL format
+        if filters is None:
+            row_ids = range(len(catalog))
+        else:
+            _, row_ids = get_ordered_row_ids(filters, catalog)
+        encoded_products = catalog.encoded_products
+        return Response(
+            200,
+            chunks=iter_jsonl_chunks(encoded_products[row_id] for row_id in row_ids),
+        )
 
-            # Apply pagination using pagination.py functions
-            page_data = pagination_module.get_page_data(
-                filtered_products, page_number, items_per_page
+    query = ("data.jsonl",) if filters is None else ("data.jsonl", get_query_key(filters))
+    return conditional_response(request_headers, catalog, query, build_response)
+
+
+def handle_products(query_params, request_headers):
+    # Get page number from query params (default to 1)
+    page_number = int(query_params.get("page", [1])[0])
+    items_per_page = int(query_params.get("items_per_page", [50])[0])
+    if page_number < 1:
+        raise ValueError("page must be at least 1")
+    if items_per_page < 1:
+        raise ValueError("items_per_page must be at least 1")
+    explain = query_params.get("explain", ["0"])[0] not in ("", "0", "false")
+    # A "cursor" parameter (blank for the first page) asks for cursor-based
+    # pages instead of numbered ones
+    cursor = query_params.get("cursor", [None])[0]
+    after = pagination_module.decode_cursor(cursor) if cursor else None
+    # "count=approximate" allows the total to be estimated for broad queries
+    approximate_count = query_params.get("count", ["exact"])[0] == "approximate"
+
+    # Load and filter products (same logic as /data.jsonl)
+    filters = get_request_filters(query_params) or {}
+    catalog = catalog_store.get()
+
+    def build_response():
+        if cursor is None:
+            page_row_ids, pagination_info = get_numbered_page(
+                filters, catalog, page_number, items_per_page, approximate_count
             )
-            pagination_info = pagination_module.create_pagination_info(
-                filtered_products, page_number, items_per_page
+        else:
+            page_row_ids, pagination_info = get_cursor_page(
+                filters, catalog, after, items_per_page
             )
 
-            # Create response with both products and pagination info
-            response_data = {"products": page_data, "pagination": pagination_info}
+        extra = {}
+        if explain:
+            # Report how the query planner answered the filters
+            extra["plan"] = filter_module.explain_filters(
+                catalog.index, **parse_filters(filters)
+            )
 
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps(response_data).encode())
-        else:
+        # Create response with both products and pagination info, reusing
+        # each product's JSON from when the catalog was loaded
+        body = encode_products_response(
+            catalog.encoded_products, page_row_ids, pagination_info, extra
+        )
+        return Response(200, body)
+
+    query = (
+        "products",
+        get_query_key(filters),
+        cursor,
+        page_number,
+        items_per_page,
+        approximate_count,
+        explain,
+    )
+    return conditional_response(request_headers, catalog, query, build_response)
+
+
+def handle_facets(query_params, request_headers):
+    # Counts for each filter option, given the other filters (and search)
+    filters = get_request_filters(query_params) or {}
+    catalog = catalog_store.get()
+
+    def build_response():
+        terms = get_search_terms(filters)
+        row_ids = catalog.text_index.search(terms) if terms else None
+        counts = filter_module.count_facets(
+            catalog.facet_index, **parse_filters(filters), row_ids=row_ids
+        )
+        # Keyed the way each filter is passed, e.g. "brand" and "0-50"
+        counts["price"] = {
+            f"{min_price:g}-{max_price:g}": count
+            for (min_price, max_price), count in counts["price"].items()
+        }
+        facets = {FACET_PARAMS[field]: values for field, values in counts.items()}
+        return json_response({"facets": facets})
+
+    # The counts don't depend on the sort order
+    query = ("facets", get_query_key(filters)[0])
+    return conditional_response(request_headers, catalog, query, build_response)
+
+
+def get_numbered_page(filters, catalog, page_number, items_per_page, approximate_count=False):
+    """
+    Get one numbered page of the rows matching the filters.
+
+    If the query's ordered rows are cached the page is sliced out of them.
+    Otherwise only the page's rows are looked up and the matches are
+    counted, when that is cheaper than finding and sorting every match.
+
+    Args:
+        filters (dict): Filter settings posted by the frontend
+        catalog (Catalog): The catalog to search
+        page_number (int): The page number (1-indexed)
+        items_per_page (int): Number of items per page
+        approximate_count (bool): Allow the total to be estimated
+
+    Returns:
+        tuple: (page_row_ids, pagination_info)
+    """
+    cache_key = get_query_key(filters)
+    row_ids = result_cache.get(cache_key, catalog.version)
+    if row_ids is None and get_search_terms(filters):
+        # Search results are ranked as a whole
+        row_ids = find_ordered_row_ids(filters, catalog)
+    if row_ids is None:
+        filter_args, sort_by = parse_filters(filters), cache_key[1]
+        offset = pagination_module.get_page_offset(page_number, items_per_page)
+        page_row_ids = filter_module.filter_page_row_ids(
+            catalog.index, sort_by, offset, items_per_page, **filter_args
+        )
+        if page_row_ids is not None:
+            total_items, margin = filter_module.count_matches(
+                catalog.index, **filter_args, approximate=approximate_count
+            )
+            pagination_info = pagination_module.create_pagination_info_from_count(
+                total_items,
+                page_number,
+                items_per_page,
+                margin if approximate_count else None,
+            )
+            return page_row_ids, pagination_info
+        row_ids = find_ordered_row_ids(filters, catalog)
+
+    # Apply pagination using pagination.py functions
+    page_row_ids = pagination_module.get_page_data(row_ids, page_number, items_per_page)
+    # create_pagination_info only needs to know how many items there are
+    pagination_info = pagination_module.create_pagination_info(
+        row_ids, page_number, items_per_page
+    )
+    return page_row_ids, pagination_info
+
+
+def get_cursor_page(filters, catalog, after, items_per_page):
+    """
+    Get the page of rows matching the filters that follows a pagination cursor.
+
+    If the query's ordered rows are cached the page is found in them.
+    Otherwise the sort order is walked from the cursor's position, checking
+    rows against the filters, when that is cheaper than finding and sorting
+    every match (as for numbered pages, see get_numbered_page).
+
+    Args:
+        filters (dict): Filter settings posted by the frontend
+        catalog (Catalog): The catalog to search
+        after (tuple): (sort_key, product_id) from the cursor, or None for
+            the first page
+        items_per_page (int): Number of items per page
+
+    Returns:
+        tuple: (page_row_ids, pagination_info)
+    """
+    cache_key = get_query_key(filters)
+    terms = get_search_terms(filters)
+    row_ids = result_cache.get(cache_key, catalog.version)
+    if row_ids is None and not terms:
+        sort_by = cache_key[1]
+        last_rank = -1 if after is None else catalog.index.cursor_rank(sort_by, *after)
+        # One row past the page tells whether there is a next page
+        row_ids = filter_module.filter_page_row_ids(
+            catalog.index,
+            sort_by,
+            0,
+            items_per_page + 1,
+            **parse_filters(filters),
+            start=last_rank + 1,
+        )
+        if row_ids is not None:
+            # The rows start right after the cursor, so the page is their
+            # first page
+            return get_keyset_page(catalog, row_ids, sort_by, None, items_per_page)
+    if row_ids is None:
+        # Search results are ranked as a whole
+        row_ids = find_ordered_row_ids(filters, catalog)
+    return get_keyset_page(
+        catalog, row_ids, filters.get("sort_by"), after, items_per_page, terms
+    )
+
+
+def get_keyset_page(catalog, row_ids, sort_by, after, items_per_page, terms=()):
+    """
+    Get the page of ordered rows that follows a pagination cursor.
+
+    Args:
+        catalog (Catalog): The catalog the rows belong to
+        row_ids: Matching row ids, in the requested sort order
+        sort_by (str): The requested sort order
+        after (tuple): (sort_key, product_id) from the cursor, or None for
+            the first page
+        items_per_page (int): Number of items per page
+        terms (tuple): Search query terms, if the rows are search results
+
+    Returns:
+        tuple: (page_row_ids, pagination_info)
+    """
+    index = catalog.index
+    if sort_by not in SORT_ORDERS:
+        sort_by = None
+
+    if terms and sort_by is None:
+        # Ranked by relevance: highest score first, then by row id. A cursor
+        # whose product has gone, or changed score, points past every row
+        # with its score.
+        def sort_key(row_id):
+            return catalog.text_index.score(terms, row_id)
+
+        def position(row_id):
+            return (-sort_key(row_id), row_id)
+
+        last_position = None
+        if after is not None:
+            score, product_id = after
+            row_id = index.row_ids_by_product_id.get(product_id)
+            if row_id is None or sort_key(row_id) != score:
+                row_id = len(catalog)
+            last_position = (-score, row_id)
+    else:
+        # row_ids are in rank order, so the page starts right after the rank
+        # of the cursor's row
+        rank = index.ranks.get(sort_by)
+        position = None if rank is None else rank.__getitem__
+        last_position = None if after is None else index.cursor_rank(sort_by, *after)
+
+        def sort_key(row_id):
+            return index.sort_key(row_id, sort_by)
+
+    page_row_ids, has_next = pagination_module.get_keyset_page(
+        row_ids, last_position, items_per_page, key=position
+    )
+
+    next_cursor = None
+    if page_row_ids:
+        last_row_id = page_row_ids[-1]
+        next_cursor = pagination_module.encode_cursor(
+            sort_key(last_row_id),
+            catalog.products[last_row_id].get("product_id"),
+        )
+    pagination_info = pagination_module.create_keyset_info(
+        page_row_ids, items_per_page, has_next, next_cursor
+    )
+    return page_row_ids, pagination_info
+
+
+def handle_set_filters(body):
+    # Kept for older clients: newer ones pass their filters with each request.
+    # The filters are held in memory and written to a JSON file so they
+    # survive a restart.
+    global saved_filters
+    filters = json.loads(body.decode())
+    check_filters(filters)
+    saved_filters = filters
+    with open("current_filters.json", "w") as f:
+        json.dump(filters, f)
+    return json_response({"status": "success", "token": encode_filter_token(filters)})
+
+
+def handle_clear_filters():
+    # Remove the saved filters and the filters file
+    global saved_filters
+    saved_filters = None
+    if os.path.exists("current_filters.json"):
+        os.remove("current_filters.json") #removed when you clear filters
+    return json_response({"status": "success"})
+
+
+def route_request(method, path, body=b"", request_headers=None):
+    """
+    Handle a request to one of the app's own endpoints.
+
+    This is shared by every server mode.
+
+    Args:
+        method (str): HTTP method, e.g. "GET"
+        path (str): Request path including the query string
+        body (bytes): Request body
+        request_headers (optional): The request's headers (anything with
+            .get(name) that accepts lowercase names)
+
+    Returns:
+        Response: The response to send, or None if the path isn't an app
+        endpoint and should be served as a static file instead
+    """
+    if request_headers is None:
+        request_headers = {}
+    parsed_url = urlparse(path)
+    # Keep blank values so that e.g. "color=" means "any color"
+    query_params = parse_qs(parsed_url.query, keep_blank_values=True)
+    if method == "GET":
+        try:
+            if parsed_url.path == "/data.jsonl":
+                return handle_data_jsonl(query_params, request_headers)
+            if parsed_url.path == "/api/products":
+                return handle_products(query_params, request_headers)
+            if parsed_url.path == "/api/facets":
+                return handle_facets(query_params, request_headers)
+        except ValueError as e:
+            return json_response({"status": "error", "message": str(e)}, 400)
+        except CatalogError:
+            # The details are in the server's log
+            return json_response(
+                {"status": "error", "message": "the product catalog is unavailable"}, 500
+            )
+        if parsed_url.path == "/api/cache-stats":
+            return json_response(
+                {**result_cache.stats(), "compressed": compressed_cache.stats()}
+            )
+        return None
+    if method == "POST":
+        if parsed_url.path == "/api/set-filters":
+            try:
+                return handle_set_filters(body)
+            except ValueError as e:
+                return json_response({"status": "error", "message": str(e)}, 400)
+        if parsed_url.path == "/api/clear-filters":
+            return handle_clear_filters()
+    return Response(404, content_type=None)
+
+
+class Handler(SimpleHTTPRequestHandler):
+    # HTTP/1.1 is needed for chunked responses. A request that doesn't
+    # arrive within the timeout closes the connection.
+    protocol_version = "HTTP/1.1"
+    timeout = 5
+    # Headers and body are sent in separate writes; with Nagle's algorithm
+    # the body would wait for the client's delayed ACK of the headers
+    # (about 40ms) on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def handle(self):
+        """
+        Handle requests until the connection is closed or goes idle.
+
+        A server that watches idle connections itself (ThreadPoolHTTPServer)
+        gets a keep-alive connection back as soon as no request is waiting
+        on it, with self.idle set, rather than the thread waiting for the
+        client's next request.
+        """
+        self.idle = False
+        self.close_connection = True
+        self.handle_one_request()
+        while not self.close_connection:
+            if getattr(self.server, "watches_idle_connections", False) and not self.request_waiting():
+                self.idle = True
+                return
+            self.handle_one_request()
+
+    def request_waiting(self):
+        """
+        Check whether the next request has already arrived, without waiting.
+
+        Returns:
+            bool: True if some of it has been read or can be read at once
+        """
+        # With a zero timeout rfile.peek() returns whatever is buffered or
+        # readable now, and nothing rather than blocking
+        self.connection.settimeout(0)
+        try:
+            return bool(self.rfile.peek(1))
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def do_GET(self):
+        response = route_request("GET", self.path, request_headers=self.headers)
+        if response is None:
             super().do_GET()
+        else:
+            self.send_app_response(response)
 
     def do_POST(self):
-        if self.path == "/api/set-filters":
-            # Read the filter data from the request
-            content_length = int(self.headers["Content-Length"])
-            post_data = self.rfile.read(content_length)
-            filters = json.loads(post_data.decode())
-
-            # Save filters to a JSON file
-            with open("current_filters.json", "w") as f:
-                json.dump(filters, f)
-
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
-            self.end_headers()
-            self.wfile.write(json.dumps({"status": "success"}).encode())
-        elif self.path == "/api/clear-filters":
-            # Remove the filters file
-            if os.path.exists("current_filters.json"):
-                os.remove("current_filters.json") #removed when you clear filters
-
-            self.send_response(200)
-            self.send_header("Content-type", "application/json")
+        # Read the request body (e.g. the filter data)
+        content_length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(content_length)
+        self.send_app_response(route_request("POST", self.path, body, self.headers))
+
+    def send_app_response(self, response):
+        self.send_response(response.status)
+        for name, value in response.headers:
+            self.send_header(name, value)
+
+        if response.file_path is not None:
+            with open(response.file_path, "rb") as f:
+                size = os.fstat(f.fileno()).st_size
+                self.send_header("Content-Length", str(size))
+                self.end_headers()
+                # socket.sendfile() uses os.sendfile(), so the file's bytes
+                # go from the page cache to the socket without being copied
+                # into Python
+                self.connection.sendfile(f, 0, size)
+        elif response.chunks is not None:
+            if self.request_version == "HTTP/1.1":
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in response.chunks:
+                    if chunk:
+                        self.wfile.write(b"%X\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.write(b"0\r\n\r\n")
+            else:
+                # HTTP/1.0 has no chunked encoding: closing the connection
+                # marks the end of the body instead
+                self.close_connection = True
+                self.end_headers()
+                for chunk in response.chunks:
+                    self.wfile.write(chunk)
+        elif response.status == HTTPStatus.NOT_MODIFIED:
+            # A 304 never has a body
             self.end_headers()
-            self.wfile.write(json.dumps({"status": "success"}).encode())
         else:
-            self.send_response(404)
+            self.send_header("Content-Length", str(len(response.body)))
             self.end_headers()
+            self.wfile.write(response.body)
+
+
+class SingleConnectionHandler(Handler):
+    """
+    Handler for the "single" mode, which serves one connection at a time.
+
+    Waiting on an idle keep-alive connection would keep every other client
+    waiting too, so each connection is closed after its response.
+    """
+
+    def end_headers(self):
+        if not self.close_connection:
+            # send_header() sets close_connection as well
+            self.send_header("Connection", "close")
+        super().end_headers()
+
+
+class ThreadPoolHTTPServer(HTTPServer):
+    """
+    An HTTPServer that handles requests on a bounded pool of threads.
+
+    Unlike ThreadingHTTPServer, which starts a new thread per connection,
+    at most max_workers requests are processed at once; the rest wait in
+    the pool's queue. A worker is only taken up while a request is being
+    handled: between requests, keep-alive connections are handed back to a
+    watcher thread that waits for their next request with a selector, so
+    clients with idle connections don't keep other clients from being
+    served. Connections idle for idle_timeout seconds are closed.
+    """
+
+    request_queue_size = 128
+    idle_timeout = 5
+    # Tells Handler to return idle connections rather than wait on them
+    watches_idle_connections = True
+
+    def __init__(self, server_address, handler_class, max_workers=8):
+        super().__init__(server_address, handler_class)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="http-worker"
+        )
+        self._idle_selector = selectors.DefaultSelector()
+        # Connections to watch are passed to the watcher in _new_idle; a
+        # byte written to the socket pair wakes it up to register them
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._idle_selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        self._idle_lock = Lock()
+        self._new_idle = []
+        self._closed = False
+        self._watcher = Thread(
+            target=self._watch_idle_connections, name="http-idle", daemon=True
+        )
+        self._watcher.start()
+
+    def process_request(self, request, client_address):
+        # A new connection waits for its first request like an idle one
+        self._watch(request, client_address)
+
+    def _watch(self, request, client_address):
+        with self._idle_lock:
+            closed = self._closed
+            if not closed:
+                self._new_idle.append((request, client_address))
+        if closed:
+            self.shutdown_request(request)
+            return
+        try:
+            self._wakeup_writer.send(b"\0")
+        except BlockingIOError:
+            # The watcher already has wake-ups waiting
+            pass
+
+    def _watch_idle_connections(self):
+        next_sweep = time.monotonic() + 1
+        while True:
+            with self._idle_lock:
+                if self._closed:
+                    return
+                new_idle, self._new_idle = self._new_idle, []
+            now = time.monotonic()
+            for request, client_address in new_idle:
+                self._idle_selector.register(
+                    request, selectors.EVENT_READ, (client_address, now + self.idle_timeout)
+                )
+
+            for key, _ in self._idle_selector.select(timeout=1):
+                if key.fileobj is self._wakeup_reader:
+                    try:
+                        self._wakeup_reader.recv(4096)
+                    except BlockingIOError:
+                        pass
+                    continue
+                # A request has arrived (or the client has closed the
+                # connection, which the handler will find)
+                self._idle_selector.unregister(key.fileobj)
+                self.executor.submit(self._process_request_in_worker, key.fileobj, key.data[0])
+
+            now = time.monotonic()
+            if now >= next_sweep:
+                for key in list(self._idle_selector.get_map().values()):
+                    if key.data is not None and key.data[1] <= now:
+                        self._idle_selector.unregister(key.fileobj)
+                        self.shutdown_request(key.fileobj)
+                next_sweep = now + 1
+
+    def _process_request_in_worker(self, request, client_address):
+        idle = False
+        try:
+            handler = self.RequestHandlerClass(request, client_address, self)
+            idle = getattr(handler, "idle", False)
+        except Exception:
+            self.handle_error(request, client_address)
+        if idle:
+            self._watch(request, client_address)
+        else:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        with self._idle_lock:
+            self._closed = True
+            new_idle, self._new_idle = self._new_idle, []
+        try:
+            self._wakeup_writer.send(b"\0")
+        except BlockingIOError:
+            pass
+        self._watcher.join()
+        for key in list(self._idle_selector.get_map().values()):
+            if key.data is not None:
+                self.shutdown_request(key.fileobj)
+        for request, _ in new_idle:
+            self.shutdown_request(request)
+        self._idle_selector.close()
+        self._wakeup_reader.close()
+        self._wakeup_writer.close()
+        super().server_close()
+        self.executor.shutdown(wait=True)
+
+
+def serve_static_file(path):
+    """
+    Serve a file from the current directory (used by the asyncio server).
+
+    Args:
+        path (str): Request path
+
+    Returns:
+        Response: The file's contents, or a 404 response
+    """
+    root = os.path.realpath(os.getcwd())
+    relative_path = unquote(urlparse(path).path).lstrip("/") or "index.html"
+    file_path = os.path.realpath(os.path.join(root, relative_path))
+    if os.path.isdir(file_path):
+        file_path = os.path.join(file_path, "index.html")
+    if not file_path.startswith(root + os.sep) or not os.path.isfile(file_path):
+        return Response(404, content_type=None)
+
+    content_type = mimetypes.guess_type(file_path)[0] or "application/octet-stream"
+    return Response(200, content_type=content_type, file_path=file_path)
+
+
+def dispatch_request(method, path, body=b"", request_headers=None):
+    """
+    Route a request, falling back to static files (used by the asyncio server).
+
+    Args:
+        method (str): HTTP method
+        path (str): Request path including the query string
+        body (bytes): Request body
+        request_headers (dict, optional): The request's headers, with
+            lowercase names
+
+    Returns:
+        Response: The response to send
+    """
+    response = route_request(method, path, body, request_headers)
+    if response is None:
+        response = serve_static_file(path)
+    return response
+
 
+async def handle_connection(reader, writer, executor):
+    """
+    Serve HTTP/1.1 requests on one connection until the client closes it.
 
-server_address = ("", 3000)
-httpd = HTTPServer(server_address, Handler)
+    Parsing happens on the event loop; the request itself is handled on the
+    executor so that filtering and encoding don't block other connections.
+    """
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            request_line = await reader.readline()
+            if not request_line.strip():
+                break
+            method, path, version = request_line.decode("latin-1").split()
 
-# Set up file watcher for auto-reload
-observer = Observer()
-reload_handler = ReloadHandler([filter_module, pagination_module])
-observer.schedule(reload_handler, path=".", recursive=False)
-observer.start()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+            response = await loop.run_in_executor(
+                executor, dispatch_request, method, path, body, headers
+            )
+
+            keep_alive = (
+                version == "HTTP/1.1"
+                and headers.get("connection", "").lower() != "close"
+            )
+            await write_response(writer, response, keep_alive, executor)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def write_response(writer, response, keep_alive, executor):
+    """
+    Write a Response to an asyncio stream.
+
+    Files are sent with loop.sendfile() (os.sendfile() where possible) and
+    chunks are produced on the executor one at a time, so neither is held
+    in memory in full.
+    """
+    loop = asyncio.get_running_loop()
+    head = [f"HTTP/1.1 {response.status} {HTTPStatus(response.status).phrase}"]
+    head.extend(f"{name}: {value}" for name, value in response.headers)
+
+    file = None
+    if response.file_path is not None:
+        file = open(response.file_path, "rb")
+        size = os.fstat(file.fileno()).st_size
+        head.append(f"Content-Length: {size}")
+    elif response.chunks is not None:
+        # Without keep-alive, closing the connection ends the body
+        if keep_alive:
+            head.append("Transfer-Encoding: chunked")
+    elif response.status != HTTPStatus.NOT_MODIFIED:
+        head.append(f"Content-Length: {len(response.body)}")
+    head.append("Connection: " + ("keep-alive" if keep_alive else "close"))
+    writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+
+    if file is not None:
+        with file:
+            await writer.drain()
+            await loop.sendfile(writer.transport, file, 0, size)
+    elif response.chunks is not None:
+        chunks = iter(response.chunks)
+        while True:
+            chunk = await loop.run_in_executor(executor, next, chunks, None)
+            if chunk is None:
+                break
+            if not chunk:
+                continue
+            writer.write(b"%X\r\n%s\r\n" % (len(chunk), chunk) if keep_alive else chunk)
+            await writer.drain()
+        if keep_alive:
+            writer.write(b"0\r\n\r\n")
+    else:
+        writer.write(response.body)
+    await writer.drain()
+
+
+async def start_asyncio_server(host, port, executor):
+    """
+    Start listening for connections to the asyncio server.
+
+    Args:
+        host (str): Address to listen on ("" for all interfaces)
+        port (int): Port to listen on (0 for any free port)
+        executor (Executor): Where requests are handled
+
+    Returns:
+        asyncio.Server: The listening server
+    """
+    return await asyncio.start_server(
+        lambda reader, writer: handle_connection(reader, writer, executor),
+        host or None,
+        port,
+        backlog=128,
+    )
+
+
+async def serve_asyncio(host, port, max_workers):
+    """
+    Run the asyncio server until it is cancelled.
+
+    Args:
+        host (str): Address to listen on ("" for all interfaces)
+        port (int): Port to listen on
+        max_workers (int): Number of threads handling requests
+    """
+    executor = ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="http-worker"
+    )
+    server = await start_asyncio_server(host, port, executor)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        executor.shutdown(wait=False)
+
+
+def bump_code_version():
+    """Invalidate every ETag issued so far, e.g. after the code is reloaded."""
+    global code_version
+    code_version += 1
+
+
+def make_server(mode, port, max_workers):
+    """
+    Create a blocking HTTP server for the "single" or "threaded" mode.
+
+    Args:
+        mode (str): "single" for one connection (and so one request) at a
+            time, "threaded" for a bounded thread pool
+        port (int): Port to listen on
+        max_workers (int): Number of worker threads in "threaded" mode
+
+    Returns:
+        HTTPServer: The server, ready for serve_forever()
+    """
+    server_address = ("", port)
+    if mode == "threaded":
+        return ThreadPoolHTTPServer(server_address, Handler, max_workers=max_workers)
+    return HTTPServer(server_address, SingleConnectionHandler)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the product feed.")
+    parser.add_argument(
+        "--mode",
+        choices=["single", "threaded", "asyncio"],
+        default="threaded",
+        help="how concurrent requests are handled (default: threaded)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="worker threads for the threaded and asyncio modes (default: 8)",
+    )
+    parser.add_argument("--port", type=int, default=3000)
+    parser.add_argument(
+        "--compact",
+        action="store_true",
+        help="keep products in compact columns instead of dictionaries",
+    )
+    args = parser.parse_args(argv)
+    catalog_store.compact = args.compact
+
+    # Load the catalog up front so the first request doesn't pay for it
+    catalog_store.get()
+
+    # Pick up filters saved by an older client before the last restart
+    global saved_filters
+    saved_filters = read_filters_file()
+
+    # Set up file watcher for auto-reload
+    observer = Observer()
+    # Cached results and ETags may depend on the reloaded code, so drop them
+    # on reload
+    reload_handler = ReloadHandler(
+        [filter_module, pagination_module],
+        on_reload=[result_cache.clear, compressed_cache.clear, bump_code_version],
+        data_files=[catalog_store.filename, catalog_store.changes_filename],
+        on_data_change=[catalog_store.get],
+    )
+    observer.schedule(reload_handler, path=".", recursive=False)
+    observer.start()
+
+    print(f"🚀 Server starting on http://localhost:{args.port} ({args.mode} mode)")
+    print("👀 Watching for file changes (auto-reload enabled)...")
+    print("Press Ctrl+C to stop\n")
+
+    try:
+        if args.mode == "asyncio":
+            asyncio.run(serve_asyncio("", args.port, args.workers))
+        else:
+            httpd = make_server(args.mode, args.port, args.workers)
+            try:
+                httpd.serve_forever()
+            finally:
+                httpd.server_close()
+    except KeyboardInterrupt:
+        print("\n🛑 Shutting down server...")
+    finally:
+        observer.stop()
+        observer.join()
+        print("✅ Server stopped")
 
-print("🚀 Server starting on http://localhost:3000")
-print("👀 Watching for file changes (auto-reload enabled)...")
-print("Press Ctrl+C to stop\n")
 
-try:
-    httpd.serve_forever()
-except KeyboardInterrupt:
-    print("\n🛑 Shutting down server...")
-    observer.stop()
-    observer.join()
-    print("✅ Server stopped")
+if __name__ == "__main__":
+    main()
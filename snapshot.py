@@ -0,0 +1,446 @@
+"""
+Catalog Snapshot Module
+
+This module saves a loaded product catalog as a binary, column-oriented
+snapshot file next to the JSONL file it came from, and opens it again
+without parsing any JSON.
+
+Every product field is stored as one column, in one of these forms:
+
+- "float", "int" and "bool": fixed-width numeric arrays
+- "category": strings (or nulls) with few distinct values, stored as an
+  array of small integer codes plus the list of distinct values
+- "string": other strings, stored in a heap of UTF-8 bytes with an array
+  of offsets into it
+- "json": anything else (mixed types, nested values), stored like
+  "string" but JSON-encoded
+
+Each product's json.dumps() output is stored in a heap as well, so the
+server can send products without encoding them. Any other arrays computed
+from the products (such as the ProductIndex's posting lists and sort
+orders) can be stored alongside them, with a little JSON metadata, so they
+don't have to be computed again either.
+
+The file starts with a magic string and a JSON header describing where
+each column is, followed by the column data. Opening a snapshot only reads
+the header: the data is memory-mapped, and products are built from the
+columns when they are accessed.
+
+A snapshot records the size and modification time of the JSONL file it was
+made from, and is only used while the JSONL file still matches them.
+"""
+
+import json
+import mmap
+import os
+import struct
+from array import array
+from collections.abc import Sequence
+
+from compact import column_type, field_names
+
+
+MAGIC = b"PRODSNAP1\n"
+
+# Snapshots are saved as <data file> + SUFFIX, e.g. data.jsonl.snapshot
+SUFFIX = ".snapshot"
+
+_HEADER_SIZE = struct.Struct("<Q")
+
+
+def snapshot_path(filename):
+    """
+    Get the path a data file's snapshot is saved to.
+
+    Args:
+        filename (str): Path to the JSONL data file
+
+    Returns:
+        str: Path to the snapshot file
+    """
+    return filename + SUFFIX
+
+
+def _heap(encoded_values):
+    # Offsets of each value in the joined bytes, plus the end of the last one
+    offsets = array("q", [0])
+    total = 0
+    for value in encoded_values:
+        total += len(value)
+        offsets.append(total)
+    return offsets, b"".join(encoded_values)
+
+
+def write_snapshot(products, path, source_size, source_mtime_ns, encoded_products=None, arrays=None, metadata=None):
+    """
+    Save products as a snapshot file.
+
+    The file is written to a temporary name and renamed into place, so a
+    half-written snapshot is never opened.
+
+    Args:
+        products (list): Product dictionaries, all with the same fields in
+            the same order
+        path (str): Path to write the snapshot to
+        source_size (int): Size of the JSONL file the products were loaded from
+        source_mtime_ns (int): Modification time of that file
+        encoded_products (list, optional): Each product's json.dumps() output
+            as bytes, if already computed
+        arrays (dict, optional): Maps name -> array of other data to store
+            (see Snapshot.arrays)
+        metadata (optional): Anything json.dumps() can encode, to store with
+            the arrays (see Snapshot.metadata)
+
+    Raises:
+        ValueError: If the products don't all have the same fields
+    """
+    get_column = getattr(products, "column_values", None)
+    if get_column is None:
+        names = field_names(products)
+
+        def get_column(name):
+            return [product[name] for product in products]
+
+    else:
+        # Column-backed sequences (compact.ColumnarProducts, SnapshotProducts)
+        # only ever hold products with the same fields
+        names = list(products.names)
+    if encoded_products is None:
+        encoded_products = [json.dumps(product).encode() for product in products]
+
+    header = {
+        "rows": len(products),
+        "source_size": source_size,
+        "source_mtime_ns": source_mtime_ns,
+        "columns": [],
+        "encoded_products": {},
+        "arrays": {},
+        "metadata": metadata,
+    }
+    # (description to record the extents in, extent names, data for each)
+    sections = []
+    for name in names:
+        values = get_column(name)
+        column = {"name": name, "type": column_type(values)}
+        header["columns"].append(column)
+        if column["type"] == "float":
+            sections.append((column, ["data"], [array("d", values)]))
+        elif column["type"] == "int":
+            sections.append((column, ["data"], [array("q", values)]))
+        elif column["type"] == "bool":
+            sections.append((column, ["data"], [array("B", values)]))
+        elif column["type"] == "category":
+            dictionary = list(dict.fromkeys(values))
+            codes = {value: code for code, value in enumerate(dictionary)}
+            column["dictionary"] = dictionary
+            sections.append(
+                (column, ["data"], [array("H", [codes[value] for value in values])])
+            )
+        elif column["type"] == "string":
+            heap = _heap([value.encode() for value in values])
+            sections.append((column, ["offsets", "heap"], heap))
+        else:
+            heap = _heap([json.dumps(value).encode() for value in values])
+            sections.append((column, ["offsets", "heap"], heap))
+    sections.append(
+        (header["encoded_products"], ["offsets", "heap"], _heap(encoded_products))
+    )
+    for name, values in (arrays or {}).items():
+        description = header["arrays"][name] = {
+            "typecode": values.typecode,
+            "itemsize": values.itemsize,
+        }
+        sections.append((description, ["data"], [values]))
+
+    # Lay the data out after the header, each part starting on an 8-byte
+    # boundary so the arrays can be used straight from the memory map
+    layout = []
+    position = 0
+    for description, keys, parts in sections:
+        for key, part in zip(keys, parts):
+            data = part.tobytes() if isinstance(part, array) else part
+            description[key] = [position, len(data)]
+            layout.append((position, data))
+            position += len(data) + (-len(data) % 8)
+
+    header_bytes = json.dumps(header).encode()
+    header_bytes += b" " * (-(len(MAGIC) + _HEADER_SIZE.size + len(header_bytes)) % 8)
+    data_start = len(MAGIC) + _HEADER_SIZE.size + len(header_bytes)
+
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, "wb") as file:
+            file.write(MAGIC)
+            file.write(_HEADER_SIZE.pack(len(header_bytes)))
+            file.write(header_bytes)
+            for offset, data in layout:
+                file.seek(data_start + offset)
+                file.write(data)
+            file.truncate(data_start + position)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class Snapshot:
+    """
+    A memory-mapped snapshot file.
+
+    Attributes:
+        path (str): Path to the snapshot file
+        rows (int): Number of products
+        names (list): Field names, in the order they appear in each product
+        columns (dict): Maps field name -> column description from the header
+        source_size (int): Size of the JSONL file the snapshot was made from
+        source_mtime_ns (int): Modification time of that JSONL file
+        metadata: The metadata stored with the arrays, or None
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a catalog snapshot")
+        (header_size,) = _HEADER_SIZE.unpack_from(self._map, len(MAGIC))
+        header_start = len(MAGIC) + _HEADER_SIZE.size
+        header = json.loads(self._map[header_start : header_start + header_size])
+        self._data_start = header_start + header_size
+        self._view = memoryview(self._map)
+
+        self.rows = header["rows"]
+        self.source_size = header["source_size"]
+        self.source_mtime_ns = header["source_mtime_ns"]
+        self.columns = {column["name"]: column for column in header["columns"]}
+        self.names = list(self.columns)
+        self._encoded_products = header["encoded_products"]
+        self._arrays = header["arrays"]
+        self.metadata = header["metadata"]
+
+    def _array(self, extent, typecode):
+        # A zero-copy view of one stored array
+        start, length = extent
+        start += self._data_start
+        return self._view[start : start + length].cast(typecode)
+
+    def _heap_values(self, block):
+        # Returns a function reading one value's bytes from a heap
+        offsets = self._array(block["offsets"], "q")
+        heap_start = self._data_start + block["heap"][0]
+        view = self._view
+
+        def read(row_id):
+            return bytes(
+                view[heap_start + offsets[row_id] : heap_start + offsets[row_id + 1]]
+            )
+
+        return read
+
+    def column_values(self, name):
+        """
+        Get every product's value for one field.
+
+        Numeric columns are returned as zero-copy views onto the file;
+        other columns are decoded into a list.
+
+        Args:
+            name (str): Field name
+
+        Returns:
+            Sequence of values, by row id (all None if no product has the field)
+        """
+        column = self.columns.get(name)
+        if column is None:
+            return [None] * self.rows
+        kind = column["type"]
+        if kind == "float":
+            return self._array(column["data"], "d")
+        if kind == "int":
+            return self._array(column["data"], "q")
+        if kind == "bool":
+            return [bool(value) for value in self._array(column["data"], "B")]
+        if kind == "category":
+            dictionary = column["dictionary"]
+            return [dictionary[code] for code in self._array(column["data"], "H")]
+        read = self._heap_values(column)
+        if kind == "string":
+            return [read(row_id).decode() for row_id in range(self.rows)]
+        return [json.loads(read(row_id)) for row_id in range(self.rows)]
+
+    def _value_reader(self, name):
+        # Returns a function reading one product's value for a field
+        column = self.columns[name]
+        kind = column["type"]
+        if kind in ("float", "int"):
+            return self._array(column["data"], "d" if kind == "float" else "q").__getitem__
+        if kind == "bool":
+            flags = self._array(column["data"], "B")
+            return lambda row_id: flags[row_id] == 1
+        if kind == "category":
+            dictionary = column["dictionary"]
+            codes = self._array(column["data"], "H")
+            return lambda row_id: dictionary[codes[row_id]]
+        read = self._heap_values(column)
+        if kind == "string":
+            return lambda row_id: read(row_id).decode()
+        return lambda row_id: json.loads(read(row_id))
+
+    def arrays(self):
+        """
+        Get the other arrays stored in the snapshot.
+
+        Returns:
+            dict: Maps name -> zero-copy memoryview of each stored array, or
+            None if the arrays were stored on a platform with different
+            integer sizes
+        """
+        arrays = {}
+        for name, description in self._arrays.items():
+            typecode = description["typecode"]
+            if array(typecode).itemsize != description["itemsize"]:
+                return None
+            arrays[name] = self._array(description["data"], typecode)
+        return arrays
+
+    def products(self):
+        """
+        Get the products, built from the columns as they are accessed.
+
+        Returns:
+            SnapshotProducts: A read-only sequence of product dictionaries
+        """
+        return SnapshotProducts(self)
+
+    def encoded_products(self):
+        """
+        Get each product's stored json.dumps() output.
+
+        Returns:
+            EncodedProducts: A read-only sequence of bytes, by row id
+        """
+        return EncodedProducts(self)
+
+
+class SnapshotProducts(Sequence):
+    """
+    The products of a Snapshot, as a sequence of dictionaries.
+
+    Each product is built from the columns when it is accessed, so a new
+    dictionary is returned every time. Code that needs one field of every
+    product can use column_values() instead, which doesn't build products.
+
+    Attributes:
+        snapshot (Snapshot): The snapshot the products are read from
+        names (list): Field names, in the order they appear in each product
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self.names = snapshot.names
+        self._readers = [
+            (name, snapshot._value_reader(name)) for name in snapshot.names
+        ]
+
+    def __len__(self):
+        return self.snapshot.rows
+
+    def __getitem__(self, row_id):
+        if isinstance(row_id, slice):
+            return [self[i] for i in range(*row_id.indices(len(self)))]
+        if row_id < 0:
+            row_id += len(self)
+        if not 0 <= row_id < len(self):
+            raise IndexError("product index out of range")
+        return {name: read(row_id) for name, read in self._readers}
+
+    def __iter__(self):
+        names = self.names
+        columns = [self.snapshot.column_values(name) for name in names]
+        for values in zip(*columns):
+            yield dict(zip(names, values))
+
+    def column_values(self, name):
+        """
+        Get every product's value for one field (see Snapshot.column_values).
+
+        Args:
+            name (str): Field name
+
+        Returns:
+            Sequence of values, by row id
+        """
+        return self.snapshot.column_values(name)
+
+
+class EncodedProducts(Sequence):
+    """
+    The stored json.dumps() output of each product in a Snapshot.
+
+    Attributes:
+        snapshot (Snapshot): The snapshot the products are read from
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._read = snapshot._heap_values(snapshot._encoded_products)
+
+    def __len__(self):
+        return self.snapshot.rows
+
+    def __getitem__(self, row_id):
+        if isinstance(row_id, slice):
+            return [self[i] for i in range(*row_id.indices(len(self)))]
+        if row_id < 0:
+            row_id += len(self)
+        if not 0 <= row_id < len(self):
+            raise IndexError("product index out of range")
+        return self._read(row_id)
+
+
+def open_snapshot(filename):
+    """
+    Open a data file's snapshot, if it is up to date.
+
+    Args:
+        filename (str): Path to the JSONL data file
+
+    Returns:
+        Snapshot: The snapshot, or None if there isn't one or the data file
+        has changed since it was made
+    """
+    path = snapshot_path(filename)
+    try:
+        source_stat = os.stat(filename)
+        snapshot = Snapshot(path)
+    except (OSError, ValueError, KeyError, struct.error):
+        # Missing, or not a complete snapshot
+        return None
+    if (
+        snapshot.source_size != source_stat.st_size
+        or snapshot.source_mtime_ns != source_stat.st_mtime_ns
+    ):
+        return None
+    return snapshot
+
+
+if __name__ == "__main__":
+    import sys
+
+    import jsonl_loader
+    from catalog import Catalog, CatalogStore
+
+    # Saves a snapshot of the given data file (default: data.jsonl), as it
+    # is without its change log
+    filename = sys.argv[1] if len(sys.argv) > 1 else "data.jsonl"
+    stat_result = os.stat(filename)
+    catalog = Catalog(
+        jsonl_loader.load_jsonl(filename),
+        filename,
+        stat_result.st_mtime_ns,
+        stat_result.st_size,
+        1,
+    )
+    CatalogStore(filename).save_snapshot(catalog)
+    print(f"Wrote {snapshot_path(filename)}")
@@ -0,0 +1,165 @@
+"""
+Test suite for the storage backend benchmarks.
+
+This module contains pytest tests for backends.py. The PostgreSQL and
+MongoDB backends need running servers, so only the queries they would send
+are checked here.
+"""
+
+import random
+
+import pytest
+from backends import (
+    BackendUnavailable,
+    JsonlBackend,
+    JsonlScanBackend,
+    build_query_mix,
+    latency_percentiles,
+    mongo_filter,
+    run_benchmarks,
+    sql_order,
+    sql_where,
+)
+from query_planner import Exclude
+
+
+@pytest.fixture
+def products():
+    """Fixture with 500 random products, with many equal prices and scores"""
+    generator = random.Random(3)
+    products = []
+    for product_id in range(500):
+        regular_price = generator.choice([40.0, 120.0, 300.0, 800.0])
+        products.append(
+            {
+                "product_id": product_id,
+                "color": generator.choice(["red", "black", "blue", None]),
+                "designer": generator.choice(["gucci", "prada", "dior"]),
+                "gender": generator.choice(["F", "M"]),
+                "on_sale": generator.random() < 0.4,
+                "regular_price": regular_price,
+                "discount_price": regular_price / 2,
+                "item_score": generator.choice([1.0, 2.5, 4.0]),
+            }
+        )
+    return products
+
+
+def unavailable():
+    raise BackendUnavailable("not running")
+
+
+class TestQueries:
+    """Tests for the queries sent to the databases"""
+
+    def test_sql_where(self):
+        """Test that each filter becomes a condition with its parameters"""
+        condition, parameters = sql_where(
+            {
+                "color": ["red", "blue"],
+                "brand": Exclude(["dior"]),
+                "gender": "F",
+                "on_sale": False,
+                "price_range": (100, 250),
+            }
+        )
+        assert condition == (
+            "color = ANY(%s) AND (designer IS NULL OR designer <> ALL(%s)) AND gender = %s"
+            " AND on_sale = %s AND effective_price BETWEEN %s AND %s"
+        )
+        assert parameters == [["red", "blue"], ["dior"], "F", False, 100, 250]
+
+    def test_sql_without_filters(self):
+        """Test that no filters match every row"""
+        assert sql_where({}) == ("TRUE", [])
+
+    def test_sql_order_keeps_ties_in_catalog_order(self):
+        """Test that every sort order ends with the catalog position"""
+        assert sql_order(None) == "row_id ASC"
+        assert sql_order("price_high_to_low") == "effective_price DESC, row_id ASC"
+        assert sql_order("popularity") == "item_score DESC, row_id ASC"
+
+    def test_mongo_filter(self):
+        """Test that each filter becomes a query document field"""
+        assert mongo_filter(
+            {
+                "color": ["red", "blue"],
+                "brand": Exclude(["dior"]),
+                "gender": "F",
+                "on_sale": True,
+                "price_range": (100, 250),
+            }
+        ) == {
+            "color": {"$in": ["red", "blue"]},
+            "designer": {"$nin": ["dior"]},
+            "gender": "F",
+            "on_sale": True,
+            "effective_price": {"$gte": 100, "$lte": 250},
+        }
+
+    def test_query_mix(self, products):
+        """Test that the mix covers every sort order and page for each filter set"""
+        queries = build_query_mix(products)
+        assert len(queries) == 8 * 4 * 3
+        assert len({query["name"] for query in queries}) == len(queries)
+        assert {query["sort_by"] for query in queries} == {
+            None,
+            "price_high_to_low",
+            "price_low_to_high",
+            "popularity",
+        }
+        assert {query["page"] for query in queries} == {1, 10, 100}
+        assert queries == build_query_mix(products)
+
+
+class TestRunBenchmarks:
+    """Tests for timing backends against each other"""
+
+    def test_backends_agree(self, products):
+        """Test that the indexed and scanning backends give the same answers"""
+        queries = build_query_mix(products, pages=(1, 2, 3))
+        queries.append(
+            {
+                "name": "exclusions",
+                "filters": {"color": Exclude(["red"]), "brand": ["gucci", "dior"]},
+                "sort_by": "price_low_to_high",
+                "page": 2,
+            }
+        )
+        reports = run_benchmarks(
+            [("jsonl", JsonlBackend), ("jsonl-scan", JsonlScanBackend)],
+            products,
+            queries,
+            repeat=2,
+            items_per_page=20,
+        )
+        report = reports["jsonl-scan"]
+        assert report["status"] == "ok"
+        assert report["compared_with"] == "jsonl"
+        assert report["mismatches"] == []
+        assert report["queries"]["none/catalog/page 1"]["total"] == len(products)
+        assert set(report["warm_ms"]) == {"p50", "p95", "p99", "max"}
+        assert report["throughput_qps"] > 0
+
+    def test_unavailable_backends_are_skipped(self, products):
+        """Test that a backend that can't be reached doesn't stop the run"""
+        reports = run_benchmarks(
+            [("postgres", unavailable), ("jsonl", JsonlBackend)],
+            products,
+            build_query_mix(products, pages=(1,)),
+            repeat=1,
+        )
+        assert reports["postgres"] == {"status": "skipped", "reason": "not running"}
+        assert reports["jsonl"]["status"] == "ok"
+        assert reports["jsonl"]["compared_with"] == "jsonl"
+
+    def test_latency_percentiles(self):
+        """Test nearest-rank percentiles in milliseconds"""
+        seconds = [index / 1000 for index in range(1, 101)]
+        assert latency_percentiles(seconds) == {
+            "p50": 50.0,
+            "p95": 95.0,
+            "p99": 99.0,
+            "max": 100.0,
+        }
+        assert latency_percentiles([]) == {"p50": None, "p95": None, "p99": None, "max": None}
@@ -0,0 +1,182 @@
+"""
+Test suite for the in-memory product catalog.
+
+This module contains pytest tests for the catalog.py module.
+"""
+
+import json
+import os
+
+import pytest
+from catalog import CatalogError, CatalogStore
+
+
+def write_products(path, products):
+    """Write a list of product dictionaries to a JSONL file"""
+    with open(path, "w") as file:
+        for product in products:
+            file.write(json.dumps(product) + "\n")
+
+
+def make_product(product_id, color):
+    """Build a minimal product dictionary"""
+    return {
+        "product_id": product_id,
+        "color": color,
+        "designer": "gucci",
+        "gender": "F",
+        "on_sale": False,
+        "regular_price": 100.0,
+        "discount_price": 100.0,
+        "item_score": 1.0,
+    }
+
+
+def touch_later(path):
+    """Move the file's modification time forward so the change is detected"""
+    stat_result = os.stat(path)
+    os.utime(path, ns=(stat_result.st_atime_ns, stat_result.st_mtime_ns + 10**9))
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    """Fixture with a small JSONL data file"""
+    path = tmp_path / "data.jsonl"
+    write_products(
+        path,
+        [
+            make_product(1, "red"),
+            make_product(2, "black"),
+        ],
+    )
+    return str(path)
+
+
+class TestCatalogStore:
+    """Tests for the CatalogStore class"""
+
+    def test_loads_products(self, data_file):
+        """Test that the catalog contains every product in the file"""
+        catalog = CatalogStore(data_file).get()
+        assert len(catalog) == 2
+        assert [p["product_id"] for p in catalog.products] == [1, 2]
+        assert catalog.version == 1
+
+    def test_reuses_catalog_when_unchanged(self, data_file):
+        """Test that repeated calls return the same in-memory catalog"""
+        store = CatalogStore(data_file)
+        assert store.get() is store.get()
+
+    def test_swaps_catalog_when_file_changes(self, data_file):
+        """Test that a modified file is reloaded into a new catalog"""
+        store = CatalogStore(data_file)
+        old_catalog = store.get()
+
+        write_products(data_file, [make_product(3, "blue")])
+        touch_later(data_file)
+
+        new_catalog = store.get()
+        assert new_catalog is not old_catalog
+        assert new_catalog.version == old_catalog.version + 1
+        assert [p["product_id"] for p in new_catalog.products] == [3]
+        # The old snapshot is left untouched for requests still using it
+        assert [p["product_id"] for p in old_catalog.products] == [1, 2]
+
+    def test_reload_forces_new_catalog(self, data_file):
+        """Test that reload() re-reads the file even if it hasn't changed"""
+        store = CatalogStore(data_file)
+        old_catalog = store.get()
+        assert store.reload() is not old_catalog
+        assert store.get().version == 2
+
+
+def append_lines(path, lines):
+    """Append JSON lines to a file"""
+    with open(path, "a") as file:
+        for line in lines:
+            file.write(json.dumps(line) + "\n")
+
+
+class TestCatalogUpdates:
+    """Tests for applying appended products and logged changes"""
+
+    def test_appended_products_are_added(self, data_file):
+        """Test that products appended to the file update the catalog"""
+        store = CatalogStore(data_file)
+        old_catalog = store.get()
+
+        append_lines(data_file, [make_product(3, "red")])
+        catalog = store.get()
+        assert catalog.version == 2
+        assert [p["product_id"] for p in catalog.products] == [1, 2, 3]
+        assert list(catalog.index.posting_list("color", "red")) == [0, 2]
+        assert catalog.encoded_products[2] == json.dumps(make_product(3, "red")).encode()
+        assert [p["product_id"] for p in old_catalog.products] == [1, 2]
+        assert store.get() is catalog
+
+    def test_change_log(self, data_file):
+        """Test that logged upserts and deletes are applied by product_id"""
+        store = CatalogStore(data_file)
+        store.get()
+
+        append_lines(
+            store.changes_filename,
+            [
+                {"op": "upsert", "product": make_product(2, "blue")},
+                {"op": "delete", "product_id": 1},
+                {"op": "upsert", "product": make_product(4, "red")},
+            ],
+        )
+        catalog = store.get()
+        assert catalog.products == [make_product(2, "blue"), make_product(4, "red")]
+        assert list(catalog.index.posting_list("color", "blue")) == [0]
+        assert catalog.index.row_ids_by_product_id == {2: 0, 4: 1}
+        assert list(catalog.encoded_products) == [
+            json.dumps(product).encode() for product in catalog.products
+        ]
+
+        # A new store applies the whole change log after loading the file
+        assert CatalogStore(data_file).get().products == catalog.products
+
+    def test_rewritten_file_is_reloaded(self, data_file):
+        """Test that a change other than appending loads the file again"""
+        store = CatalogStore(data_file)
+        store.get()
+        append_lines(store.changes_filename, [{"op": "delete", "product_id": 1}])
+        assert len(store.get()) == 1
+
+        os.remove(store.changes_filename)
+        assert [p["product_id"] for p in store.get().products] == [1, 2]
+
+    def test_invalid_change_keeps_last_catalog(self, data_file, capsys):
+        """Test that a bad line in the change log is logged and the last catalog kept"""
+        store = CatalogStore(data_file)
+        catalog = store.get()
+
+        append_lines(store.changes_filename, [{"op": "upsert"}])
+        assert store.get() is catalog
+        assert "invalid change" in capsys.readouterr().err
+        # The same broken file isn't read again
+        assert store.get() is catalog
+        assert capsys.readouterr().err == ""
+
+        # Once the line is fixed the change log is read again
+        with open(store.changes_filename, "w") as file:
+            file.write(json.dumps({"op": "delete", "product_id": 1}) + "\n")
+        assert [p["product_id"] for p in store.get().products] == [2]
+
+    def test_invalid_appended_product_keeps_last_catalog(self, data_file, capsys):
+        """Test that a product line that isn't JSON is logged and the last catalog kept"""
+        store = CatalogStore(data_file)
+        catalog = store.get()
+        with open(data_file, "a") as file:
+            file.write("{not json\n")
+        assert store.get() is catalog
+        assert "Error reading" in capsys.readouterr().err
+
+    def test_invalid_file_without_catalog(self, data_file):
+        """Test that a file that can't be loaded at all raises CatalogError"""
+        with open(data_file, "a") as file:
+            file.write("{not json\n")
+        with pytest.raises(CatalogError):
+            CatalogStore(data_file).get()
@@ -0,0 +1,126 @@
+"""
+Test suite for reading catalog changes.
+
+This module contains pytest tests for the catalog_changes.py module.
+"""
+
+import os
+
+import pytest
+from catalog_changes import (
+    FileMark,
+    PatchedSequence,
+    parse_operations,
+    parse_products,
+    patch_sequence,
+)
+
+
+@pytest.fixture
+def log_file(tmp_path):
+    """Fixture with a two-line file"""
+    path = tmp_path / "data.jsonl"
+    path.write_bytes(b'{"product_id": 1}\n{"product_id": 2}\n')
+    return str(path)
+
+
+def append(path, data):
+    """Append bytes to a file"""
+    with open(path, "ab") as file:
+        file.write(data)
+
+
+class TestFileMark:
+    """Tests for finding what has been appended to a file"""
+
+    def test_reads_appended_lines(self, log_file):
+        """Test that only the new lines are read"""
+        mark = FileMark(log_file, os.stat(log_file))
+        assert mark.is_current(os.stat(log_file))
+
+        append(log_file, b'{"product_id": 3}\n')
+        assert not mark.is_current(os.stat(log_file))
+        data, mark = mark.read_appended(os.stat(log_file))
+        assert parse_products(data) == [{"product_id": 3}]
+        assert mark.is_current(os.stat(log_file))
+
+    def test_waits_for_complete_lines(self, log_file):
+        """Test that a line still being written is read once it's finished"""
+        mark = FileMark(log_file, os.stat(log_file))
+        append(log_file, b'{"product_id"')
+        data, mark = mark.read_appended(os.stat(log_file))
+        assert data == b""
+
+        append(log_file, b": 3}\n")
+        data, mark = mark.read_appended(os.stat(log_file))
+        assert parse_products(data) == [{"product_id": 3}]
+
+    def test_rewritten_file(self, log_file):
+        """Test that changes other than appending aren't read as appends"""
+        mark = FileMark(log_file, os.stat(log_file))
+        with open(log_file, "r+b") as file:
+            file.write(b'{"product_id": 9}\n{"product_id": 2}\n{"product_id": 3}\n')
+        assert mark.read_appended(os.stat(log_file)) is None
+
+        mark = FileMark(log_file, os.stat(log_file))
+        with open(log_file, "r+b") as file:
+            file.truncate(18)
+        assert mark.read_appended(os.stat(log_file)) is None
+
+    def test_missing_file(self, log_file):
+        """Test that a file that doesn't exist yet is read from the start"""
+        mark = FileMark(log_file)
+        assert mark.is_current(None)
+        assert mark.read_appended(None) == (b"", mark)
+        data, _ = mark.read_appended(os.stat(log_file))
+        assert len(parse_products(data)) == 2
+
+        # A file that has been removed has to be loaded again
+        mark = FileMark(log_file, os.stat(log_file))
+        assert mark.read_appended(None) is None
+
+
+class TestParseOperations:
+    """Tests for parsing change log lines"""
+
+    def test_operations(self):
+        """Test that upserts and deletes are read in order"""
+        data = (
+            b'{"op": "upsert", "product": {"product_id": 1}}\n'
+            b"\n"
+            b'{"op": "delete", "product_id": 2}\n'
+        )
+        assert parse_operations(data) == [
+            ("upsert", {"product_id": 1}),
+            ("delete", 2),
+        ]
+
+    def test_invalid_operation(self):
+        """Test that an unknown or incomplete change is rejected"""
+        with pytest.raises(ValueError):
+            parse_operations(b'{"op": "rename", "product_id": 2}\n')
+        with pytest.raises(ValueError):
+            parse_operations(b'{"op": "delete"}\n')
+
+
+class TestPatchSequence:
+    """Tests for changing sequences without modifying them"""
+
+    def test_list_is_copied(self):
+        """Test that a list is copied with the changes made"""
+        items = ["a", "b", "c", "d"]
+        assert patch_sequence(items, {1: "B"}, {2}, ["e"]) == ["a", "B", "d", "e"]
+        assert items == ["a", "b", "c", "d"]
+
+    def test_other_sequences_are_wrapped(self):
+        """Test that read-only sequences are patched without copying them"""
+        items = ("a", "b", "c", "d")
+        patched = patch_sequence(items, {1: "B"}, {2}, ["e"])
+        assert isinstance(patched, PatchedSequence)
+        assert patched.base is items
+        assert list(patched) == ["a", "B", "d", "e"]
+        assert patched[-1] == "e"
+
+        patched = patch_sequence(patched, {3: "E"}, {0}, ["f"])
+        assert patched.base is items
+        assert list(patched) == ["B", "d", "E", "f"]
@@ -0,0 +1,128 @@
+"""
+Test suite for compact product storage.
+
+This module contains pytest tests for the compact.py module.
+"""
+
+import pytest
+from catalog import CatalogStore
+from compact import ColumnarProducts, column_type
+from filter import apply_filters, sort_by_price_low_to_high
+from pagination import get_page_data
+from test_catalog import make_product, write_products
+
+
+def make_products():
+    """Build products with a field of every column type"""
+    products = []
+    for product_id in range(20):
+        product = make_product(product_id, ["red", "black"][product_id % 2])
+        product["on_sale"] = product_id % 3 == 0
+        product["discount_price"] = 50.0 + product_id
+        product["short_description"] = f"Product number {product_id}"
+        product["sizes"] = ["S", "M"] if product_id % 5 else None
+        products.append(product)
+    return products
+
+
+class TestColumnType:
+    """Tests for choosing how a field is stored"""
+
+    def test_numbers_and_flags(self):
+        """Test that numbers and booleans are packed into arrays"""
+        assert column_type([1.5, 2.0]) == "float"
+        assert column_type([1, 2]) == "int"
+        assert column_type([True, False]) == "bool"
+        assert column_type([1, 2.5]) == "json"
+        assert column_type([2**70]) == "json"
+
+    def test_strings(self):
+        """Test that only strings with repeated values are categories"""
+        assert column_type(["red", "black", None, "red"] * 3) == "category"
+        assert column_type(["a", "b", "c", "d"]) == "string"
+        assert column_type([None, None]) == "json"
+
+
+class TestColumnarProducts:
+    """Tests for the ColumnarProducts class"""
+
+    def test_round_trip(self):
+        """Test that every product comes back unchanged"""
+        products = make_products()
+        columnar = ColumnarProducts(products)
+        assert len(columnar) == 20
+        assert list(columnar) == products
+        assert columnar[3] == products[3]
+        assert columnar[-1] == products[-1]
+        assert columnar[2:5] == products[2:5]
+        with pytest.raises(IndexError):
+            columnar[20]
+
+    def test_column_types(self):
+        """Test that each field is stored in the expected column"""
+        columnar = ColumnarProducts(make_products())
+        assert columnar.types["product_id"] == "int"
+        assert columnar.types["color"] == "category"
+        assert columnar.types["on_sale"] == "bool"
+        assert columnar.types["short_description"] == "string"
+        assert columnar.types["sizes"] == "json"
+
+    def test_categories_are_shared(self):
+        """Test that repeated category values are a single object"""
+        columnar = ColumnarProducts(make_products())
+        colors = columnar.column_values("color")
+        assert colors[0] is colors[2]
+        assert columnar[0]["color"] is columnar[2]["color"]
+
+    def test_column_values(self):
+        """Test that a column can be read without building products"""
+        products = make_products()
+        columnar = ColumnarProducts(products)
+        for name in products[0]:
+            assert list(columnar.column_values(name)) == [
+                product[name] for product in products
+            ]
+        assert columnar.column_values("missing") == [None] * 20
+
+    def test_products_must_have_same_fields(self):
+        """Test that products with different fields are rejected"""
+        with pytest.raises(ValueError):
+            ColumnarProducts([{"a": 1}, {"b": 1}])
+
+    def test_filters_sorts_and_pages(self):
+        """Test that the filter, sort and page functions accept columns"""
+        products = make_products()
+        columnar = ColumnarProducts(products)
+        assert apply_filters(columnar, color="black", on_sale=True) == apply_filters(
+            products, color="black", on_sale=True
+        )
+        assert sort_by_price_low_to_high(columnar) == sort_by_price_low_to_high(products)
+        assert get_page_data(columnar, 2, 5) == get_page_data(products, 2, 5)
+
+
+class TestCompactCatalog:
+    """Tests for a catalog that keeps its products compact"""
+
+    def test_catalog_matches(self, tmp_path):
+        """Test that a compact catalog has the same index and responses"""
+        path = str(tmp_path / "data.jsonl")
+        write_products(path, make_products())
+        parsed = CatalogStore(path).get()
+        catalog = CatalogStore(path, compact=True).get()
+        assert isinstance(catalog.products, ColumnarProducts)
+        assert catalog.encoded_products == parsed.encoded_products
+        assert catalog.index.postings == parsed.index.postings
+        assert catalog.index.sort_orders == parsed.index.sort_orders
+        criteria = {"color": "black"}
+        assert list(catalog.index.lookup(criteria, (50, 60))) == list(
+            parsed.index.lookup(criteria, (50, 60))
+        )
+
+    def test_uneven_products_stay_dicts(self, tmp_path):
+        """Test that products with different fields are kept as a list"""
+        path = str(tmp_path / "data.jsonl")
+        products = make_products()
+        del products[0]["sizes"]
+        write_products(path, products)
+        catalog = CatalogStore(path, compact=True).get()
+        assert catalog.products == products
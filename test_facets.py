@@ -0,0 +1,143 @@
+"""
+Test suite for facet counts.
+
+This module contains pytest tests for FacetIndex in facets.py.
+"""
+
+import random
+from collections import Counter
+
+import pytest
+from facets import FacetIndex
+from filter import apply_filters, count_facets
+from product_index import ProductIndex
+from query_planner import Exclude
+
+
+@pytest.fixture
+def products():
+    """Fixture with 300 random products, some priced on bucket boundaries"""
+    generator = random.Random(7)
+    products = []
+    for product_id in range(300):
+        regular_price = generator.choice([50.0, 100.0, 99999.0, 25.5, 75.0, 300.0, 120000.0])
+        products.append(
+            {
+                "product_id": product_id,
+                "color": generator.choice(["red", "black", "blue", None]),
+                "designer": generator.choice(["gucci", "prada", "dior"]),
+                "gender": generator.choice(["F", "M"]),
+                "on_sale": generator.random() < 0.3,
+                "regular_price": regular_price,
+                "discount_price": regular_price / 2,
+                "item_score": generator.random(),
+            }
+        )
+    return products
+
+
+# Facet name -> (product field, apply_filters argument)
+FACETS = {
+    "color": ("color", "color"),
+    "designer": ("designer", "brand"),
+    "gender": ("gender", "gender"),
+    "on_sale": ("on_sale", "on_sale"),
+}
+
+
+def expected_counts(products, facet_index, filters):
+    """Count each facet by filtering the products without it"""
+    facets = {}
+    for facet, (field, argument) in FACETS.items():
+        other_filters = {name: value for name, value in filters.items() if name != argument}
+        counts = Counter(
+            product.get(field) for product in apply_filters(products, **other_filters)
+        )
+        facets[facet] = {
+            value: counts[value] for value in facet_index.index.postings[field]
+        }
+    other_filters = {name: value for name, value in filters.items() if name != "price_range"}
+    facets["price"] = {
+        bucket: len(apply_filters(products, **other_filters, price_range=bucket))
+        for bucket in facet_index.price_buckets
+    }
+    return facets
+
+
+FILTERS = [
+    {},
+    {"color": "red"},
+    {"brand": "prada", "on_sale": True},
+    {"price_range": (50.0, 100.0), "gender": "M"},
+    {"price_range": (1000, 99999), "color": "black", "on_sale": False},
+    # Not one of the buckets, so counted from the matching rows
+    {"price_range": (60.0, 110.0), "brand": "dior"},
+    {"color": "green"},
+    {"color": ["red", "blue"], "brand": Exclude(["dior"])},
+    {"brand": Exclude(["prada"]), "price_range": (0, 50), "gender": ["F"]},
+]
+
+
+class TestFacetIndex:
+    """Tests for counting products by filter value"""
+
+    @pytest.mark.parametrize("filters", FILTERS)
+    def test_counts_exclude_own_filter(self, products, filters):
+        """Test that each facet is counted with every other filter applied"""
+        facet_index = FacetIndex(ProductIndex(products))
+        assert count_facets(facet_index, **filters) == expected_counts(
+            products, facet_index, filters
+        )
+
+    def test_counts_within_rows(self, products):
+        """Test that counts can be limited to some rows, e.g. search results"""
+        facet_index = FacetIndex(ProductIndex(products))
+        row_ids = list(range(0, 300, 3))
+        searched = [products[row_id] for row_id in row_ids]
+        for filters in FILTERS:
+            facets = count_facets(facet_index, **filters, row_ids=row_ids)
+            assert facets == expected_counts(searched, facet_index, filters)
+
+    def test_zero_counts_are_included(self, products):
+        """Test that values no product would match are still listed"""
+        facet_index = FacetIndex(ProductIndex(products))
+        facets = count_facets(facet_index, color="red", brand="gucci", gender="F")
+        assert set(facets["color"]) == {"red", "black", "blue", None}
+        assert facets["price"][(500, 1000)] == 0
+
+    def test_many_allowed_values(self, products):
+        """Test filters allowing more combinations than the cube has entries"""
+        products = [
+            dict(product, designer=f"brand-{product['product_id'] % 40}")
+            for product in products
+        ]
+        facet_index = FacetIndex(ProductIndex(products))
+        filters = {"brand": Exclude(["brand-1"]), "color": Exclude(["red"])}
+        assert count_facets(facet_index, **filters) == expected_counts(
+            products, facet_index, filters
+        )
+
+
+class TestApplyChanges:
+    """Tests for updating a FacetIndex instead of counting again"""
+
+    def test_matches_a_fresh_count(self, products):
+        """Test that added, replaced and deleted products are counted"""
+        index = ProductIndex(products)
+        facet_index = FacetIndex(index)
+
+        updated = [product for row_id, product in enumerate(products) if row_id not in (4, 9)]
+        updated[0] = dict(updated[0], color="green", regular_price=1000.0, on_sale=False)
+        updated.append(dict(products[4], product_id=1000, regular_price=250.0))
+        updated_index = index.apply_changes(updated, changed_rows=[0], deleted_rows=[4, 9])
+        updated_facets = facet_index.apply_changes(
+            updated_index, changed_rows=[0], deleted_rows=[4, 9]
+        )
+
+        fresh = FacetIndex(ProductIndex(updated))
+        assert updated_facets.cells == fresh.cells
+        assert updated_facets.counts == fresh.counts
+        for filters in FILTERS:
+            assert count_facets(updated_facets, **filters) == count_facets(fresh, **filters)
+        # The original counts are left as they were
+        assert facet_index.counts == FacetIndex(index).counts
@@ -6,6 +6,7 @@ This module contains pytest tests for all filtering functions in the filter.py m
 
 import pytest
 import json
+from array import array
 from filter import (
     load_products,
     filter_by_color,
@@ -13,11 +14,18 @@ from filter import (
     filter_by_sale_status,
     filter_by_brand,
     apply_filters,
+    count_matches,
+    explain_filters,
+    filter_page_row_ids,
+    filter_row_ids,
+    iter_filtered_products,
     save_filtered_results,
     sort_by_price_high_to_low,
     sort_by_price_low_to_high,
     sort_by_popularity,
 )
+from product_index import SORT_ORDERS, ProductIndex
+from query_planner import Exclude, intersect_posting_lists, plan_query
 
 
 @pytest.fixture
@@ -387,3 +395,435 @@ class TestSortByPopularity:
         # Product 4 has the highest item_score (4.5)
         assert sorted_products[0]["item_score"] == 4.5
         assert sorted_products[0]["product_id"] == 4
+
+
+class TestApplyFiltersWithIndex:
+    """Tests for apply_filters backed by a ProductIndex"""
+
+    def test_index_matches_scan(self, sample_products):
+        """Test that the index gives the same results as scanning"""
+        index = ProductIndex(sample_products)
+        queries = [
+            {},
+            {"color": "black"},
+            {"brand": "gucci", "on_sale": True},
+            {"brand": "gucci", "on_sale": False},
+            {"color": "black", "price_range": (100, 500)},
+            {"color": "purple"},
+        ]
+        for query in queries:
+            assert apply_filters(sample_products, index=index, **query) == (
+                apply_filters(sample_products, **query)
+            )
+
+    def test_index_keeps_catalog_order(self, sample_products):
+        """Test that indexed results come back in catalog order"""
+        index = ProductIndex(sample_products)
+        filtered = apply_filters(sample_products, brand="gucci", index=index)
+        assert [p["product_id"] for p in filtered] == [1, 2, 4]
+
+
+class TestProductIndex:
+    """Tests for the posting lists in ProductIndex"""
+
+    def test_posting_lists_are_sorted_row_ids(self, sample_products):
+        """Test that each value maps to the sorted rows that have it"""
+        index = ProductIndex(sample_products)
+        assert list(index.posting_list("color", "black")) == [1, 2]
+        assert list(index.posting_list("designer", "gucci")) == [0, 1, 3]
+        assert list(index.posting_list("on_sale", False)) == [2, 3]
+        assert list(index.posting_list("color", "purple")) == []
+
+    def test_lookup_intersects_posting_lists(self, sample_products):
+        """Test that lookup returns rows matching every criterion"""
+        index = ProductIndex(sample_products)
+        assert list(index.lookup({"color": "black", "designer": "gucci"})) == [1]
+        assert list(index.lookup({})) == [0, 1, 2, 3]
+
+    def test_intersect_posting_lists(self):
+        """Test intersecting a short list with a long one"""
+        small = array("l", [3, 50, 99])
+        large = array("l", range(0, 100, 3))
+        assert list(intersect_posting_lists(small, large)) == [3, 99]
+
+    def test_rows_in_price_range(self, sample_products):
+        """Test that a price range is a contiguous slice of the price order"""
+        index = ProductIndex(sample_products)
+        # Effective prices by row: 250, 400, 150, 50
+        assert list(index.price_order) == [3, 2, 0, 1]
+        assert list(index.rows_in_price_range(100, 400)) == [2, 0, 1]
+        assert list(index.rows_in_price_range(250, 250)) == [0]
+        assert list(index.rows_in_price_range(1000, 2000)) == []
+
+    def test_lookup_combines_price_and_categories(self, sample_products):
+        """Test price ranges combined with categorical criteria"""
+        index = ProductIndex(sample_products)
+        assert list(index.lookup({"designer": "gucci"}, (0, 300))) == [0, 3]
+        assert list(index.lookup({}, (100, 500))) == [0, 1, 2]
+        assert list(index.lookup({"color": "black"}, (0, 1000))) == [1, 2]
+
+
+class TestSortOrders:
+    """Tests for the precomputed sort orders in ProductIndex"""
+
+    @pytest.mark.parametrize(
+        "sort_by, sort_function",
+        [
+            ("price_high_to_low", sort_by_price_high_to_low),
+            ("price_low_to_high", sort_by_price_low_to_high),
+            ("popularity", sort_by_popularity),
+        ],
+    )
+    def test_sort_row_ids_matches_sort_functions(
+        self, sample_products, sort_by, sort_function
+    ):
+        """Test that sorting row ids gives the same order as sorting products"""
+        index = ProductIndex(sample_products)
+        for row_ids in ([0, 1, 2, 3], [1, 3], [2]):
+            products = index.get_products(row_ids)
+            sorted_rows = index.sort_row_ids(array("l", row_ids), sort_by)
+            assert index.get_products(sorted_rows) == sort_function(products)
+
+    def test_sort_row_ids_unknown_order(self, sample_products):
+        """Test that an unknown sort order leaves the rows unchanged"""
+        index = ProductIndex(sample_products)
+        assert index.sort_row_ids([2, 0], None) == [2, 0]
+
+    def test_sorting_does_not_modify_products(self, sample_products):
+        """Test that the sort functions don't add keys to the products"""
+        keys_before = [set(product) for product in sample_products]
+        sort_by_price_high_to_low(sample_products)
+        sort_by_price_low_to_high(sample_products)
+        ProductIndex(sample_products)
+        assert [set(product) for product in sample_products] == keys_before
+
+
+class TestCursorRank:
+    """Tests for resuming a sort order from a pagination cursor"""
+
+    @pytest.mark.parametrize("sort_by", [None, *SORT_ORDERS])
+    def test_cursor_points_after_its_row(self, sample_products, sort_by):
+        """Test that a cursor's rank is its row's rank in the sort order"""
+        index = ProductIndex(sample_products)
+        order = index.sort_orders.get(sort_by, range(len(sample_products)))
+        for position, row_id in enumerate(order):
+            sort_key = index.sort_key(row_id, sort_by)
+            product_id = sample_products[row_id]["product_id"]
+            assert index.cursor_rank(sort_by, sort_key, product_id) == position
+
+    def test_cursor_for_removed_product(self, sample_products):
+        """Test that a cursor whose product is gone resumes after its sort key"""
+        index = ProductIndex(sample_products)
+        # Prices low to high are 50, 150, 250, 400
+        assert index.cursor_rank("price_low_to_high", 150.0, 99) == 1
+        assert index.cursor_rank("price_low_to_high", 10.0, 99) == -1
+        # Prices high to low are 400, 250, 150, 50
+        assert index.cursor_rank("price_high_to_low", 200.0, 99) == 1
+        # Scores high to low are 4.5, 3.8, 2.5, 1.2
+        assert index.cursor_rank("popularity", 3.8, 99) == 1
+
+    def test_catalog_order_after_earlier_product_removed(self, sample_products):
+        """Test that a catalog order cursor follows its product to its new row"""
+        index = ProductIndex(sample_products[1:])
+        # The cursor was made when the product was in row 2, now it's in row 1
+        assert index.cursor_rank(None, 2, sample_products[2]["product_id"]) == 1
+
+    def test_catalog_order_key_out_of_range(self, sample_products):
+        """Test that a catalog order cursor with a row id past either end is clamped"""
+        index = ProductIndex(sample_products)
+        assert index.cursor_rank(None, -5, 99) == -1
+        assert index.cursor_rank(None, 1e300, 99) == len(sample_products) - 1
+        assert index.cursor_rank(None, 1.5, 99) == 1
+
+
+class TestBoundedSorting:
+    """Tests for sorting with an offset and limit"""
+
+    @pytest.mark.parametrize(
+        "sort_function",
+        [sort_by_price_high_to_low, sort_by_price_low_to_high, sort_by_popularity],
+    )
+    def test_bounded_sort_matches_full_sort(self, all_products, sort_function):
+        """Test that each page of a bounded sort is a slice of the full sort"""
+        full = sort_function(all_products)
+        for offset, limit in [(0, 50), (50, 50), (450, 50), (0, len(all_products))]:
+            page = sort_function(all_products, offset=offset, limit=limit)
+            assert page == full[offset:offset + limit]
+
+    def test_bounded_sort_past_the_end(self, sample_products):
+        """Test that a page past the end is empty"""
+        assert sort_by_popularity(sample_products, offset=10, limit=5) == []
+
+    @pytest.mark.parametrize(
+        "sort_by", ["price_high_to_low", "price_low_to_high", "popularity", None]
+    )
+    def test_bounded_sort_row_ids(self, all_products, sort_by):
+        """Test that bounded row id sorting returns the right page"""
+        index = ProductIndex(all_products)
+        for query in [{}, {"color": "black"}, {"brand": "gucci", "gender": "F"}]:
+            row_ids = filter_row_ids(index, **query)
+            full = list(index.sort_row_ids(row_ids, sort_by))
+            for offset in (0, 50, 1000):
+                page = index.sort_row_ids(row_ids, sort_by, offset=offset, limit=50)
+                assert list(page) == full[offset:offset + 50]
+
+
+class TestIterFilteredProducts:
+    """Tests for the lazy, single-pass filter pipeline"""
+
+    def test_matches_apply_filters(self, all_products):
+        """Test that the lazy pipeline finds the same products as apply_filters"""
+        index = ProductIndex(all_products)
+        query = {"color": "black", "price_range": (100, 500), "on_sale": True}
+        expected = apply_filters(all_products, **query)
+        assert list(iter_filtered_products(all_products, **query)) == expected
+        assert list(iter_filtered_products(all_products, index=index, **query)) == expected
+
+    def test_stops_early(self, sample_products):
+        """Test that the scan stops once the consumer has enough matches"""
+        seen = []
+
+        def tracked(products):
+            for product in products:
+                seen.append(product["product_id"])
+                yield product
+
+        matches = iter_filtered_products(tracked(sample_products), brand="gucci")
+        assert next(matches)["product_id"] == 1
+        assert seen == [1]
+
+    def test_save_filtered_results_from_generator(self, sample_products, tmp_path):
+        """Test saving a limited number of products from a generator"""
+        output_file = tmp_path / "lazy.jsonl"
+        matches = iter_filtered_products(sample_products, brand="gucci")
+        assert save_filtered_results(matches, str(output_file), limit=2) == 2
+        with open(output_file, "r") as f:
+            assert [json.loads(line)["product_id"] for line in f] == [1, 2]
+
+
+class TestQueryPlanner:
+    """Tests for the selectivity-aware query planner"""
+
+    def test_plan_starts_with_most_selective_filter(self, all_products):
+        """Test that the rarest value is read from the index first"""
+        index = ProductIndex(all_products)
+        plan = plan_query(index, {"gender": "F", "color": "black", "designer": "gucci"})
+        steps = plan.explain()
+        assert steps[0]["method"] == "index"
+        assert [s["matching_rows"] for s in steps] == sorted(
+            s["matching_rows"] for s in steps
+        )
+
+    def test_plan_matches_scan(self, all_products):
+        """Test that every plan finds exactly the scanned matches"""
+        index = ProductIndex(all_products)
+        queries = [
+            {"color": "black", "brand": "gucci", "gender": "F"},
+            {"price_range": (100, 110), "color": "black"},
+            {"price_range": (0, 5000), "on_sale": True},
+            {"color": "no-such-color", "gender": "F"},
+        ]
+        for query in queries:
+            expected = apply_filters(all_products, **query)
+            assert index.get_products(filter_row_ids(index, **query)) == expected
+
+    def test_explain_reports_actual_rows(self, sample_products):
+        """Test that explain reports estimated and actual row counts"""
+        index = ProductIndex(sample_products)
+        steps = explain_filters(index, brand="gucci", color="black")
+        assert [s["field"] for s in steps] == ["color", "designer"]
+        assert [s["actual_rows"] for s in steps] == [2, 1]
+        assert all(s["estimated_rows"] is not None for s in steps)
+
+    def test_explain_without_filters(self, sample_products):
+        """Test that a query with no filters has an empty plan"""
+        assert explain_filters(ProductIndex(sample_products)) == []
+
+
+class TestCountAndPage:
+    """Tests for counting matches and looking up a single page"""
+
+    queries = [
+        {},
+        {"color": "black"},
+        {"gender": "F", "on_sale": True},
+        {"price_range": (100, 2000), "gender": "F"},
+        {"color": "black", "gender": "F", "price_range": (0, 500)},
+        {"color": "no-such-color", "gender": "F"},
+    ]
+
+    def test_count_matches_lookup(self, all_products):
+        """Test that counting gives the number of rows a lookup finds"""
+        index = ProductIndex(all_products)
+        for query in self.queries:
+            expected = len(filter_row_ids(index, **query))
+            assert count_matches(index, **query) == (expected, 0)
+
+    def test_estimate_is_within_margin(self, all_products):
+        """Test that an estimated count is close to the exact count"""
+        index = ProductIndex(all_products)
+        for query in self.queries:
+            count, margin = count_matches(index, **query, approximate=True)
+            expected = len(filter_row_ids(index, **query))
+            # Allow twice the 95% margin so the test isn't flaky
+            assert abs(count - expected) <= 2 * margin
+
+    @pytest.mark.parametrize("sort_by", [None, *SORT_ORDERS])
+    def test_page_matches_sorted_lookup(self, all_products, sort_by):
+        """Test that a page looked up on its own matches the full result"""
+        index = ProductIndex(all_products)
+        for query in self.queries:
+            full = index.sort_row_ids(filter_row_ids(index, **query), sort_by)
+            for offset in (0, 450):
+                page = filter_page_row_ids(index, sort_by, offset, 50, **query)
+                if page is not None:
+                    assert list(page) == list(full[offset:offset + 50])
+
+    @pytest.mark.parametrize("sort_by", [None, *SORT_ORDERS])
+    def test_page_from_cursor_matches_sorted_lookup(self, all_products, sort_by):
+        """Test that walking from a rank in the sort order finds the next matches"""
+        index = ProductIndex(all_products)
+        rank = index.ranks.get(sort_by)
+        for query in self.queries:
+            full = list(index.sort_row_ids(filter_row_ids(index, **query), sort_by))
+            for position in (0, 300):
+                if position >= len(full):
+                    continue
+                last_row_id = full[position]
+                start = (last_row_id if rank is None else rank[last_row_id]) + 1
+                page = filter_page_row_ids(index, sort_by, 0, 50, **query, start=start)
+                if page is not None:
+                    assert list(page) == full[position + 1:position + 51]
+
+    def test_broad_query_is_walked(self, sample_products):
+        """Test that a page of a broad sorted query doesn't find every match"""
+        products = [dict(sample_products[i % 4], product_id=i) for i in range(400)]
+        index = ProductIndex(products)
+        page = index.lookup_page({"designer": "gucci"}, None, "popularity", 0, 2)
+        # The most popular products are the copies of product 4
+        assert list(page) == [3, 7]
+
+
+def matches_condition(value, condition):
+    """Check a product's value against a filter value by hand"""
+    if isinstance(condition, Exclude):
+        return value not in condition.values
+    if isinstance(condition, list):
+        return value in condition
+    return value == condition
+
+
+class TestMultiValueFilters:
+    """Tests for filters that accept several values, or all but some"""
+
+    queries = [
+        {"color": ["black", "navy"]},
+        {"color": ["black", "navy"], "brand": ["gucci", "prada"]},
+        {"color": Exclude(["black"])},
+        {"brand": Exclude(["gucci", "prada"]), "gender": "F", "on_sale": True},
+        {"color": ["black", "white", "navy", "red", "pink", "green", "gray"]},
+        {"gender": ["F", "M"], "price_range": (100, 500)},
+    ]
+
+    def expected_row_ids(self, products, query):
+        """Find the matching row ids by checking every product"""
+        fields = {"color": "color", "brand": "designer", "gender": "gender", "on_sale": "on_sale"}
+        row_ids = []
+        for row_id, product in enumerate(products):
+            if "price_range" in query:
+                min_price, max_price = query["price_range"]
+                price = product["discount_price"] if product["on_sale"] else product["regular_price"]
+                if not min_price <= price <= max_price:
+                    continue
+            if all(
+                matches_condition(product[fields[name]], condition)
+                for name, condition in query.items()
+                if name in fields
+            ):
+                row_ids.append(row_id)
+        return row_ids
+
+    def test_index_and_scan_match(self, all_products):
+        """Test that lists and exclusions match the same products either way"""
+        index = ProductIndex(all_products)
+        for query in self.queries:
+            expected = self.expected_row_ids(all_products, query)
+            assert expected
+            assert list(filter_row_ids(index, **query)) == expected
+            assert count_matches(index, **query) == (len(expected), 0)
+            scanned = apply_filters(all_products, **query)
+            assert scanned == [all_products[row_id] for row_id in expected]
+
+    @pytest.mark.parametrize("sort_by", SORT_ORDERS)
+    def test_sorted_pages(self, all_products, sort_by):
+        """Test that several values come back once each, in sort order"""
+        index = ProductIndex(all_products)
+        order = list(index.sort_orders[sort_by])
+        for query in self.queries:
+            expected = set(self.expected_row_ids(all_products, query))
+            full = list(index.sort_row_ids(filter_row_ids(index, **query), sort_by))
+            assert full == [row_id for row_id in order if row_id in expected]
+            page = filter_page_row_ids(index, sort_by, 50, 50, **query)
+            if page is not None:
+                assert list(page) == full[50:100]
+
+    def test_repeated_and_single_values(self, all_products):
+        """Test that repeated values count once and one value is a plain filter"""
+        index = ProductIndex(all_products)
+        black = list(filter_row_ids(index, color="black"))
+        assert list(filter_row_ids(index, color=["black", "black"])) == black
+        assert list(filter_row_ids(index, color=("black",))) == black
+        assert list(filter_row_ids(index, color=Exclude([]))) == list(range(len(all_products)))
+
+    def test_nothing_accepted(self, sample_products):
+        """Test that an empty list of values matches no products"""
+        index = ProductIndex(sample_products)
+        assert list(filter_row_ids(index, color=[])) == []
+        assert apply_filters(sample_products, color=[]) == []
+        assert list(filter_row_ids(index, color=Exclude(["red", "black", "blue"]))) == []
+
+    def test_explain_lists_values(self, sample_products):
+        """Test that explain shows the values a step accepts or excludes"""
+        index = ProductIndex(sample_products)
+        steps = explain_filters(index, color=["red", "blue"], brand=Exclude(["gucci"]))
+        values = {step["field"]: step["value"] for step in steps}
+        assert values == {"color": ["red", "blue"], "designer": {"not": ["gucci"]}}
+        assert [step["actual_rows"] for step in steps] == [1, 0]
+
+
+class TestApplyChanges:
+    """Tests for updating a ProductIndex instead of building a new one"""
+
+    def assert_same_index(self, index, expected):
+        """Check that two indexes hold the same rows in the same orders"""
+        assert index.postings == expected.postings
+        assert index.row_ids_by_product_id == expected.row_ids_by_product_id
+        assert list(index.sorted_prices) == list(expected.sorted_prices)
+        for sort_by in SORT_ORDERS:
+            assert list(index.sort_orders[sort_by]) == list(expected.sort_orders[sort_by])
+            assert list(index.ranks[sort_by]) == list(expected.ranks[sort_by])
+
+    def test_added_and_replaced_products(self, all_products):
+        """Test that new and replaced products are indexed in place"""
+        products = all_products[:300]
+        index = ProductIndex(products)
+        updated = list(products)
+        updated[5] = dict(products[5], color="no-such-color", on_sale=False)
+        updated[6] = dict(products[6], item_score=products[0]["item_score"])
+        updated.append(dict(products[1], product_id=-1))
+        self.assert_same_index(
+            index.apply_changes(updated, changed_rows=[5, 6]), ProductIndex(updated)
+        )
+        # The original index is left as it was
+        self.assert_same_index(index, ProductIndex(products))
+
+    def test_deleted_products(self, all_products):
+        """Test that rows after a deleted product move up"""
+        products = all_products[:300]
+        index = ProductIndex(products)
+        updated = [product for row_id, product in enumerate(products) if row_id not in (0, 150)]
+        updated[10] = dict(updated[10], designer="gucci")
+        self.assert_same_index(
+            index.apply_changes(updated, changed_rows=[11], deleted_rows=[0, 150]),
+            ProductIndex(updated),
+        )
@@ -0,0 +1,106 @@
+"""
+Test suite for the synthetic catalog generator.
+
+This module contains pytest tests for generate_catalog.py.
+"""
+
+import io
+import json
+import random
+import statistics
+from collections import Counter
+
+import pytest
+from filter import apply_filters
+from generate_catalog import BATCH_SIZE, FIELDS, CatalogModel, write_catalog
+
+
+@pytest.fixture
+def sample():
+    """Fixture with 2,000 sample products: gucci is common and expensive, cos rare and cheap"""
+    generator = random.Random(11)
+    products = []
+    for product_id in range(2000):
+        designer = "gucci" if generator.random() < 0.8 else "cos"
+        category = generator.choice(["bags", "socks"])
+        regular_price = (1000.0 if designer == "gucci" else 50.0) * (
+            4 if category == "bags" else 1
+        )
+        regular_price *= generator.uniform(0.8, 1.25)
+        on_sale = generator.random() < 0.3
+        products.append(
+            {
+                "product_id": product_id,
+                "color": generator.choice(["black"] * 5 + ["red", None]),
+                "gender": "F" if category == "bags" else generator.choice(["F", "M"]),
+                "product_type": "accessories" if category == "bags" else "clothing",
+                "category": category,
+                "subcategory": None,
+                "designer": designer,
+                "retailer": generator.choice(["ssense", "gilt"]),
+                "on_sale": on_sale,
+                "regular_price": regular_price,
+                "discount_price": regular_price * (0.6 if on_sale else 1.0),
+                "short_description": f"{category.title()} {product_id % 10}",
+                "long_description": "Made in Italy. Soft leather; Gold hardware.",
+                "image_url": "https://example.com/image.jpeg",
+                "item_score": generator.uniform(0, 20),
+            }
+        )
+    return products
+
+
+class TestCatalogModel:
+    """Tests for generating products like a sample catalog"""
+
+    def test_same_seed_same_products(self, sample):
+        """Test that generation is repeatable, and a smaller catalog is the start of a bigger one"""
+        model = CatalogModel(sample)
+        products = list(model.generate(BATCH_SIZE + 10, seed=4))
+        assert products == list(CatalogModel(sample).generate(BATCH_SIZE + 10, seed=4))
+        assert products[:50] == list(model.generate(50, seed=4))
+        assert products[:50] != list(model.generate(50, seed=5))
+
+    def test_schema(self, sample):
+        """Test that products have data.jsonl's fields and unique ids"""
+        products = list(CatalogModel(sample).generate(3000))
+        assert all(tuple(product) == FIELDS for product in products)
+        assert len({product["product_id"] for product in products}) == len(products)
+        for product in products:
+            if product["on_sale"]:
+                assert product["discount_price"] < product["regular_price"]
+            else:
+                assert product["discount_price"] == product["regular_price"]
+
+    def test_distributions_follow_the_sample(self, sample):
+        """Test that value frequencies and price levels are learnt"""
+        products = list(CatalogModel(sample).generate(5000))
+        designers = Counter(product["designer"] for product in products)
+        assert 0.75 < designers["gucci"] / len(products) < 0.85
+        assert Counter(product["color"] for product in products).most_common(1)[0][0] == "black"
+        # Socks are only sold to men as in the sample, never bags
+        men = apply_filters(products, gender="M")
+        assert men and all(product["category"] == "socks" for product in men)
+
+        def median_price(designer, category):
+            return statistics.median(
+                product["regular_price"]
+                for product in products
+                if product["designer"] == designer and product["category"] == category
+            )
+
+        assert median_price("gucci", "socks") > 5 * median_price("cos", "socks")
+        assert median_price("gucci", "bags") > 2 * median_price("gucci", "socks")
+
+    def test_write_catalog(self, sample):
+        """Test that the written lines parse back to the generated products"""
+        model = CatalogModel(sample)
+        file = io.StringIO()
+        write_catalog(model, 25, file, seed=2)
+        lines = file.getvalue().splitlines()
+        assert [json.loads(line) for line in lines] == list(model.generate(25, seed=2))
+
+    def test_sample_without_prices(self):
+        """Test that a sample with nothing to learn prices from is refused"""
+        with pytest.raises(ValueError):
+            CatalogModel([{"product_id": 1, "regular_price": None}])
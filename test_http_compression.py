@@ -0,0 +1,74 @@
+"""
+Test suite for HTTP compression.
+
+This module contains pytest tests for the http_compression.py module.
+"""
+
+import gzip
+import os
+
+from http_compression import (
+    COMPRESSORS,
+    choose_encoding,
+    compress,
+    compress_file,
+    iter_compressed,
+    parse_accept_encoding,
+)
+
+
+class TestChooseEncoding:
+    """Tests for Accept-Encoding negotiation"""
+
+    def test_parse_quality_values(self):
+        """Test that quality values are read, defaulting to 1"""
+        assert parse_accept_encoding("gzip, br;q=0.5, *;q=0") == {
+            "gzip": 1.0,
+            "br": 0.5,
+            "*": 0.0,
+        }
+
+    def test_gzip(self):
+        """Test that gzip is chosen when it's the only encoding offered"""
+        assert choose_encoding("gzip") == "gzip"
+        assert choose_encoding("identity, GZIP;q=0.9") == "gzip"
+
+    def test_no_acceptable_encoding(self):
+        """Test that the body is left uncompressed when nothing matches"""
+        assert choose_encoding(None) is None
+        assert choose_encoding("") is None
+        assert choose_encoding("deflate") is None
+        assert choose_encoding("gzip;q=0") is None
+
+    def test_wildcard(self):
+        """Test that * accepts any encoding not listed separately"""
+        assert choose_encoding("*") in COMPRESSORS
+        assert choose_encoding("*, gzip;q=0") != "gzip"
+
+
+class TestCompress:
+    """Tests for compressing bodies"""
+
+    body = b'{"product_id": 1, "color": "black"}\n' * 100
+
+    def test_round_trip(self):
+        """Test that a gzip body decompresses back to the original"""
+        compressed = compress(self.body, "gzip")
+        assert len(compressed) < len(self.body)
+        assert gzip.decompress(compressed) == self.body
+
+    def test_streaming_matches_body(self):
+        """Test that compressing in chunks gives the same content"""
+        chunks = [self.body[:1000], self.body[1000:], b""]
+        compressed = b"".join(iter_compressed(chunks, "gzip"))
+        assert gzip.decompress(compressed) == self.body
+
+    def test_compress_file(self, tmp_path):
+        """Test that a file compressed in small chunks decompresses back to it"""
+        source = tmp_path / "data.jsonl"
+        source.write_bytes(self.body)
+        destination = tmp_path / "data.jsonl.gz"
+        compress_file(str(source), str(destination), "gzip", chunk_size=100)
+        assert gzip.decompress(destination.read_bytes()) == self.body
+        # The temporary file has been renamed into place
+        assert sorted(os.listdir(tmp_path)) == ["data.jsonl", "data.jsonl.gz"]
@@ -0,0 +1,75 @@
+"""
+Test suite for the JSONL loader.
+
+This module contains pytest tests for the jsonl_loader.py module.
+"""
+
+import json
+
+import pytest
+from jsonl_loader import load_jsonl, parse_range, split_ranges
+
+
+@pytest.fixture
+def jsonl_file(tmp_path):
+    """Fixture with a JSONL file of 100 small objects"""
+    path = tmp_path / "data.jsonl"
+    with open(path, "w") as file:
+        for product_id in range(100):
+            file.write(json.dumps({"product_id": product_id, "color": "red"}) + "\n")
+    return str(path)
+
+
+class TestSplitRanges:
+    """Tests for the split_ranges function"""
+
+    def test_ranges_cover_file_on_line_boundaries(self, jsonl_file):
+        """Test that ranges are contiguous and each ends with a newline"""
+        with open(jsonl_file, "rb") as file:
+            data = file.read()
+        ranges = split_ranges(jsonl_file, 7)
+        assert len(ranges) == 7
+        assert ranges[0][0] == 0 and ranges[-1][1] == len(data)
+        assert all(end == start for (_, end), (start, _) in zip(ranges, ranges[1:]))
+        assert all(data[end - 1:end] == b"\n" for _, end in ranges)
+
+    def test_more_parts_than_lines(self, jsonl_file):
+        """Test that a range never splits a line"""
+        ranges = split_ranges(jsonl_file, 1000)
+        assert len(ranges) == 100
+
+    def test_empty_file(self, tmp_path):
+        """Test that an empty file has no ranges"""
+        path = tmp_path / "empty.jsonl"
+        path.write_text("")
+        assert split_ranges(str(path), 4) == []
+
+
+class TestLoadJsonl:
+    """Tests for loading a JSONL file serially and in parallel"""
+
+    def test_parse_ranges(self, jsonl_file):
+        """Test that parsing each range in turn gives every line once"""
+        products = []
+        for start, end in split_ranges(jsonl_file, 10):
+            products.extend(parse_range(jsonl_file, start, end))
+        assert [p["product_id"] for p in products] == list(range(100))
+
+    def test_serial_load(self, jsonl_file):
+        """Test that a small file is parsed in order"""
+        products = load_jsonl(jsonl_file)
+        assert [p["product_id"] for p in products] == list(range(100))
+
+    def test_parallel_load_matches_serial(self, jsonl_file):
+        """Test that worker processes give the same rows in the same order"""
+        products = load_jsonl(jsonl_file, workers=2, min_parallel_bytes=0)
+        assert products == load_jsonl(jsonl_file, workers=1)
+
+    def test_missing_final_newline(self, tmp_path):
+        """Test a file whose last line has no newline"""
+        path = tmp_path / "data.jsonl"
+        path.write_text('{"product_id": 1}\n{"product_id": 2}')
+        assert load_jsonl(str(path), workers=2, min_parallel_bytes=0) == [
+            {"product_id": 1},
+            {"product_id": 2},
+        ]
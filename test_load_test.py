@@ -0,0 +1,123 @@
+"""
+Test suite for the load test.
+
+This module contains pytest tests for load_test.py, run against a threaded
+server.py on a small catalog.
+"""
+
+import json
+import random
+import threading
+
+import pytest
+import server
+from catalog import CatalogStore
+from load_test import LatencyHistogram, discover_values, run_load_test
+
+
+@pytest.fixture
+def url(tmp_path, monkeypatch):
+    """Fixture serving a 200-product catalog on a free port, returning its URL"""
+    generator = random.Random(5)
+    data_file = tmp_path / "data.jsonl"
+    with open(data_file, "w") as file:
+        for product_id in range(200):
+            regular_price = generator.choice([30.0, 80.0, 400.0])
+            product = {
+                "product_id": product_id,
+                "color": generator.choice(["red", "black", None]),
+                "designer": generator.choice(["gucci", "prada"]),
+                "gender": generator.choice(["F", "M"]),
+                "on_sale": generator.random() < 0.5,
+                "regular_price": regular_price,
+                "discount_price": regular_price / 2,
+                "item_score": generator.random(),
+                "short_description": "Dress",
+            }
+            file.write(json.dumps(product) + "\n")
+    monkeypatch.setattr(server, "catalog_store", CatalogStore(str(data_file)))
+    httpd = server.make_server("threaded", 0, 4)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://localhost:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class TestLatencyHistogram:
+    """Tests for counting latencies in buckets"""
+
+    def test_percentiles_are_close(self):
+        """Test that percentiles are within 2% of the exact ones"""
+        histogram = LatencyHistogram()
+        for millisecond in range(1, 1001):
+            histogram.record(millisecond / 1000)
+        for percentile, exact in ((50, 0.5), (95, 0.95), (99, 0.99), (99.9, 0.999)):
+            assert exact <= histogram.percentile(percentile) <= exact * 1.02
+        assert histogram.percentile(100) == 1.0
+        assert LatencyHistogram().percentile(50) is None
+
+    def test_merge(self):
+        """Test that merged histograms count both sets of latencies"""
+        first, second, both = LatencyHistogram(), LatencyHistogram(), LatencyHistogram()
+        for index, seconds in enumerate([0.001, 0.2, 0.003, 0.05, 0.0000001]):
+            (first if index % 2 else second).record(seconds)
+            both.record(seconds)
+        first.merge(second)
+        assert first.to_dict() == both.to_dict()
+        assert first.count == 5
+        assert first.max == 0.2
+
+
+class TestLoadTest:
+    """Tests for simulating users against a running server"""
+
+    def test_discover_values(self, url):
+        """Test that filter values come from the facet counts, without null"""
+        port = int(url.rsplit(":", 1)[1])
+        values = discover_values("localhost", port)
+        assert sorted(values["color"][0]) == ["black", "red"]
+        assert sum(values["brand"][1]) == 200
+        assert set(values["on_sale"][0]) == {"true", "false"}
+        assert "0-50" in values["price_range"][0]
+
+    def test_run_load_test(self, url):
+        """Test that every endpoint of the session model is measured"""
+        report = run_load_test(
+            url,
+            {"download_rate": 0.5, "max_pages": 3},
+            users=3,
+            duration=1,
+            warmup=0.2,
+        )
+        assert set(report["endpoints"]) == {
+            "GET /api/facets",
+            "GET /api/products",
+            "GET /data.jsonl",
+        }
+        total = report["total"]
+        assert total["requests"] > 0
+        assert total["errors"] == 0
+        assert total["requests"] == sum(
+            stats["requests"] for stats in report["endpoints"].values()
+        )
+        latency = report["endpoints"]["GET /api/products"]["latency"]
+        assert latency["p50_ms"] <= latency["p99_ms"] <= latency["max_ms"]
+        assert sum(count for _, count in latency["buckets"]) == latency["count"]
+
+    def test_more_users_than_workers(self, url):
+        """Test that idle keep-alive connections don't keep other users from being served"""
+        # The server has 4 workers; each user thinks between requests and
+        # keeps its connection open
+        report = run_load_test(
+            url,
+            {"think_time": 0.1, "download_rate": 0.0},
+            users=12,
+            duration=2,
+            warmup=0.5,
+            options={"timeout": 2},
+        )
+        total = report["total"]
+        assert total["errors"] == 0
+        latency = report["endpoints"]["GET /api/products"]["latency"]
+        assert latency["max_ms"] < 1000
@@ -0,0 +1,145 @@
+"""
+Test suite for product pagination functions.
+
+This module contains pytest tests for the functions in the pagination.py module.
+"""
+
+import pytest
+from pagination import (
+    create_keyset_info,
+    create_pagination_info,
+    create_pagination_info_from_count,
+    decode_cursor,
+    encode_cursor,
+    get_keyset_page,
+    get_page_data,
+    get_page_offset,
+    get_total_pages,
+)
+
+
+class TestPagination:
+    """Tests for the offset-based pagination functions"""
+
+    def test_get_total_pages(self):
+        """Test that a partial last page counts as a page"""
+        assert get_total_pages(list(range(175)), 50) == 4
+        assert get_total_pages([], 50) == 0
+
+    def test_get_page_data(self):
+        """Test that each page returns the right slice of products"""
+        products = list(range(175))
+        assert get_page_data(products, 1, 50) == list(range(0, 50))
+        assert get_page_data(products, 4, 50) == list(range(150, 175))
+        assert get_page_data(products, 5, 50) == []
+
+    def test_get_page_offset(self):
+        """Test the index of the first item on a page"""
+        assert get_page_offset(1, 50) == 0
+        assert get_page_offset(3, 20) == 40
+
+    def test_create_pagination_info(self):
+        """Test the pagination info for a page in the middle"""
+        assert create_pagination_info(list(range(175)), 2, 50) == {
+            "current_page": 2,
+            "total_pages": 4,
+            "items_per_page": 50,
+            "total_items": 175,
+            "has_previous": True,
+            "has_next": True,
+            "start_index": 50,
+            "end_index": 99,
+        }
+
+    def test_create_pagination_info_first_and_last_page(self):
+        """Test has_previous/has_next at either end"""
+        first = create_pagination_info(list(range(175)), 1, 50)
+        last = create_pagination_info(list(range(175)), 4, 50)
+        assert first["has_previous"] is False and first["has_next"] is True
+        assert last["has_previous"] is True and last["has_next"] is False
+        assert last["end_index"] == 174
+
+    def test_create_pagination_info_from_count(self):
+        """Test that a count gives the same info as the full list"""
+        for page_number in (1, 2, 4, 5):
+            assert create_pagination_info_from_count(
+                175, page_number, 50
+            ) == create_pagination_info(list(range(175)), page_number, 50)
+
+    def test_create_pagination_info_from_estimate(self):
+        """Test that an estimated count is marked as such"""
+        info = create_pagination_info_from_count(1000, 1, 50, margin=40)
+        assert info["total_items"] == 1000
+        assert info["total_is_estimate"] is True
+        assert info["total_items_margin"] == 40
+
+    def test_get_page_data_from_generator(self):
+        """Test that a generator is only read up to the end of the page"""
+        consumed = []
+
+        def products():
+            for product_id in range(175):
+                consumed.append(product_id)
+                yield product_id
+
+        assert get_page_data(products(), 2, 50) == list(range(50, 100))
+        assert len(consumed) == 100
+
+
+class TestKeysetPagination:
+    """Tests for the cursor-based pagination functions"""
+
+    def test_cursor_round_trip(self):
+        """Test that a cursor decodes back to its sort key and product id"""
+        cursor = encode_cursor(249.99, 1055705468)
+        assert "=" not in cursor
+        assert decode_cursor(cursor) == (249.99, 1055705468)
+
+    def test_invalid_cursor(self):
+        """Test that malformed cursors are rejected"""
+        for cursor in (
+            "not a cursor",
+            encode_cursor("red", 1),
+            "WzFd",
+            encode_cursor(1.5, {"a": 1}),
+            encode_cursor(1, [1]),
+            encode_cursor(float("inf"), 1),
+            encode_cursor(float("nan"), 1),
+            encode_cursor(1, float("inf")),
+        ):
+            with pytest.raises(ValueError):
+                decode_cursor(cursor)
+
+    def test_pages_follow_each_other(self):
+        """Test that following the cursor walks the whole list once"""
+        items = list(range(0, 350, 2))
+        seen = []
+        after = None
+        while True:
+            page, has_next = get_keyset_page(items, after, 50)
+            seen.extend(page)
+            if not has_next:
+                break
+            after = page[-1]
+        assert seen == items
+
+    def test_page_after_missing_item(self):
+        """Test that a position between items resumes at the next one"""
+        page, has_next = get_keyset_page([10, 20, 30, 40], 25, 1)
+        assert page == [30] and has_next is True
+        assert get_keyset_page([10, 20, 30, 40], 40, 1) == ([], False)
+
+    def test_key_function(self):
+        """Test pages of items ordered by a key"""
+        items = ["d", "c", "b", "a"]
+        position = {"d": 0, "c": 1, "b": 2, "a": 3}.__getitem__
+        assert get_keyset_page(items, 1, 2, key=position) == (["b", "a"], False)
+
+    def test_create_keyset_info(self):
+        """Test that the last page has no next cursor"""
+        assert create_keyset_info([1, 2], 2, False, "abc") == {
+            "items_per_page": 2,
+            "item_count": 2,
+            "has_next": False,
+            "next_cursor": None,
+        }
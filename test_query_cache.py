@@ -0,0 +1,77 @@
+"""
+Test suite for the query result cache.
+
+This module contains pytest tests for the query_cache.py module.
+"""
+
+from array import array
+
+from query_cache import QueryCache, make_query_key
+
+
+class TestMakeQueryKey:
+    """Tests for the make_query_key function"""
+
+    def test_ignores_order_and_unused_filters(self):
+        """Test that equivalent queries share a key"""
+        key_a = make_query_key({"color": "black", "brand": "gucci", "gender": None})
+        key_b = make_query_key({"brand": "gucci", "color": "black"})
+        assert key_a == key_b
+
+    def test_sort_order_is_part_of_key(self):
+        """Test that different sort orders get different keys"""
+        filters = {"color": "black"}
+        assert make_query_key(filters, "popularity") != make_query_key(filters)
+        assert make_query_key(filters, "") == make_query_key(filters, None)
+
+
+class TestQueryCache:
+    """Tests for the QueryCache class"""
+
+    def test_hit_and_miss_counters(self):
+        """Test that lookups are counted as hits or misses"""
+        cache = QueryCache()
+        assert cache.get("a") is None
+        cache.put("a", array("l", [1, 2, 3]))
+        assert list(cache.get("a")) == [1, 2, 3]
+        stats = cache.stats()
+        assert stats["hits"] == 1 and stats["misses"] == 1
+
+    def test_evicts_least_recently_used(self):
+        """Test that the oldest unused entry is evicted first"""
+        cache = QueryCache(max_entries=2)
+        cache.put("a", array("l", [1]))
+        cache.put("b", array("l", [2]))
+        cache.get("a")
+        cache.put("c", array("l", [3]))
+        assert cache.get("b") is None
+        assert cache.get("a") is not None
+        assert cache.stats()["evictions"] == 1
+
+    def test_byte_budget(self):
+        """Test that the total size stays within the byte budget"""
+        cache = QueryCache(max_bytes=10000)
+        for key in range(10):
+            cache.put(key, array("l", range(500)))
+        assert cache.stats()["bytes"] <= 10000
+        assert len(cache) < 10
+        # A result bigger than the whole budget is never stored
+        cache.put("huge", array("l", range(5000)))
+        assert cache.get("huge") is None
+
+    def test_new_generation_clears_cache(self):
+        """Test that results from an older catalog version are dropped"""
+        cache = QueryCache()
+        cache.put("a", array("l", [1]), generation=1)
+        assert cache.get("a", generation=1) is not None
+        assert cache.get("a", generation=2) is None
+        assert len(cache) == 0
+
+    def test_clear(self):
+        """Test that clear() empties the cache but keeps the counters"""
+        cache = QueryCache()
+        cache.put("a", array("l", [1]))
+        cache.get("a")
+        cache.clear()
+        assert cache.get("a") is None
+        assert cache.stats()["hits"] == 1
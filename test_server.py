@@ -0,0 +1,864 @@
+"""
+Test suite for the server's request helpers.
+
+This module contains pytest tests for the request and response helpers in
+server.py.
+"""
+
+import asyncio
+import gzip
+import json
+import os
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import server
+from catalog import Catalog, CatalogStore
+from text_search import query_terms
+from query_cache import QueryCache
+from server import (
+    Response,
+    conditional_response,
+    decode_filter_token,
+    encode_filter_token,
+    encode_products_response,
+    etag_matches,
+    get_keyset_page,
+    get_query_key,
+    get_request_filters,
+    iter_jsonl_chunks,
+    make_etag,
+    parse_filters,
+)
+from query_planner import Exclude
+
+
+@pytest.fixture(autouse=True)
+def empty_caches(monkeypatch):
+    """Give each test its own caches, as test catalogs share a version"""
+    monkeypatch.setattr(server, "result_cache", QueryCache())
+    monkeypatch.setattr(server, "compressed_cache", QueryCache())
+
+
+class TestFilterToken:
+    """Tests for the compact "filters" query token"""
+
+    def test_round_trip(self):
+        """Test that a token decodes back to the used filters"""
+        filters = {"color": "black", "on_sale": True, "brand": "", "gender": None}
+        token = encode_filter_token(filters)
+        assert "=" not in token
+        assert decode_filter_token(token) == {"color": "black", "on_sale": True}
+
+    def test_invalid_token(self):
+        """Test that a malformed token is rejected"""
+        with pytest.raises(ValueError):
+            decode_filter_token("not a token")
+        with pytest.raises(ValueError):
+            decode_filter_token(encode_filter_token({}) + "W10")
+
+
+class TestGetRequestFilters:
+    """Tests for the get_request_filters function"""
+
+    def test_individual_params(self):
+        """Test filters given as separate query parameters"""
+        filters = get_request_filters(
+            {"color": ["black"], "on_sale": ["true"], "sort_by": ["popularity"]}
+        )
+        assert filters == {"color": "black", "on_sale": True, "sort_by": "popularity"}
+
+    def test_blank_on_sale_means_either(self):
+        """Test that a blank on_sale parameter doesn't filter"""
+        assert get_request_filters({"on_sale": [""]}) == {"on_sale": None}
+        assert get_request_filters({"on_sale": ["false"]}) == {"on_sale": False}
+
+    def test_token_param(self):
+        """Test filters given as a token"""
+        token = encode_filter_token({"brand": "gucci"})
+        assert get_request_filters({"filters": [token]}) == {"brand": "gucci"}
+
+    def test_falls_back_to_saved_filters(self, monkeypatch):
+        """Test that saved filters are only used when none are passed"""
+        monkeypatch.setattr(server, "saved_filters", {"color": "red"})
+        assert get_request_filters({"page": ["2"]}) == {"color": "red"}
+        assert get_request_filters({"color": [""]}) == {"color": ""}
+
+
+class TestMultiValueParams:
+    """Tests for filters given several values, or values to exclude"""
+
+    def test_comma_separated_and_repeated_values(self):
+        """Test that both ways of giving several values are the same"""
+        repeated = get_request_filters({"color": ["navy", "black"], "brand": ["gucci"]})
+        assert repeated == {"color": "navy,black", "brand": "gucci"}
+        assert parse_filters(repeated)["color"] == ("black", "navy")
+        assert parse_filters({"color": "black, navy,,black"})["color"] == ("black", "navy")
+        assert parse_filters({"color": ["navy", "black"]})["color"] == ("black", "navy")
+        assert parse_filters({"color": "black"})["color"] == "black"
+        assert parse_filters({"color": ""})["color"] is None
+
+    def test_exclusions(self):
+        """Test that excluded values are left out of the accepted ones"""
+        assert parse_filters({"exclude_brand": "prada,gucci"})["brand"] == Exclude(
+            ["gucci", "prada"]
+        )
+        filters = parse_filters({"color": "black,navy", "exclude_color": "navy"})
+        assert filters["color"] == "black"
+        assert parse_filters({"gender": "F", "exclude_gender": "F"})["gender"] == ()
+
+    def test_query_key_ignores_value_order(self):
+        """Test that the same values in another order share cached results"""
+        assert get_query_key({"color": "navy,black"}) == get_query_key(
+            {"color": "black,navy"}
+        )
+        assert get_query_key({"color": "black,navy"}) != get_query_key(
+            {"exclude_color": "black,navy"}
+        )
+
+
+class TestSearch:
+    """Tests for text search queries"""
+
+    def test_query_key_uses_terms(self):
+        """Test that queries with the same terms share cached results"""
+        key = get_query_key({"q": "Pleated DRESSES", "color": "red"})
+        assert key == get_query_key({"q": "dress pleat", "color": "red"})
+        assert key != get_query_key({"q": "dress", "color": "red"})
+        assert get_query_key({"q": "  "}) == get_query_key({})
+
+    def test_cursor_pages_follow_relevance(self):
+        """Test that cursor pages walk through results ranked by relevance"""
+        products = [
+            {
+                "product_id": 100 + row_id,
+                "color": "red",
+                "designer": "gucci",
+                "gender": "F",
+                "on_sale": False,
+                "regular_price": 10.0,
+                "discount_price": 10.0,
+                "item_score": 1.0,
+                "short_description": "silk dress" if row_id % 3 else "silk scarf",
+                "long_description": "silk " * (row_id % 4),
+            }
+            for row_id in range(20)
+        ]
+        catalog = Catalog(products, "data.jsonl", 1, 100, 1)
+        terms = query_terms("silk")
+        text_index = catalog.text_index
+        ranked = list(text_index.rank(terms, text_index.search(terms)))
+
+        pages = []
+        after = None
+        while True:
+            page, info = get_keyset_page(catalog, ranked, None, after, 3, terms)
+            pages.extend(page)
+            if not info["has_next"]:
+                break
+            after = server.pagination_module.decode_cursor(info["next_cursor"])
+        assert pages == ranked
+
+
+class TestCursorPages:
+    """Tests for cursor-based pages of /api/products"""
+
+    def products(self, product_ids):
+        return [
+            {
+                "product_id": product_id,
+                "color": ["red", "black"][product_id % 2],
+                "designer": "gucci",
+                "gender": "F",
+                "on_sale": False,
+                "regular_price": float(product_id % 7),
+                "discount_price": float(product_id % 7),
+                "item_score": 1.0,
+            }
+            for product_id in product_ids
+        ]
+
+    def get_page(self, monkeypatch, catalog, query):
+        monkeypatch.setattr(server.catalog_store, "get", lambda: catalog)
+        response = server.route_request("GET", f"/api/products?{query}")
+        assert response.status == 200
+        body = json.loads(response.body)
+        return [product["product_id"] for product in body["products"]], body["pagination"]
+
+    @pytest.mark.parametrize(
+        "sort_by, color",
+        [("", None), ("price_low_to_high", "red"), ("price_high_to_low", "red")],
+    )
+    def test_pages_walk_the_sort_order(self, monkeypatch, sort_by, color):
+        """Test that cursor pages found without the full result match paging through it"""
+        catalog = Catalog(self.products(range(1000, 1060)), "data.jsonl", 1, 100, 1)
+        query = f"sort_by={sort_by}&color={color or ''}&items_per_page=4"
+        row_ids = catalog.index.sort_row_ids(
+            server.filter_module.filter_row_ids(catalog.index, color=color),
+            sort_by or None,
+        )
+        expected = [catalog.products[row_id]["product_id"] for row_id in row_ids]
+
+        product_ids, cursor = [], ""
+        while True:
+            page, pagination = self.get_page(monkeypatch, catalog, f"{query}&cursor={cursor}")
+            product_ids.extend(page)
+            # Each page was walked to rather than sliced from every match
+            assert server.result_cache.stats()["entries"] == 0
+            if not pagination["has_next"]:
+                break
+            cursor = pagination["next_cursor"]
+        assert product_ids == expected
+
+    def test_catalog_order_after_product_removed(self, monkeypatch):
+        """Test that removing an earlier product doesn't make the next page skip one"""
+        catalog = Catalog(self.products(range(1000, 1020)), "data.jsonl", 1, 100, 1)
+        page, pagination = self.get_page(
+            monkeypatch, catalog, "sort_by=&items_per_page=5&cursor="
+        )
+        assert page == [1000, 1001, 1002, 1003, 1004]
+
+        catalog = Catalog(self.products(range(1001, 1020)), "data.jsonl", 1, 100, 2)
+        page, _ = self.get_page(
+            monkeypatch,
+            catalog,
+            f"sort_by=&items_per_page=5&cursor={pagination['next_cursor']}",
+        )
+        assert page == [1005, 1006, 1007, 1008, 1009]
+
+
+class TestFacets:
+    """Tests for the /api/facets endpoint"""
+
+    def test_counts_by_filter_param(self, monkeypatch):
+        """Test that facets are named and keyed the way filters are passed"""
+        products = [
+            {
+                "product_id": row_id,
+                "color": ["red", "black"][row_id % 2],
+                "designer": "gucci",
+                "gender": "F",
+                "on_sale": row_id < 3,
+                "regular_price": 40.0 * row_id,
+                "discount_price": 40.0 * row_id,
+                "item_score": 1.0,
+                "short_description": "silk dress" if row_id % 3 else "silk scarf",
+            }
+            for row_id in range(6)
+        ]
+        catalog = Catalog(products, "data.jsonl", 1, 100, 1)
+        monkeypatch.setattr(server.catalog_store, "get", lambda: catalog)
+
+        response = server.route_request("GET", "/api/facets?color=red&q=dress")
+        facets = json.loads(response.body)["facets"]
+        # Every other filter applies to the color counts, but not color itself
+        assert facets["color"] == {"red": 2, "black": 2}
+        assert facets["brand"] == {"gucci": 2}
+        assert facets["on_sale"] == {"true": 1, "false": 1}
+        assert facets["price_range"]["100-250"] == 1
+        assert facets["price_range"]["0-50"] == 0
+
+
+class TestPageParams:
+    """Tests for the page and items_per_page parameters of /api/products"""
+
+    @pytest.fixture(autouse=True)
+    def catalog(self, monkeypatch):
+        """Serve a ten-product catalog"""
+        products = [
+            {
+                "product_id": row_id,
+                "color": "red",
+                "designer": "gucci",
+                "gender": "F",
+                "on_sale": False,
+                "regular_price": 10.0,
+                "discount_price": 10.0,
+                "item_score": 1.0,
+            }
+            for row_id in range(10)
+        ]
+        catalog = Catalog(products, "data.jsonl", 1, 100, 1)
+        monkeypatch.setattr(server.catalog_store, "get", lambda: catalog)
+
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "page=0",
+            "page=-1",
+            "items_per_page=0",
+            "items_per_page=-5",
+            "page=two",
+            "cursor=" + server.pagination_module.encode_cursor(1.5, {"a": 1}),
+            "cursor=" + server.pagination_module.encode_cursor(1, [1]),
+            "cursor=" + server.pagination_module.encode_cursor(float("inf"), 1),
+        ],
+    )
+    def test_invalid_values_are_rejected(self, query):
+        """Test that bad page params get a 400, e.g. instead of a slice from the end"""
+        response = server.route_request("GET", f"/api/products?sort_by=&{query}")
+        assert response.status == 400
+        assert json.loads(response.body)["status"] == "error"
+
+    def test_last_page(self):
+        """Test that a valid page is still served"""
+        response = server.route_request("GET", "/api/products?sort_by=&page=4&items_per_page=3")
+        assert response.status == 200
+        body = json.loads(response.body)
+        assert [product["product_id"] for product in body["products"]] == [9]
+        assert body["pagination"]["start_index"] == 9
+
+
+class TestInvalidFilters:
+    """Tests for rejecting filter values of the wrong type or form"""
+
+    @pytest.fixture(autouse=True)
+    def catalog(self, monkeypatch):
+        """Serve a catalog where every other product is on sale"""
+        products = [
+            {
+                "product_id": row_id,
+                "color": "red",
+                "designer": "gucci",
+                "gender": "F",
+                "on_sale": row_id % 2 == 0,
+                "regular_price": 10.0,
+                "discount_price": 10.0,
+                "item_score": 1.0,
+            }
+            for row_id in range(6)
+        ]
+        catalog = Catalog(products, "data.jsonl", 1, 100, 1)
+        monkeypatch.setattr(server.catalog_store, "get", lambda: catalog)
+
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "price_range=50",
+            "price_range=10-20-30",
+            "price_range=low-high",
+            "filters=" + encode_filter_token({"price_range": 5}),
+            "filters=" + encode_filter_token({"color": 5}),
+            "filters=" + encode_filter_token({"brand": ["gucci", 5]}),
+            "filters=" + encode_filter_token({"on_sale": 1}),
+            "filters=" + encode_filter_token({"q": ["dress"]}),
+            "filters=" + encode_filter_token({"sort_by": {}}),
+        ],
+    )
+    def test_rejected(self, query):
+        """Test that malformed filters get a 400 rather than crashing the handler"""
+        for path in ("/api/products", "/api/facets", "/data.jsonl"):
+            response = server.route_request("GET", f"{path}?{query}")
+            assert response.status == 400
+            assert json.loads(response.body)["status"] == "error"
+
+    def test_set_filters_rejected(self):
+        """Test that malformed filters aren't saved"""
+        response = server.route_request(
+            "POST", "/api/set-filters", json.dumps({"color": 5}).encode()
+        )
+        assert response.status == 400
+        assert server.saved_filters is None
+
+    def test_token_on_sale_string(self):
+        """Test that on_sale as a string in a token is read like the query param"""
+        token = encode_filter_token({"on_sale": "true"})
+        response = server.route_request("GET", f"/api/products?sort_by=&filters={token}")
+        body = json.loads(response.body)
+        assert [product["product_id"] for product in body["products"]] == [0, 2, 4]
+        assert parse_filters({"on_sale": "False"})["on_sale"] is False
+        assert parse_filters({"on_sale": "maybe"})["on_sale"] is None
+
+
+class TestCatalogErrors:
+    """Tests for requests when the data file can't be loaded"""
+
+    def test_server_error(self, tmp_path, monkeypatch):
+        """Test that a broken data file is a 500 that doesn't show the file"""
+        data_file = tmp_path / "data.jsonl"
+        data_file.write_text('{"secret": 1\n')
+        monkeypatch.setattr(server, "catalog_store", CatalogStore(str(data_file)))
+        for path in ("/api/products", "/api/facets", "/data.jsonl"):
+            response = server.route_request("GET", path)
+            assert response.status == 500
+            assert b"secret" not in response.body
+
+
+class TestResponseEncoding:
+    """Tests for assembling responses from pre-encoded products"""
+
+    products = [
+        {"product_id": 1, "color": "red", "designer": "gucci"},
+        {"product_id": 2, "color": "black", "designer": "prada"},
+        {"product_id": 3, "color": "blue", "designer": "fendi"},
+    ]
+
+    def test_products_response_matches_json_dumps(self):
+        """Test that the assembled body is exactly what json.dumps gives"""
+        encoded = [json.dumps(product).encode() for product in self.products]
+        pagination_info = {"current_page": 1, "total_items": 3}
+        body = encode_products_response(
+            encoded, [2, 0], pagination_info, {"plan": [{"field": "color"}]}
+        )
+        expected = {
+            "products": [self.products[2], self.products[0]],
+            "pagination": pagination_info,
+            "plan": [{"field": "color"}],
+        }
+        assert body == json.dumps(expected).encode()
+
+    def test_empty_page(self):
+        """Test a page with no products"""
+        body = encode_products_response([], [], {})
+        assert json.loads(body) == {"products": [], "pagination": {}}
+
+    def test_jsonl_chunks(self):
+        """Test that chunks split on line boundaries and cover every product"""
+        encoded = [json.dumps(product).encode() for product in self.products]
+        chunks = list(iter_jsonl_chunks(encoded, chunk_size=40))
+        assert len(chunks) > 1
+        assert all(chunk.endswith(b"\n") for chunk in chunks)
+        lines = b"".join(chunks).splitlines()
+        assert [json.loads(line) for line in lines] == self.products
+
+
+class TestConditionalResponse:
+    """Tests for ETags, 304 responses and compression"""
+
+    @pytest.fixture
+    def catalog(self):
+        """Fixture with a one-product catalog"""
+        product = {
+            "product_id": 1,
+            "color": "red",
+            "designer": "gucci",
+            "gender": "F",
+            "on_sale": False,
+            "regular_price": 100.0,
+            "discount_price": 100.0,
+            "item_score": 1.0,
+        }
+        return Catalog([product], "data.jsonl", 1, 100, 1)
+
+    def build_response(self):
+        """Build a compressible uncompressed response"""
+        return Response(200, b'{"products": []}' * 50)
+
+    def test_etag_depends_on_query_and_encoding(self, catalog):
+        """Test that ETags are stable but differ per query and encoding"""
+        etag = make_etag(catalog, ("products", 1))
+        assert etag == make_etag(catalog, ("products", 1))
+        assert etag != make_etag(catalog, ("products", 2))
+        assert etag != make_etag(catalog, ("products", 1), "gzip")
+
+    def test_etag_matches(self):
+        """Test If-None-Match comparison"""
+        assert etag_matches('"a", W/"b"', '"b"')
+        assert etag_matches("*", '"b"')
+        assert not etag_matches('"a"', '"b"')
+        assert not etag_matches(None, '"b"')
+
+    def test_gzip_response(self, catalog):
+        """Test that a gzip response is compressed, tagged and cached"""
+        headers = {"accept-encoding": "gzip"}
+        response = conditional_response(headers, catalog, ("q",), self.build_response)
+        response_headers = dict(response.headers)
+        assert response_headers["Content-Encoding"] == "gzip"
+        assert response_headers["ETag"].endswith('-gzip"')
+        assert gzip.decompress(response.body) == self.build_response().body
+
+        # The second request reuses the compressed body
+        cached = conditional_response(headers, catalog, ("q",), None)
+        assert cached.body == response.body
+
+    def test_not_modified(self, catalog):
+        """Test that a matching If-None-Match gets a 304 without building a body"""
+        response = conditional_response({}, catalog, ("q",), self.build_response)
+        etag = dict(response.headers)["ETag"]
+        assert "Content-Encoding" not in dict(response.headers)
+
+        response = conditional_response(
+            {"if-none-match": etag}, catalog, ("q",), None
+        )
+        assert response.status == 304
+        assert response.body == b""
+        assert dict(response.headers)["ETag"] == etag
+
+    def test_streamed_response_is_compressed(self, catalog):
+        """Test that chunked responses are compressed as they are streamed"""
+        chunks = [b"line one\n", b"line two\n"]
+        response = conditional_response(
+            {"accept-encoding": "gzip"},
+            catalog,
+            ("q",),
+            lambda: Response(200, chunks=iter(chunks)),
+        )
+        assert gzip.decompress(b"".join(response.chunks)) == b"".join(chunks)
+
+    def test_file_response_is_compressed_once(self, catalog, tmp_path):
+        """Test that a file is sent from a compressed copy, rewritten when it changes"""
+        data_file = tmp_path / "data.jsonl"
+        data_file.write_bytes(b'{"product_id": 1}\n' * 1000)
+        headers = {"accept-encoding": "gzip"}
+
+        def build_response():
+            return Response(200, file_path=str(data_file))
+
+        response = conditional_response(headers, catalog, ("q",), build_response)
+        assert response.file_path == str(data_file) + ".gz"
+        assert dict(response.headers)["Content-Encoding"] == "gzip"
+        with open(response.file_path, "rb") as f:
+            assert gzip.decompress(f.read()) == data_file.read_bytes()
+
+        # An unchanged file isn't compressed again
+        mtime_ns = os.stat(data_file).st_mtime_ns
+        inode = os.stat(response.file_path).st_ino
+        conditional_response(headers, catalog, ("q2",), build_response)
+        assert os.stat(response.file_path).st_ino == inode
+
+        data_file.write_bytes(b'{"product_id": 2}\n')
+        os.utime(data_file, ns=(mtime_ns + 1, mtime_ns + 1))
+        conditional_response(headers, catalog, ("q3",), build_response)
+        with open(response.file_path, "rb") as f:
+            assert gzip.decompress(f.read()) == b'{"product_id": 2}\n'
+
+    def test_file_response_without_writable_copy(self, catalog, tmp_path, monkeypatch):
+        """Test that a file is compressed as it's sent if the copy can't be written"""
+        data_file = tmp_path / "data.jsonl"
+        data_file.write_bytes(b'{"product_id": 1}\n' * 1000)
+
+        def compress_file(*args):
+            raise PermissionError("read only")
+
+        monkeypatch.setattr(server.http_compression, "compress_file", compress_file)
+        response = conditional_response(
+            {"accept-encoding": "gzip"},
+            catalog,
+            ("q",),
+            lambda: Response(200, file_path=str(data_file)),
+        )
+        assert response.file_path is None
+        assert gzip.decompress(b"".join(response.chunks)) == data_file.read_bytes()
+
+
+def serve(mode, tmp_path, monkeypatch):
+    """Serve a four-product catalog in a mode on a free port, yielding the port"""
+    monkeypatch.chdir(tmp_path)
+    with open("data.jsonl", "w") as file:
+        for product_id in range(4):
+            product = {
+                "product_id": product_id,
+                "color": ["red", "black"][product_id % 2],
+                "designer": "gucci",
+                "gender": "F",
+                "on_sale": False,
+                "regular_price": 10.0,
+                "discount_price": 10.0,
+                "item_score": 1.0,
+            }
+            file.write(json.dumps(product) + "\n")
+    with open("index.html", "w") as file:
+        file.write("<h1>Products</h1>")
+    monkeypatch.setattr(server, "catalog_store", CatalogStore("data.jsonl"))
+    monkeypatch.setattr(server, "saved_filters", None)
+
+    if mode == "asyncio":
+        loop = asyncio.new_event_loop()
+        executor = ThreadPoolExecutor(max_workers=2)
+        httpd = loop.run_until_complete(
+            server.start_asyncio_server("localhost", 0, executor)
+        )
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        yield httpd.sockets[0].getsockname()[1]
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        httpd.close()
+        loop.run_until_complete(httpd.wait_closed())
+        loop.close()
+        executor.shutdown()
+    else:
+        httpd = server.make_server(mode, 0, 2)
+        thread = threading.Thread(
+            target=httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+        thread.start()
+        yield httpd.server_address[1]
+        httpd.shutdown()
+        httpd.server_close()
+
+
+@pytest.fixture(params=["single", "threaded", "asyncio"])
+def http_port(request, tmp_path, monkeypatch):
+    """Fixture serving a four-product catalog in each mode on a free port"""
+    yield from serve(request.param, tmp_path, monkeypatch)
+
+
+@pytest.fixture(params=["threaded", "asyncio"])
+def keep_alive_port(request, tmp_path, monkeypatch):
+    """Fixture like http_port, in the modes that keep connections open"""
+    yield from serve(request.param, tmp_path, monkeypatch)
+
+
+@pytest.fixture
+def single_port(tmp_path, monkeypatch):
+    """Fixture like http_port, in the single mode"""
+    yield from serve("single", tmp_path, monkeypatch)
+
+
+def connect(port):
+    """Open a connection to the server, failing rather than hanging if it stops answering"""
+    return socket.create_connection(("localhost", port), timeout=10)
+
+
+def read_response(file):
+    """
+    Read one response from a connection, keeping chunked bodies as sent.
+
+    Args:
+        file: The connection's socket, as a binary file
+
+    Returns:
+        tuple: (status, headers with lowercase names, raw body)
+    """
+    status = int(file.readline().split()[1])
+    headers = {}
+    while True:
+        line = file.readline().decode("latin-1")
+        if line in ("\r\n", ""):
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    if status == 304:
+        body = b""
+    elif "content-length" in headers:
+        body = file.read(int(headers["content-length"]))
+    elif headers.get("transfer-encoding") == "chunked":
+        body = b""
+        while True:
+            size_line = file.readline()
+            chunk = file.read(int(size_line, 16) + 2)
+            body += size_line + chunk
+            if int(size_line, 16) == 0:
+                break
+    else:
+        # Without a length the body ends when the connection is closed
+        body = file.read()
+    return status, headers, body
+
+
+def decode_chunked(body):
+    """Join the chunks of a raw chunked body"""
+    data = b""
+    while True:
+        size_line, _, body = body.partition(b"\r\n")
+        size = int(size_line, 16)
+        if size == 0:
+            return data
+        data += body[:size]
+        body = body[size + 2:]
+
+
+class TestServerModes:
+    """Tests for serving requests over real connections in each mode"""
+
+    def test_keep_alive(self, keep_alive_port):
+        """Test that several requests are answered on one connection"""
+        with connect(keep_alive_port) as sock, sock.makefile("rb") as file:
+            for _ in range(3):
+                sock.sendall(b"GET /api/products HTTP/1.1\r\nHost: localhost\r\n\r\n")
+                status, headers, body = read_response(file)
+                assert status == 200
+                assert headers.get("connection", "keep-alive") == "keep-alive"
+                assert int(headers["content-length"]) == len(body)
+                assert len(json.loads(body)["products"]) == 4
+
+    def test_pipelined_requests(self, keep_alive_port):
+        """Test that requests sent together are all answered, in order"""
+        with connect(keep_alive_port) as sock, sock.makefile("rb") as file:
+            sock.sendall(
+                b"GET /api/products?color=red HTTP/1.1\r\nHost: localhost\r\n\r\n"
+                b"GET /api/products?color=black HTTP/1.1\r\nHost: localhost\r\n\r\n"
+            )
+            for expected in ([0, 2], [1, 3]):
+                status, _, body = read_response(file)
+                assert status == 200
+                products = json.loads(body)["products"]
+                assert [product["product_id"] for product in products] == expected
+
+    def test_single_mode_closes_connections(self, single_port):
+        """Test that the single mode closes each connection, so the next client isn't kept waiting"""
+        with connect(single_port) as sock, sock.makefile("rb") as file:
+            sock.sendall(b"GET /api/products HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            status, headers, body = read_response(file)
+            assert status == 200
+            assert headers["connection"] == "close"
+            assert len(json.loads(body)["products"]) == 4
+
+            # The first client still has its connection open
+            with connect(single_port) as other, other.makefile("rb") as other_file:
+                other.settimeout(1)
+                other.sendall(b"GET /data.jsonl?color=red HTTP/1.1\r\nHost: localhost\r\n\r\n")
+                status, headers, body = read_response(other_file)
+                assert status == 200
+                assert headers["connection"] == "close"
+                assert decode_chunked(body).count(b"\n") == 2
+            assert file.read() == b""
+
+    def test_connection_close(self, http_port):
+        """Test that the server closes the connection when asked to"""
+        with connect(http_port) as sock, sock.makefile("rb") as file:
+            sock.sendall(
+                b"GET /api/products HTTP/1.1\r\nHost: localhost\r\n"
+                b"Connection: close\r\n\r\n"
+            )
+            status, headers, body = read_response(file)
+            assert status == 200
+            assert headers.get("connection", "close") == "close"
+            assert int(headers["content-length"]) == len(body)
+            assert file.read() == b""
+
+    def test_static_files(self, http_port):
+        """Test that static files are served, but nothing outside the directory"""
+        with connect(http_port) as sock, sock.makefile("rb") as file:
+            sock.sendall(b"GET / HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            status, headers, body = read_response(file)
+            assert (status, body) == (200, b"<h1>Products</h1>")
+            assert headers["content-type"] == "text/html"
+        for path in (b"/../../../etc/passwd", b"/%2e%2e/%2e%2e/%2e%2e/etc/passwd"):
+            # Errors may close the connection, so each gets its own
+            with connect(http_port) as sock, sock.makefile("rb") as file:
+                sock.sendall(b"GET " + path + b" HTTP/1.1\r\nHost: localhost\r\n\r\n")
+                status, _, body = read_response(file)
+                assert status == 404
+                assert b"root:" not in body
+
+    def test_request_body_is_read(self, keep_alive_port):
+        """Test that a POST body is read, leaving the connection ready for the next request"""
+        body = json.dumps({"color": "red"}).encode()
+        with connect(keep_alive_port) as sock, sock.makefile("rb") as file:
+            sock.sendall(
+                b"POST /api/set-filters HTTP/1.1\r\nHost: localhost\r\n"
+                b"Content-Type: application/json\r\n"
+                b"Content-Length: %d\r\n\r\n%s" % (len(body), body)
+            )
+            status, _, response_body = read_response(file)
+            assert status == 200
+            assert json.loads(response_body)["status"] == "success"
+            assert server.saved_filters == {"color": "red"}
+
+            # The saved filters apply to the next request on the connection
+            sock.sendall(b"GET /api/products HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            status, _, response_body = read_response(file)
+            assert status == 200
+            products = json.loads(response_body)["products"]
+            assert [product["product_id"] for product in products] == [0, 2]
+
+
+class TestSendAppResponse:
+    """Tests for how each kind of response is framed on the connection"""
+
+    def get(self, sock, path, headers=b""):
+        """Send a GET request on a keep-alive connection"""
+        sock.sendall(b"GET " + path + b" HTTP/1.1\r\nHost: localhost\r\n" + headers + b"\r\n")
+
+    def test_sendfile(self, keep_alive_port):
+        """Test that a file is sent whole with its length, plain or compressed"""
+        with open("data.jsonl", "rb") as f:
+            data = f.read()
+        with connect(keep_alive_port) as sock, sock.makefile("rb") as file:
+            self.get(sock, b"/data.jsonl")
+            status, headers, body = read_response(file)
+            assert (status, body) == (200, data)
+            assert int(headers["content-length"]) == len(data)
+
+            self.get(sock, b"/data.jsonl", b"Accept-Encoding: gzip\r\n")
+            status, headers, body = read_response(file)
+            assert status == 200
+            assert headers["content-encoding"] == "gzip"
+            assert int(headers["content-length"]) == os.path.getsize("data.jsonl.gz")
+            assert gzip.decompress(body) == data
+
+    def test_chunked(self, keep_alive_port):
+        """Test that streamed responses are chunked and end with a zero-length chunk"""
+        with connect(keep_alive_port) as sock, sock.makefile("rb") as file:
+            for _ in range(2):
+                self.get(sock, b"/data.jsonl?color=red")
+                status, headers, body = read_response(file)
+                assert status == 200
+                assert headers["transfer-encoding"] == "chunked"
+                assert "content-length" not in headers
+                assert body.endswith(b"\r\n0\r\n\r\n")
+                products = [json.loads(line) for line in decode_chunked(body).splitlines()]
+                assert [product["product_id"] for product in products] == [0, 2]
+
+    def test_not_modified(self, keep_alive_port):
+        """Test that a 304 has no body, so the next response follows straight on"""
+        with connect(keep_alive_port) as sock, sock.makefile("rb") as file:
+            self.get(sock, b"/api/products")
+            _, headers, body = read_response(file)
+            etag = headers["etag"].encode()
+
+            self.get(sock, b"/api/products", b"If-None-Match: " + etag + b"\r\n")
+            status, headers, _ = read_response(file)
+            assert status == 304
+            assert headers["etag"].encode() == etag
+            assert headers.get("content-length", "0") == "0"
+            assert "transfer-encoding" not in headers
+
+            self.get(sock, b"/api/products")
+            status, _, next_body = read_response(file)
+            assert (status, next_body) == (200, body)
+
+    def test_http_1_0_close_delimited(self, http_port):
+        """Test that streamed responses to HTTP/1.0 end by closing the connection"""
+        with connect(http_port) as sock, sock.makefile("rb") as file:
+            sock.sendall(b"GET /data.jsonl?color=red HTTP/1.0\r\n\r\n")
+            status, headers, body = read_response(file)
+            assert status == 200
+            assert "transfer-encoding" not in headers
+            assert "content-length" not in headers
+            products = [json.loads(line) for line in body.splitlines()]
+            assert [product["product_id"] for product in products] == [0, 2]
+
+
+class TestThreadPoolHTTPServer:
+    """Tests for keeping idle connections off the worker threads"""
+
+    @pytest.fixture
+    def httpd(self, tmp_path, monkeypatch):
+        """Fixture serving an empty catalog with one worker"""
+        monkeypatch.chdir(tmp_path)
+        open("data.jsonl", "w").close()
+        monkeypatch.setattr(server, "catalog_store", CatalogStore("data.jsonl"))
+        httpd = server.make_server("threaded", 0, 1)
+        thread = threading.Thread(
+            target=httpd.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True
+        )
+        thread.start()
+        yield httpd
+        httpd.shutdown()
+        httpd.server_close()
+
+    def test_idle_connections_dont_hold_the_worker(self, httpd):
+        """Test that one worker serves several open keep-alive connections in turn"""
+        port = httpd.server_address[1]
+        with connect(port) as first, connect(port) as second:
+            files = [first.makefile("rb"), second.makefile("rb")]
+            for _ in range(2):
+                for sock, file in zip((first, second), files):
+                    sock.sendall(b"GET /api/products HTTP/1.1\r\nHost: localhost\r\n\r\n")
+                    assert read_response(file)[0] == 200
+            for file in files:
+                file.close()
+
+    def test_idle_connections_are_closed(self, httpd, monkeypatch):
+        """Test that connections left idle are closed after idle_timeout"""
+        monkeypatch.setattr(httpd, "idle_timeout", 0.1)
+        with connect(httpd.server_address[1]) as sock, sock.makefile("rb") as file:
+            sock.sendall(b"GET /api/products HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            assert read_response(file)[0] == 200
+            assert file.read() == b""
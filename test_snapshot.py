@@ -0,0 +1,142 @@
+"""
+Test suite for catalog snapshots.
+
+This module contains pytest tests for the snapshot.py module.
+"""
+
+import os
+import time
+
+import pytest
+import text_search
+from catalog import CatalogStore
+from snapshot import SnapshotProducts, open_snapshot, snapshot_path, write_snapshot
+from test_catalog import make_product, touch_later, write_products
+
+
+@pytest.fixture
+def data_file(tmp_path):
+    """Fixture with a JSONL data file of 40 products"""
+    path = tmp_path / "data.jsonl"
+    products = []
+    for product_id in range(40):
+        product = make_product(product_id, ["red", "black", "blue"][product_id % 3])
+        product["on_sale"] = product_id % 2 == 0
+        product["discount_price"] = 50.0 + product_id
+        product["item_score"] = product_id / 7
+        product["short_description"] = f"Product number {product_id}"
+        product["sizes"] = ["S", "M"] if product_id % 5 else None
+        products.append(product)
+    write_products(path, products)
+    return str(path)
+
+
+def save_snapshot(data_file):
+    """Write a snapshot of a data file and return the parsed products"""
+    store = CatalogStore(data_file)
+    catalog = store.get()
+    store.save_snapshot(catalog)
+    return catalog
+
+
+class TestSnapshot:
+    """Tests for writing and reading snapshots"""
+
+    def test_round_trip(self, data_file):
+        """Test that products read from a snapshot equal the parsed ones"""
+        catalog = save_snapshot(data_file)
+        snapshot = open_snapshot(data_file)
+        assert snapshot is not None
+        products = snapshot.products()
+        assert len(products) == 40
+        assert list(products) == catalog.products
+        assert products[7] == catalog.products[7]
+        assert products[-1] == catalog.products[-1]
+        assert products[2:4] == catalog.products[2:4]
+        assert list(snapshot.encoded_products()) == catalog.encoded_products
+
+    def test_column_types(self, data_file):
+        """Test that each field is stored in the expected form"""
+        save_snapshot(data_file)
+        columns = open_snapshot(data_file).columns
+        assert columns["product_id"]["type"] == "int"
+        assert columns["regular_price"]["type"] == "float"
+        assert columns["on_sale"]["type"] == "bool"
+        assert columns["color"]["type"] == "category"
+        assert columns["short_description"]["type"] == "string"
+        assert columns["sizes"]["type"] == "json"
+
+    def test_stale_snapshot_is_ignored(self, data_file):
+        """Test that a snapshot isn't used once the data file changes"""
+        save_snapshot(data_file)
+        touch_later(data_file)
+        assert open_snapshot(data_file) is None
+
+    def test_damaged_snapshot_is_ignored(self, data_file):
+        """Test that a truncated snapshot isn't used"""
+        save_snapshot(data_file)
+        with open(snapshot_path(data_file), "r+b") as file:
+            file.truncate(12)
+        assert open_snapshot(data_file) is None
+
+    def test_products_must_have_same_fields(self, tmp_path):
+        """Test that products with different fields can't be saved"""
+        stat_result = os.stat(tmp_path)
+        with pytest.raises(ValueError):
+            write_snapshot(
+                [{"a": 1, "b": 2}, {"b": 2, "a": 1}],
+                str(tmp_path / "data.snapshot"),
+                stat_result.st_size,
+                stat_result.st_mtime_ns,
+            )
+
+
+class TestCatalogFromSnapshot:
+    """Tests for loading a catalog from its snapshot"""
+
+    def test_catalog_uses_snapshot(self, data_file):
+        """Test that the catalog and index loaded from a snapshot match"""
+        parsed = save_snapshot(data_file)
+        catalog = CatalogStore(data_file).get()
+        assert isinstance(catalog.products, SnapshotProducts)
+        assert list(catalog.encoded_products) == parsed.encoded_products
+
+        index, parsed_index = catalog.index, parsed.index
+        assert index.postings == parsed_index.postings
+        assert index.sort_orders == parsed_index.sort_orders
+        assert index.ranks == parsed_index.ranks
+        criteria = {"color": "black", "on_sale": True}
+        assert list(index.lookup(criteria, (50, 70))) == list(
+            parsed_index.lookup(criteria, (50, 70))
+        )
+
+        text_index, parsed_text_index = catalog.text_index, parsed.text_index
+        assert text_index.postings == parsed_text_index.postings
+        assert text_index.frequencies == parsed_text_index.frequencies
+        terms = ("number", "product")
+        assert list(text_index.rank(terms, text_index.search(terms))) == list(
+            parsed_text_index.rank(terms, parsed_text_index.search(terms))
+        )
+
+    def test_text_index_from_older_stemmer_is_rebuilt(self, data_file, monkeypatch):
+        """Test that search terms saved by another version of stem() aren't used"""
+        save_snapshot(data_file)
+        monkeypatch.setattr(text_search, "STEMMER_VERSION", text_search.STEMMER_VERSION + 1)
+
+        def from_arrays(*args):
+            raise AssertionError("the saved text index was used")
+
+        monkeypatch.setattr(text_search.TextIndex, "from_arrays", from_arrays)
+        catalog = CatalogStore(data_file).get()
+        assert isinstance(catalog.products, SnapshotProducts)
+        assert list(catalog.text_index.search(("product",)))
+
+    def test_saved_in_background(self, data_file):
+        """Test that a store saves a snapshot after parsing the data file"""
+        CatalogStore(data_file, save_snapshots=True).get()
+        # Give the background thread time to write the snapshot
+        for _ in range(100):
+            if open_snapshot(data_file) is not None:
+                break
+            time.sleep(0.05)
+        assert open_snapshot(data_file) is not None
@@ -0,0 +1,189 @@
+"""
+Test suite for full-text search.
+
+This module contains pytest tests for the tokenizer and TextIndex in
+text_search.py.
+"""
+
+import pytest
+from filter import search_row_ids
+from product_index import ProductIndex
+from text_search import TextIndex, query_terms, stem, tokenize
+
+
+@pytest.fixture
+def products():
+    """Fixture with a few products with descriptions"""
+    descriptions = [
+        ("Rayon Midi Dress", "100% rayon. Made in Italy"),
+        ("Leather Boots", "Calf leather boots with a rayon lining"),
+        ("Pleated Dresses", "Two pleated silk dresses"),
+        ("Silk Scarf", "A silk scarf, printed with a dress pattern"),
+        ("Café Tote", None),
+        ("Rayon Dress", "Rayon dress"),
+    ]
+    return [
+        {
+            "product_id": product_id,
+            "color": ["red", "black"][product_id % 2],
+            "designer": "gucci",
+            "gender": "F",
+            "on_sale": False,
+            "regular_price": 100.0 + product_id,
+            "discount_price": 100.0 + product_id,
+            "item_score": product_id / 2,
+            "short_description": short_description,
+            "long_description": long_description,
+        }
+        for product_id, (short_description, long_description) in enumerate(descriptions)
+    ]
+
+
+class TestTokenize:
+    """Tests for splitting text into terms"""
+
+    def test_normalises_words(self):
+        """Test that case, punctuation, plurals and endings are ignored"""
+        assert tokenize("Pleated Dresses!") == tokenize("pleat dress")
+        assert tokenize("Leather BOOTS") == ["leather", "boot"]
+        assert stem("cropped") == "crop"
+        assert stem("dressed") == "dress"
+        assert stem("string") == "string"
+
+    @pytest.mark.parametrize(
+        "singular, plural",
+        [
+            ("dress", "dresses"),
+            ("hoodie", "hoodies"),
+            ("beanie", "beanies"),
+            ("bootie", "booties"),
+            ("tie", "ties"),
+            ("accessory", "accessories"),
+            ("shoe", "shoes"),
+            ("box", "boxes"),
+        ],
+    )
+    def test_plural_has_same_stem(self, singular, plural):
+        """Test that a word and its plural have the same term"""
+        assert stem(singular) == stem(plural)
+
+    def test_search_finds_plurals(self):
+        """Test that searching for words ending in "ie" finds their plurals"""
+        index = TextIndex(
+            [{"short_description": "Cotton hoodies"}, {"short_description": "Silk ties"}]
+        )
+        assert list(index.search(query_terms("hoodie"))) == [0]
+        assert list(index.search(query_terms("tie"))) == [1]
+        assert list(index.search(query_terms("Silk Tie"))) == [1]
+
+    def test_drops_stop_words_and_single_characters(self):
+        """Test that words too common to search for aren't terms"""
+        assert tokenize("Made in Italy, a 5 star coat") == ["italy", "star", "coat"]
+        assert tokenize(None) == []
+
+    def test_removes_accents(self):
+        """Test that accented words match their unaccented form"""
+        assert tokenize("Café crème") == tokenize("cafe creme")
+
+    def test_query_terms(self):
+        """Test that equivalent queries have the same terms"""
+        assert query_terms("Dresses rayon DRESS") == ("dress", "rayon")
+        assert query_terms("the") == ()
+
+
+class TestTextIndex:
+    """Tests for searching and ranking with a TextIndex"""
+
+    def test_search_needs_every_term(self, products):
+        """Test that only products with all the terms match"""
+        index = TextIndex(products)
+        assert list(index.search(query_terms("rayon"))) == [0, 1, 5]
+        assert list(index.search(query_terms("rayon dresses"))) == [0, 5]
+        assert list(index.search(query_terms("rayon velvet"))) == []
+        assert list(index.search(query_terms("cafe"))) == [4]
+        assert list(index.search(())) == []
+
+    def test_search_within_rows(self, products):
+        """Test that a search can be limited to some rows"""
+        index = TextIndex(products)
+        assert list(index.search(query_terms("rayon"), [1, 2, 3, 4, 5])) == [1, 5]
+        assert list(index.search(query_terms("rayon"), range(6))) == [0, 1, 5]
+
+    def test_rank_by_relevance(self, products):
+        """Test that the best matches come first"""
+        index = TextIndex(products)
+        terms = query_terms("dress")
+        ranked = list(index.rank(terms, index.search(terms)))
+        # A short, repeated match beats a mention deep in a long description
+        assert ranked[0] == 5
+        assert ranked[-1] == 3
+        scores = [index.score(terms, row_id) for row_id in ranked]
+        assert scores == sorted(scores, reverse=True)
+        assert index.score(terms, 1) == 0.0
+
+    def test_equal_scores_keep_row_order(self):
+        """Test that products with the same score stay in catalog order"""
+        products = [{"short_description": "silk scarf"} for _ in range(5)]
+        index = TextIndex(products)
+        terms = query_terms("scarf")
+        assert list(index.rank(terms, index.search(terms))) == [0, 1, 2, 3, 4]
+
+    def test_arrays_round_trip(self, products):
+        """Test that an index rebuilt from its arrays gives the same results"""
+        index = TextIndex(products)
+        arrays, metadata = index.to_arrays()
+        rebuilt = TextIndex.from_arrays(products, arrays, metadata)
+        terms = query_terms("rayon dress")
+        assert list(rebuilt.rank(terms, rebuilt.search(terms))) == list(
+            index.rank(terms, index.search(terms))
+        )
+        assert list(rebuilt.lengths) == list(index.lengths)
+
+
+class TestApplyChanges:
+    """Tests for updating a TextIndex instead of building a new one"""
+
+    def assert_same_index(self, index, expected):
+        """Check that two indexes hold the same terms and counts"""
+        assert index.postings == expected.postings
+        assert index.frequencies == expected.frequencies
+        assert list(index.lengths) == list(expected.lengths)
+        assert index.total_length == expected.total_length
+
+    def test_added_and_replaced_products(self, products):
+        """Test that new and replaced products are indexed"""
+        index = TextIndex(products)
+        updated = list(products)
+        updated[1] = dict(products[1], short_description="Velvet Boots")
+        updated.append(dict(products[0], product_id=10))
+        self.assert_same_index(
+            index.apply_changes(updated, changed_rows=[1]), TextIndex(updated)
+        )
+        # The original index is left as it was
+        self.assert_same_index(index, TextIndex(products))
+
+    def test_deleted_products(self, products):
+        """Test that rows after a deleted product move up"""
+        index = TextIndex(products)
+        updated = [products[0], products[2], dict(products[3], long_description=None)]
+        updated += products[4:]
+        self.assert_same_index(
+            index.apply_changes(updated, changed_rows=[3], deleted_rows=[1]),
+            TextIndex(updated),
+        )
+
+
+class TestSearchRowIds:
+    """Tests for combining a search with filters and sort orders"""
+
+    def test_filters_and_sort_orders(self, products):
+        """Test that filters narrow a search and sort orders replace relevance"""
+        index, text_index = ProductIndex(products), TextIndex(products)
+        terms = query_terms("rayon")
+        assert list(search_row_ids(index, text_index, terms)) == list(
+            text_index.rank(terms, [0, 1, 5])
+        )
+        assert list(search_row_ids(index, text_index, terms, color="black")) == [5, 1]
+        assert list(
+            search_row_ids(index, text_index, terms, "price_high_to_low")
+        ) == [5, 1, 0]
@@ -0,0 +1,525 @@
+"""
+Text Search Module
+
+This module answers free-text queries over the products' descriptions.
+
+Each product's short_description and long_description are split into
+terms: lowercased words with accents removed, common stop words dropped
+and plural and -ed/-ing endings stripped, so "Pleated Dresses" and "pleat
+dress" find the same products. An inverted index maps every term to the
+sorted row ids of the products that contain it, together with how often it
+appears in each.
+
+A query matches the products that contain all of its terms, which are
+ranked by BM25: a term counts for more the more often it appears in a
+product and the fewer products it appears in, and matches in a short
+description count for more than the same matches in a long one. Words in
+the short description are counted FIELD_WEIGHTS times over.
+
+Posting lists use four-byte row ids and one-byte counts, since there is an
+entry for every distinct term of every product - many more than there are
+posting lists in ProductIndex. Like ProductIndex, the index can be updated
+for a few changed products without indexing every product again, and saved
+to and rebuilt from arrays (see snapshot.py).
+"""
+
+import math
+import re
+import unicodedata
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from itertools import accumulate, chain, compress
+
+from product_index import column_values
+from query_planner import intersect_posting_lists
+
+
+# Fields that are searched, and how many times each word in them is counted
+FIELD_WEIGHTS = {"short_description": 3, "long_description": 1}
+
+# Words too common to be worth indexing
+STOP_WORDS = frozenset(
+    "a an and are as at be by for from in into is it its made of on or the "
+    "this to with".split()
+)
+
+# (suffix, replacement) pairs for plurals, tried in order until one can be
+# stripped. It is only stripped if at least MIN_STEM_LENGTH characters are
+# left (and one more than that for VERB_SUFFIXES, so "string" stays
+# "string"); otherwise the next matching suffix is tried, so "ties" -> "tie".
+SUFFIXES = (
+    ("sses", "ss"),
+    ("ies", "y"),
+    ("ches", "ch"),
+    ("shes", "sh"),
+    ("xes", "x"),
+    ("ss", "ss"),
+    ("us", "us"),
+    ("s", ""),
+)
+VERB_SUFFIXES = ("ing", "ed")
+MIN_STEM_LENGTH = 3
+
+# Changes whenever stem() gives different terms, so indexes saved with an
+# older version are built again
+STEMMER_VERSION = 2
+
+# Term counts are stored in one byte
+MAX_FREQUENCY = 255
+
+# BM25 parameters: how quickly repeats of a term stop adding to the score,
+# and how much a product's score is scaled down for having more text
+K1 = 1.2
+B = 0.75
+SATURATION = K1 + 1
+BASE_PENALTY = K1 * (1 - B)
+
+WORD_PATTERN = re.compile(r"\w+")
+
+# Maps every ASCII byte to itself, lowercased, if it can be part of a word
+# (the same characters as \w) and to a space otherwise
+_ASCII_WORDS = bytes(
+    byte if chr(byte).isalnum() or chr(byte) == "_" else ord(" ")
+    for byte in range(128)
+).lower() + b" " * 128
+
+# Words whose terms are remembered, so each is only stemmed once
+MAX_CACHED_WORDS = 100000
+
+
+def stem(word):
+    """
+    Strip plural and -ed/-ing endings off a lowercase word.
+
+    This is a deliberately simple stemmer: it only has to map the forms of
+    a word found in product descriptions onto the same term.
+
+    Args:
+        word (str): A lowercase word
+
+    Returns:
+        str: The word's stem, e.g. "dress" for "dresses" and "crop" for
+        "cropped"
+    """
+    for suffix, replacement in SUFFIXES:
+        if word.endswith(suffix) and (
+            len(word) - len(suffix) + len(replacement) >= MIN_STEM_LENGTH
+        ):
+            word = word[: -len(suffix)] + replacement
+            break
+    for suffix in VERB_SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) > MIN_STEM_LENGTH:
+            word = word[: -len(suffix)]
+            # "cropped" -> "cropp" -> "crop", but "dressed" -> "dress"
+            if word[-1] == word[-2] and word[-1] not in "lsz":
+                word = word[:-1]
+            break
+    # "shoe" and "shoes" -> "sho"
+    if word.endswith("e") and len(word) > MIN_STEM_LENGTH:
+        word = word[:-1]
+        # "hoodie" -> "hoody", like "hoodies"
+        if word.endswith("i"):
+            word = word[:-1] + "y"
+    return word
+
+
+class _TermCache(dict):
+    # Maps a word (bytes or str) -> its term, or None if it isn't indexed
+
+    def __missing__(self, key):
+        word = key.decode() if isinstance(key, bytes) else key
+        term = None if len(word) < 2 or word in STOP_WORDS else stem(word)
+        if len(self) < MAX_CACHED_WORDS:
+            self[key] = term
+        return term
+
+
+_terms = _TermCache()
+
+
+def _words(text):
+    # The lowercase words of a text. ASCII text is split without a regex,
+    # which is several times faster, and its words are returned as bytes.
+    if text.isascii():
+        return text.encode().translate(_ASCII_WORDS).split()
+    # Search for "cafe" finds "café"
+    text = "".join(
+        char
+        for char in unicodedata.normalize("NFKD", text.lower())
+        if not unicodedata.combining(char)
+    )
+    return WORD_PATTERN.findall(text)
+
+
+def tokenize(text):
+    """
+    Split text into index terms.
+
+    Words are lowercased and have their accents removed, stop words and
+    single characters are dropped, and the rest are stemmed.
+
+    Args:
+        text (str): Text to split (None is treated as empty)
+
+    Returns:
+        list: The text's terms, in order, including repeats
+    """
+    if not text:
+        return []
+    return [term for term in map(_terms.__getitem__, _words(text)) if term is not None]
+
+
+def query_terms(query):
+    """
+    Get the distinct terms of a search query.
+
+    Args:
+        query (str): The search query
+
+    Returns:
+        tuple: The query's terms, sorted, so equivalent queries give the same
+        tuple (empty if the query has no searchable words)
+    """
+    return tuple(sorted(set(tokenize(query))))
+
+
+def _term_counts(texts):
+    # Weighted number of times each term appears in a product's texts (one
+    # per field in FIELD_WEIGHTS). Repeating a field's words counts them that
+    # many times over.
+    words = []
+    for text, weight in zip(texts, FIELD_WEIGHTS.values()):
+        if text:
+            words += _words(text) * weight
+    counts = Counter(map(_terms.__getitem__, words))
+    counts.pop(None, None)
+    return counts
+
+
+class TextIndex:
+    """
+    Inverted index over the words in the products' descriptions.
+
+    Attributes:
+        products (list): The product dictionaries the index was built from
+        postings (dict): Maps term -> sorted array of the row ids of the
+            products containing it
+        frequencies (dict): Maps term -> array of the term's weighted count
+            in each of those products (capped at MAX_FREQUENCY), in the same
+            order
+        lengths (array): Weighted number of terms in each product, by row id
+        total_length (int): Sum of lengths
+    """
+
+    def __init__(self, products):
+        self.products = products
+        self.lengths = array("I")
+        # The fields are read a column at a time, so products stored as
+        # columns don't have to be built, and tokenized a product at a time,
+        # so only one product's terms are held on top of the index itself
+        fields = [column_values(products, field) for field in FIELD_WEIGHTS]
+        entries = {}
+        for row_id, texts in enumerate(zip(*fields)):
+            counts = _term_counts(texts)
+            for term, count in counts.items():
+                entry = entries.get(term)
+                if entry is None:
+                    entry = entries[term] = (array("I"), array("B"))
+                entry[0].append(row_id)
+                entry[1].append(count if count < MAX_FREQUENCY else MAX_FREQUENCY)
+            self.lengths.append(sum(counts.values()))
+        self.postings = {term: rows for term, (rows, _) in entries.items()}
+        self.frequencies = {term: counts for term, (_, counts) in entries.items()}
+        self.total_length = sum(self.lengths)
+
+    @classmethod
+    def from_arrays(cls, products, arrays, metadata):
+        """
+        Rebuild an index from the output of to_arrays(), without tokenizing.
+
+        Args:
+            products (list): The products the index was built from
+            arrays (dict): The arrays returned by to_arrays()
+            metadata (dict): The metadata returned by to_arrays()
+
+        Returns:
+            TextIndex: The index
+        """
+        index = cls.__new__(cls)
+        index.products = products
+        rows, counts = arrays["text.postings"], arrays["text.frequencies"]
+        offsets = arrays["text.offsets"]
+        index.postings = {}
+        index.frequencies = {}
+        for i, term in enumerate(metadata["terms"]):
+            index.postings[term] = rows[offsets[i] : offsets[i + 1]]
+            index.frequencies[term] = counts[offsets[i] : offsets[i + 1]]
+        index.lengths = arrays["text.lengths"]
+        index.total_length = metadata["total_length"]
+        return index
+
+    def to_arrays(self):
+        """
+        Export the index's arrays, so it can be saved and rebuilt later.
+
+        Returns:
+            tuple: (arrays, metadata) where arrays maps names -> arrays and
+            metadata is a JSON-compatible dictionary of everything else
+            needed by from_arrays()
+        """
+        # Every posting list, one after another
+        postings, frequencies = array("I"), array("B")
+        for term, rows in self.postings.items():
+            _extend(postings, rows)
+            _extend(frequencies, self.frequencies[term])
+        arrays = {
+            "text.postings": postings,
+            "text.frequencies": frequencies,
+            "text.offsets": array(
+                "l", accumulate(map(len, self.postings.values()), initial=0)
+            ),
+            "text.lengths": self.lengths,
+        }
+        metadata = {
+            "terms": list(self.postings),
+            "total_length": self.total_length,
+            "stemmer": STEMMER_VERSION,
+        }
+        return arrays, metadata
+
+    def apply_changes(self, products, changed_rows=(), deleted_rows=()):
+        """
+        Build the index of an updated product list from this index.
+
+        Only the added and changed products are tokenized, and only the
+        posting lists of their terms (old and new) are rebuilt. The others
+        are shared with this index, or renumbered if products were deleted.
+        This index isn't modified.
+
+        Args:
+            products (list): The updated products: this index's products,
+                with changed_rows replaced and deleted_rows left out,
+                followed by any new products
+            changed_rows (iterable): Row ids (in this index) of products
+                that have been replaced
+            deleted_rows (iterable): Row ids (in this index) of products
+                that have been removed
+
+        Returns:
+            TextIndex: The index of the updated products, the same as
+            TextIndex(products) would build
+        """
+        old_count = len(self.lengths)
+        deleted = set(deleted_rows)
+        changed = set(changed_rows) - deleted
+        # The rows each term loses: the old products' terms come out of the
+        # posting lists. Other rows keep their entries, and only need
+        # renumbering if rows were deleted.
+        removals = {}
+        for row_id in chain(changed, deleted):
+            for term in _term_counts(_texts(self.products[row_id])):
+                removals.setdefault(term, []).append(row_id)
+
+        if deleted:
+            keep = bytearray(b"\x01") * old_count
+            for row_id in deleted:
+                keep[row_id] = 0
+            new_ids = array("l", accumulate(keep, initial=0))
+            changed = {new_ids[row_id] for row_id in changed}
+            lengths = array("I", compress(self.lengths, keep))
+        else:
+            lengths = _extend(array("I"), self.lengths)
+        added = range(old_count - len(deleted), len(products))
+        inserted = sorted(changed) + list(added)
+        lengths.extend(array("I", bytes(lengths.itemsize * len(added))))
+
+        # The rows each term gains, with their counts
+        additions = {}
+        for row_id in inserted:
+            counts = _term_counts(_texts(products[row_id]))
+            lengths[row_id] = sum(counts.values())
+            for term, count in counts.items():
+                additions.setdefault(term, []).append((row_id, count))
+
+        index = TextIndex.__new__(TextIndex)
+        index.products = products
+        index.postings = {}
+        index.frequencies = {}
+        index.lengths = lengths
+        index.total_length = sum(lengths)
+        for term, rows in self.postings.items():
+            counts = self.frequencies[term]
+            if term in removals:
+                rows, counts = _splice(rows, counts, removed=removals[term])
+            if deleted:
+                rows = array("I", map(new_ids.__getitem__, rows))
+            if term in additions:
+                rows, counts = _splice(rows, counts, added=additions.pop(term))
+            if rows:
+                index.postings[term] = rows
+                index.frequencies[term] = counts
+        for term, new_rows in additions.items():
+            index.postings[term], index.frequencies[term] = _splice(
+                array("I"), array("B"), added=new_rows
+            )
+        return index
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def search(self, terms, row_ids=None):
+        """
+        Find the products containing every one of the terms.
+
+        Args:
+            terms (tuple): Query terms, from query_terms()
+            row_ids (optional): Sorted row ids to search among (default: all
+                products)
+
+        Returns:
+            array: Sorted row ids of the matching products (none if there
+            are no terms)
+        """
+        if not terms:
+            return array("I")
+        # Start from the rarest term so every intersection is as small as
+        # possible
+        posting_lists = sorted(
+            (self.postings.get(term, array("I")) for term in terms), key=len
+        )
+        matches = posting_lists[0]
+        for rows in posting_lists[1:]:
+            matches = self._intersect(matches, rows)
+        if row_ids is not None and not isinstance(row_ids, range):
+            if len(row_ids) < len(matches):
+                matches = self._intersect(row_ids, matches)
+            else:
+                matches = self._intersect(matches, row_ids)
+        return array("I", matches)
+
+    def _intersect(self, small, large):
+        # Sorted row ids in both lists. A binary search per row of the small
+        # list is cheapest unless it is nearly as long as the large one.
+        if len(small) * len(large).bit_length() < len(large):
+            return intersect_posting_lists(small, large)
+        in_small = bytearray(len(self.lengths))
+        for row_id in small:
+            in_small[row_id] = 1
+        return array("I", compress(large, map(in_small.__getitem__, large)))
+
+    def _weights(self, term):
+        # The term's posting list and counts, plus the BM25 factors that don't
+        # depend on the product
+        rows = self.postings.get(term, ())
+        document_count = len(self.lengths)
+        idf = math.log(1 + (document_count - len(rows) + 0.5) / (len(rows) + 0.5))
+        average_length = self.total_length / document_count if document_count else 1
+        return rows, self.frequencies.get(term, ()), idf, K1 * B / (average_length or 1)
+
+    def rank(self, terms, row_ids):
+        """
+        Order matching products by relevance.
+
+        Args:
+            terms (tuple): Query terms, from query_terms()
+            row_ids: Sorted row ids of products containing every term (see
+                search())
+
+        Returns:
+            array: The row ids from most to least relevant. Products with
+            the same score stay in row id order.
+        """
+        scores = [0.0] * len(row_ids)
+        lengths = self.lengths
+        in_result = None
+        for term in terms:
+            rows, counts, idf, length_factor = self._weights(term)
+            if len(rows) == len(row_ids):
+                # Every product with the term matched
+                matched_counts = counts
+            elif len(row_ids) * len(rows).bit_length() < len(rows):
+                # Few matches: find each one's count with a binary search
+                matched_counts = []
+                position = 0
+                for row_id in row_ids:
+                    position = bisect_left(rows, row_id, position)
+                    matched_counts.append(counts[position])
+            else:
+                # Many matches: walk the posting list, keeping their counts
+                if in_result is None:
+                    in_result = bytearray(len(lengths))
+                    for row_id in row_ids:
+                        in_result[row_id] = 1
+                matched_counts = compress(counts, map(in_result.__getitem__, rows))
+            # The same sum, in the same order, as score()
+            scores = [
+                score
+                + idf * count * SATURATION / (count + (BASE_PENALTY + length_factor * lengths[row_id]))
+                for score, count, row_id in zip(scores, matched_counts, row_ids)
+            ]
+        # A stable sort, reversed, keeps equal scores in row id order
+        order = sorted(range(len(row_ids)), key=scores.__getitem__, reverse=True)
+        return array("I", [row_ids[i] for i in order])
+
+    def score(self, terms, row_id):
+        """
+        Get one product's relevance score, the same as rank() orders it by.
+
+        Args:
+            terms (tuple): Query terms, from query_terms()
+            row_id (int): The product's row id
+
+        Returns:
+            float: The product's BM25 score (0.0 if it doesn't contain every
+            term)
+        """
+        score = 0.0
+        for term in terms:
+            rows, counts, idf, length_factor = self._weights(term)
+            position = bisect_left(rows, row_id)
+            if position == len(rows) or rows[position] != row_id:
+                return 0.0
+            count = counts[position]
+            score = score + idf * count * SATURATION / (
+                count + (BASE_PENALTY + length_factor * self.lengths[row_id])
+            )
+        return score
+
+
+def _texts(product):
+    # The product's value for each field in FIELD_WEIGHTS
+    return [product.get(field) for field in FIELD_WEIGHTS]
+
+
+def _extend(values, more):
+    # Append an array, or a memoryview onto one (from a snapshot), in one copy
+    if isinstance(more, array):
+        values.extend(more)
+    else:
+        values.frombytes(memoryview(more).cast("B"))
+    return values
+
+
+def _splice(rows, counts, removed=(), added=()):
+    # Take row ids out of a posting list and put (row_id, count) pairs into
+    # it, keeping it sorted. Only the places that change are searched for;
+    # everything in between is copied a slice at a time.
+    edits = [(bisect_left(rows, row_id), 1, row_id, 0) for row_id in removed]
+    edits += [(bisect_left(rows, row_id), 0, row_id, count) for row_id, count in added]
+    # At the same position, new rows go before the row that is there
+    edits.sort()
+    new_rows, new_counts = array("I"), array("B")
+    start = 0
+    for position, is_removal, row_id, count in edits:
+        _extend(new_rows, rows[start:position])
+        _extend(new_counts, counts[start:position])
+        start = position
+        if is_removal:
+            start += 1
+        else:
+            new_rows.append(row_id)
+            new_counts.append(min(count, MAX_FREQUENCY))
+    _extend(new_rows, rows[start:])
+    _extend(new_counts, counts[start:])
+    return new_rows, new_counts